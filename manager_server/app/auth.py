@@ -2,9 +2,18 @@ import base64
 import hmac
 import hashlib
 import json
+import threading
 import time
+from collections import OrderedDict
 from typing import Dict, Any, Optional, Tuple
 
+# verify_cached: tokens remembered per process, and how long a result without exp is kept (s)
+TOKEN_CACHE_SIZE = 4096
+TOKEN_CACHE_TTL = 300
+
+_token_lock = threading.Lock()
+_tokens: "OrderedDict[str, tuple]" = OrderedDict()
+
 
 def _b64url_encode(data: bytes) -> str:
     return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
@@ -47,3 +56,24 @@ def decode_and_verify_jwt(token: str, secret: str, verify_exp: bool = True) -> T
         return payload, None
     except Exception as e:
         return None, str(e)
+
+
+def verify_cached(token: str, secret: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """decode_and_verify_jwt, computed once per token: the result is reused until the token's
+    exp (TOKEN_CACHE_TTL for failures and tokens without exp). Do not mutate the payload."""
+    now = time.time()
+    with _token_lock:
+        hit = _tokens.get(token)
+        if hit is not None and hit[2] > now:
+            _tokens.move_to_end(token)
+            return hit[0], hit[1]
+    payload, error = decode_and_verify_jwt(token, secret)
+    until = now + TOKEN_CACHE_TTL
+    if payload is not None and isinstance(payload, dict) and "exp" in payload:
+        until = int(payload["exp"]) + 1  # decode_and_verify_jwt accepts exp == now
+    with _token_lock:
+        _tokens[token] = (payload, error, until)
+        _tokens.move_to_end(token)
+        while len(_tokens) > TOKEN_CACHE_SIZE:
+            _tokens.popitem(last=False)
+    return payload, error
@@ -0,0 +1,174 @@
+"""Read-through response cache for hot read endpoints.
+
+    data = cache.get_or_load("users", "all", ttl=300, loader=lambda: ...)
+    cache.invalidate("users")             # from the crud write functions
+
+Entries live under a namespace whose generation number is part of every key, so
+invalidating a namespace is a single counter bump and stale entries simply age out.
+Concurrent misses of the same key are coalesced: one caller runs the loader, the
+others wait for its result (single-flight, per process). Values must be JSON-able
+(run jsonable_encoder in the loader).
+
+Backends (settings.cache_backend):
+  memory  per-process LRU (default); with several workers, invalidations are relayed to
+          the other workers over app/worker_bus.py
+  redis   shared by all workers (cache.redis_url, needs the optional `redis` package);
+          falls back to memory when redis is unavailable
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+from . import worker_bus
+from .config import get_settings
+
+try:
+    import redis  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    redis = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+_MISS = object()
+
+
+class MemoryBackend:
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return _MISS
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return _MISS
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def generation(self, namespace: str) -> int:
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def bump(self, namespace: str) -> None:
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+
+class RedisBackend:
+    def __init__(self, url: str, prefix: str = "kk:cache:"):
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._prefix = prefix
+
+    def get(self, key: str) -> Any:
+        raw = self._client.get(self._prefix + key)
+        return _MISS if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        raw = json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+        self._client.set(self._prefix + key, raw, px=max(1, int(ttl * 1000)))
+
+    def generation(self, namespace: str) -> int:
+        return int(self._client.get(self._prefix + "gen:" + namespace) or 0)
+
+    def bump(self, namespace: str) -> None:
+        self._client.incr(self._prefix + "gen:" + namespace)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_flights_lock = threading.Lock()
+_flights: Dict[str, threading.Lock] = {}
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                settings = get_settings()
+                if settings.cache_backend == "redis" and redis is not None and settings.cache_redis_url:
+                    _backend = RedisBackend(settings.cache_redis_url)
+                    logger.info("Response cache: redis %s", settings.cache_redis_url)
+                else:
+                    if settings.cache_backend == "redis":
+                        logger.warning("Response cache: redis unavailable, using in-process memory")
+                    _backend = MemoryBackend(settings.cache_max_entries)
+    return _backend
+
+
+def _safe(fn: Callable, default: Any) -> Any:
+    # a broken shared backend must degrade to "no cache", never fail the request
+    try:
+        return fn()
+    except Exception as e:
+        _stats["errors"] += 1
+        logger.warning("Response cache backend error: %s", e)
+        return default
+
+
+def get_or_load(namespace: str, key: str, ttl: float, loader: Callable[[], Any]) -> Any:
+    """Cached value of namespace/key, loading (once across concurrent callers) on a miss."""
+    if not get_settings().cache_enabled:
+        return loader()
+    be = backend()
+    full_key = f"{namespace}:{_safe(lambda: be.generation(namespace), 0)}:{key}"
+    value = _safe(lambda: be.get(full_key), _MISS)
+    if value is not _MISS:
+        _stats["hits"] += 1
+        return value
+    with _flights_lock:
+        flight = _flights.setdefault(full_key, threading.Lock())
+    waited = not flight.acquire(blocking=False)
+    if waited:
+        flight.acquire()
+    try:
+        if waited:
+            value = _safe(lambda: be.get(full_key), _MISS)
+            if value is not _MISS:
+                _stats["coalesced"] += 1
+                return value
+        _stats["misses"] += 1
+        value = loader()
+        _safe(lambda: be.set(full_key, value, ttl), None)
+        return value
+    finally:
+        flight.release()
+        with _flights_lock:
+            if _flights.get(full_key) is flight and not flight.locked():
+                del _flights[full_key]
+
+
+def _bump(namespaces) -> None:
+    be = backend()
+    for ns in namespaces:
+        _safe(lambda: be.bump(ns), None)
+
+
+def invalidate(*namespaces: str) -> None:
+    _bump(namespaces)
+    if isinstance(backend(), MemoryBackend):
+        worker_bus.publish("cache", list(namespaces))
+
+
+worker_bus.subscribe("cache", _bump)
+
+
+def stats() -> Dict[str, Any]:
+    return dict(_stats, backend=type(backend()).__name__)
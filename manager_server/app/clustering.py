@@ -0,0 +1,222 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from . import crud, geohash
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# aggregates are queried from the DB at this precision (~1.2 x 0.6 km); coarser levels roll up in memory
+BASE_PRECISION = 6
+# target on-screen width of a cluster cell
+_CELL_PX = 48
+_MAX_ENTRIES = 32
+
+
+class AlarmFilters(NamedTuple):
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    alarm_type: Optional[str] = None
+    process_status: Optional[str] = None
+    user_code: Optional[str] = None
+
+    def matches(self, row: dict) -> bool:
+        """Python mirror of crud._alarm_filter_conditions."""
+        if not row.get("geohash"):
+            return False
+        t = row.get("alarm_time")
+        if self.start_time and (t is None or _aware(t) < _aware(self.start_time)):
+            return False
+        if self.end_time and (t is None or _aware(t) > _aware(self.end_time)):
+            return False
+        if self.alarm_type and row.get("alarm_type") != self.alarm_type:
+            return False
+        if self.process_status:
+            if row.get("process_status") != self.process_status:
+                return False
+        elif row.get("process_status") == "auto_ignore":
+            return False
+        if self.user_code and row.get("user_code") != self.user_code:
+            return False
+        return True
+
+
+def _aware(dt: datetime) -> datetime:
+    # naive filter values are local time, as PostgreSQL interprets them for timestamptz
+    return dt if dt.tzinfo is not None else dt.astimezone()
+
+
+def precision_for_zoom(zoom: int) -> int:
+    """Finest geohash precision whose cells are still at least _CELL_PX wide at this zoom."""
+    world_px = 256.0 * (2 ** max(0, zoom))
+    best = 1
+    for p in range(1, BASE_PRECISION + 1):
+        w, _ = geohash.cell_size(p)
+        if w / 360.0 * world_px >= _CELL_PX:
+            best = p
+    return best
+
+
+class _Aggregate:
+    """Per-filter cell counts: levels[precision][cell] = [count, sum_lat, sum_lon, {type: count}]."""
+
+    def __init__(self, filters: AlarmFilters, rows, expires_at: float):
+        self.filters = filters
+        self.expires_at = expires_at
+        base: Dict[str, list] = {}
+        for cell, alarm_type, count, sum_lat, sum_lon in rows:
+            e = base.setdefault(cell, [0, 0.0, 0.0, {}])
+            e[0] += int(count)
+            e[1] += float(sum_lat or 0)
+            e[2] += float(sum_lon or 0)
+            e[3][alarm_type] = e[3].get(alarm_type, 0) + int(count)
+        self.levels: Dict[int, Dict[str, list]] = {BASE_PRECISION: base}
+        self.lock = threading.Lock()
+
+    def level(self, precision: int) -> Dict[str, list]:
+        with self.lock:
+            cells = self.levels.get(precision)
+            if cells is None:
+                cells = {}
+                for cell, (count, sum_lat, sum_lon, types) in self.levels[BASE_PRECISION].items():
+                    e = cells.setdefault(cell[:precision], [0, 0.0, 0.0, {}])
+                    e[0] += count
+                    e[1] += sum_lat
+                    e[2] += sum_lon
+                    for t, n in types.items():
+                        e[3][t] = e[3].get(t, 0) + n
+                self.levels[precision] = cells
+            return cells
+
+    def apply(self, row: dict, sign: int) -> None:
+        lat, lon = float(row["latitude"]), float(row["longitude"])
+        t = row.get("alarm_type")
+        with self.lock:
+            for precision, cells in self.levels.items():
+                key = row["geohash"][:precision]
+                e = cells.setdefault(key, [0, 0.0, 0.0, {}])
+                e[0] += sign
+                e[1] += sign * lat
+                e[2] += sign * lon
+                e[3][t] = e[3].get(t, 0) + sign
+                if e[3][t] <= 0:
+                    e[3].pop(t, None)
+                if e[0] <= 0:
+                    cells.pop(key, None)
+
+
+_lock = threading.Lock()
+_cache: "OrderedDict[AlarmFilters, _Aggregate]" = OrderedDict()
+_build_locks: Dict[AlarmFilters, threading.Lock] = {}
+_changes = 0
+
+
+def _on_alarm_change(old: Optional[dict], new: Optional[dict], change_id: Optional[int]) -> None:
+    global _changes
+    with _lock:
+        _changes += 1
+        entries = list(_cache.values())
+    for agg in entries:
+        if old is not None and agg.filters.matches(old):
+            agg.apply(old, -1)
+        if new is not None and agg.filters.matches(new):
+            agg.apply(new, +1)
+
+
+crud.add_alarm_listener(_on_alarm_change)
+
+
+def _get_aggregate(db: Session, filters: AlarmFilters) -> _Aggregate:
+    now = time.monotonic()
+    with _lock:
+        agg = _cache.get(filters)
+        if agg is not None and agg.expires_at > now:
+            _cache.move_to_end(filters)
+            return agg
+        build_lock = _build_locks.setdefault(filters, threading.Lock())
+    with build_lock:
+        with _lock:
+            agg = _cache.get(filters)
+            if agg is not None and agg.expires_at > time.monotonic():
+                return agg
+            seen = _changes
+        started = time.monotonic()
+        rows = crud.aggregate_alarm_cells(db, BASE_PRECISION, *filters)
+        ttl = max(1, get_settings().cluster_cache_ttl)
+        with _lock:
+            if _changes != seen:
+                # writes raced the aggregate query and may be counted twice or not at all; rebuild soon
+                ttl = min(ttl, 30)
+            agg = _Aggregate(filters, rows, time.monotonic() + ttl)
+            _cache[filters] = agg
+            _cache.move_to_end(filters)
+            while len(_cache) > _MAX_ENTRIES:
+                evicted, _ = _cache.popitem(last=False)
+                _build_locks.pop(evicted, None)
+        logger.info("Cluster aggregate built: cells=%s in %.3fs", len(agg.levels[BASE_PRECISION]), time.monotonic() - started)
+        return agg
+
+
+def clusters(
+    db: Session,
+    bbox: tuple,
+    zoom: int,
+    filters: AlarmFilters,
+) -> dict:
+    """Clusters inside bbox (min_lon, min_lat, max_lon, max_lat) at a map zoom level."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    precision = precision_for_zoom(zoom)
+    agg = _get_aggregate(db, filters)
+    out: List[dict] = []
+    total = 0
+    for cell, (count, sum_lat, sum_lon, types) in list(agg.level(precision).items()):
+        if count <= 0:
+            continue
+        lat, lon = sum_lat / count, sum_lon / count
+        if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+            continue
+        total += count
+        out.append({
+            "geohash": cell,
+            "count": count,
+            "latitude": round(lat, 7),
+            "longitude": round(lon, 7),
+            "types": dict(types),
+            "bbox": [round(v, 7) for v in geohash.bounds(cell)],
+        })
+    out.sort(key=lambda c: c["count"], reverse=True)
+    return {"mode": "clusters", "zoom": zoom, "precision": precision, "total": total, "clusters": out}
+
+
+def points(db: Session, bbox: tuple, zoom: int, filters: AlarmFilters, limit: int) -> dict:
+    rows = crud.query_alarm_points_in_bbox(db, *bbox, *filters, limit=limit + 1)
+    items = [
+        {
+            "alarm_id": r["alarm_id"],
+            "alarm_time": r["alarm_time"],
+            "longitude": float(r["longitude"]),
+            "latitude": float(r["latitude"]),
+            "alarm_type": r["alarm_type"],
+            "process_status": r["process_status"],
+        }
+        for r in rows[:limit]
+    ]
+    return {"mode": "points", "zoom": zoom, "total": len(items), "truncated": len(rows) > limit, "points": items}
+
+
+def parse_bbox(value: str) -> tuple:
+    """'min_lon,min_lat,max_lon,max_lat' -> floats; raises ValueError."""
+    parts = [float(v) for v in value.split(",")]
+    if len(parts) != 4 or not all(math.isfinite(v) for v in parts):
+        raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if min_lon > max_lon or min_lat > max_lat:
+        raise ValueError("bbox min must not exceed max")
+    return min_lon, min_lat, max_lon, max_lat
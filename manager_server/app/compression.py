@@ -0,0 +1,58 @@
+"""gzip for large JSON/text responses.
+
+Only complete responses are compressed: the first body message must carry the whole
+body (more_body false) and be at least minimum_size bytes. Streamed responses (SSE,
+CSV/NDJSON/zip exports, file downloads and ranges) and bodies that already have a
+Content-Encoding pass through untouched, so no event is held back in a buffer and
+images are not compressed twice.
+"""
+import gzip
+
+from starlette.datastructures import Headers, MutableHeaders
+
+COMPRESSIBLE = ("application/json", "text/")
+NOT_COMPRESSIBLE = ("text/event-stream",)
+
+
+def _compressible(content_type: str) -> bool:
+    ct = content_type.split(";", 1)[0].strip().lower()
+    return ct.startswith(COMPRESSIBLE) and not ct.startswith(NOT_COMPRESSIBLE)
+
+
+class GZipMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, compresslevel: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+        pending = {"start": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # held until the first body message shows whether the body is complete
+                pending["start"] = message
+                return
+            start, pending["start"] = pending["start"], None
+            if start is not None and message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                headers = MutableHeaders(raw=start["headers"])
+                if (
+                    not message.get("more_body", False)
+                    and len(body) >= self.minimum_size
+                    and "content-encoding" not in headers
+                    and _compressible(headers.get("content-type", ""))
+                ):
+                    body = gzip.compress(body, self.compresslevel)
+                    headers["Content-Encoding"] = "gzip"
+                    headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {**message, "body": body}
+            if start is not None:
+                await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
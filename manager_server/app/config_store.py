@@ -0,0 +1,124 @@
+"""In-process snapshot of config_kv, versioned by max(config_kv.version).
+
+Reads (GET /api/v1/config, /api/v1/config/{key}) are served from memory. The snapshot
+is reloaded when upsert_config commits: locally right away, in other workers through
+NOTIFY on the "config_kv" channel (app/pg_listener.py), with a cheap poll of
+(max, count, sum) of version as fallback. Versions come from a sequence, so a row
+whose version was taken earlier can commit later without moving max(version); the
+poll therefore compares the whole fingerprint, and a commit or NOTIFY always reloads.
+upsert_config also serializes writers (WRITE_LOCK_KEY) so versions commit in order and
+clients can long-poll GET /api/v1/config/changes?since=<version>.
+"""
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from . import models, pg_listener
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "config_kv"
+# pg_advisory_xact_lock key taken by crud.upsert_config
+WRITE_LOCK_KEY = 7_010_042
+
+_lock = threading.Lock()
+_items: Dict[str, dict] = {}
+_version = -1  # not loaded yet
+_fingerprint: Tuple[int, int, int] = (-1, -1, -1)
+_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+
+def _current_fingerprint(db) -> Tuple[int, int, int]:
+    v = models.ConfigKV.version
+    row = db.execute(select(func.coalesce(func.max(v), 0), func.count(), func.coalesce(func.sum(v), 0))).one()
+    return int(row[0]), int(row[1]), int(row[2])
+
+
+def refresh(force: bool = False) -> int:
+    """Reload the snapshot if the table fingerprint moved (or force); returns the version."""
+    global _items, _version, _fingerprint
+    db = SessionLocal()
+    try:
+        if not force and _current_fingerprint(db) == _fingerprint:
+            return _version
+        rows = db.execute(select(models.ConfigKV).order_by(models.ConfigKV.key.asc())).scalars().all()
+        items = {r.key: {"id": r.id, "key": r.key, "value": r.value} for r in rows}
+        # taken from the rows themselves: a write may have landed between the two queries
+        versions = [int(r.version) for r in rows]
+        fingerprint = (max(versions, default=0), len(versions), sum(versions))
+        version = fingerprint[0]
+    finally:
+        db.close()
+    with _lock:
+        changed = version != _version or items != _items
+        _items, _version, _fingerprint = items, version, fingerprint
+        waiters = list(_waiters) if changed else []
+        if changed:
+            _waiters.clear()
+    if changed:
+        logger.info("Config snapshot loaded: version=%s keys=%s", version, len(items))
+    for loop, fut in waiters:
+        try:
+            loop.call_soon_threadsafe(_wake, fut)
+        except RuntimeError:
+            pass  # loop closed
+    return version
+
+
+def _wake(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+def _ensure_loaded() -> None:
+    if _version < 0:
+        refresh()
+
+
+def version() -> int:
+    _ensure_loaded()
+    return _version
+
+
+def list_items() -> Tuple[int, List[dict]]:
+    _ensure_loaded()
+    with _lock:
+        return _version, list(_items.values())
+
+
+def get(key: str) -> Tuple[int, Optional[dict]]:
+    _ensure_loaded()
+    with _lock:
+        return _version, _items.get(key)
+
+
+async def wait_for_change(since: int, timeout: float) -> int:
+    """Wait (on the running loop) until the version differs from since, or timeout; returns it."""
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    with _lock:
+        if _version >= 0 and _version != since:
+            return _version
+        _waiters.append((loop, fut))
+    try:
+        await asyncio.wait_for(fut, timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        with _lock:
+            if (loop, fut) in _waiters:
+                _waiters.remove((loop, fut))
+    return _version
+
+
+def _on_notify(payload: str) -> None:
+    # the payload's version says nothing about which other writes are visible yet: always reload
+    refresh(force=True)
+
+
+def start_background() -> None:
+    pg_listener.subscribe(CHANNEL, _on_notify, on_idle=refresh)
@@ -1,15 +1,18 @@
-from typing import List, Optional
+from typing import Callable, Iterator, List, Optional
 import math
 import logging
+import threading
+import time
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_, func
+from sqlalchemy import select, update, and_, or_, func, tuple_
 from datetime import datetime
+from decimal import Decimal
 from . import models, schemas
 from .config import get_settings
-from imagededup.methods import WHash  # type: ignore
+from .database import on_primary
 from .mapfunc import baidu_reverse_geocode
+from . import cache, config_store, geohash, metrics, pg_listener, route_matching, whash, worker_bus
 from passlib.context import CryptContext
-_whash = WHash()
 
 # password hashing context for users
 pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -17,28 +20,140 @@ pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # module logger
 logger = logging.getLogger(__name__)
 
+# user_code -> {user_id, status} lookups (get_user_identity), seconds
+USER_IDENTITY_TTL = 600
+
 def _commit(db: Session, op: str) -> None:
+    t0 = time.perf_counter()
+    token = metrics.current_op.set(op)
     try:
         db.commit()
     except Exception:
+        metrics.observe_db_op(op, time.perf_counter() - t0, ok=False)
         try:
             db.rollback()
         except Exception:
             pass
         logger.exception("DB commit failed: %s", op)
         raise
+    finally:
+        metrics.current_op.reset(token)
+    metrics.observe_db_op(op, time.perf_counter() - t0)
 
 def _execute(db: Session, stmt, op: str):
+    t0 = time.perf_counter()
+    token = metrics.current_op.set(op)
     try:
-        return db.execute(stmt)
+        result = db.execute(stmt)
     except Exception:
+        metrics.observe_db_op(op, time.perf_counter() - t0, ok=False)
         logger.exception("DB execute failed: %s", op)
         raise
+    finally:
+        metrics.current_op.reset(token)
+    metrics.observe_db_op(op, time.perf_counter() - t0)
+    return result
+
+# callbacks(old, new, change_id) run after an alarm insert/update/delete commits; old/new are
+# column dicts (see _alarm_snapshot) or None for insert/delete. change_id is assigned once by the
+# committing worker (microsecond timestamp) and relayed with the change, so every worker sees the
+# same id for it (None for messages from a worker that predates it).
+_alarm_listeners: List[Callable[[Optional[dict], Optional[dict], Optional[int]], None]] = []
+_change_lock = threading.Lock()
+_last_change_id = 0
+
+
+def add_alarm_listener(fn: Callable[[Optional[dict], Optional[dict], Optional[int]], None]) -> None:
+    _alarm_listeners.append(fn)
+
+
+def _next_change_id() -> int:
+    global _last_change_id
+    with _change_lock:
+        _last_change_id = max(_last_change_id + 1, time.time_ns() // 1000)
+        return _last_change_id
+
+
+def _alarm_snapshot(alarm: models.AlarmInfo) -> dict:
+    return {c.name: getattr(alarm, c.name) for c in models.AlarmInfo.__table__.columns}
+
+
+def _revive_alarm_snapshot(row: Optional[dict]) -> Optional[dict]:
+    # snapshots relayed from another worker arrive as JSON: restore datetime/Decimal columns
+    if row is None:
+        return None
+    out = dict(row)
+    for c in models.AlarmInfo.__table__.columns:
+        v = out.get(c.name)
+        if not isinstance(v, str):
+            continue
+        if c.type.python_type is datetime:
+            out[c.name] = datetime.fromisoformat(v)
+        elif c.type.python_type is Decimal:
+            out[c.name] = Decimal(v)
+    return out
+
+
+# free-text columns (unbounded or up to 1024 mostly-CJK chars) stay out of worker-bus messages
+# (NOTIFY payload limit); the receiving worker reads them back from t_alarm_info
+_RELAY_OMITTED = ("process_opinion", "process_feedback", "address", "simple_address")
+# stands in for an omitted old value that differs from the new one
+RELAY_CHANGED = object()
+
+
+def _relay_snapshot(row: Optional[dict]) -> Optional[dict]:
+    if row is None:
+        return None
+    return {k: v for k, v in row.items() if k not in _RELAY_OMITTED}
+
+
+def _load_omitted(alarm_id: int) -> dict:
+    cols = [getattr(models.AlarmInfo, c) for c in _RELAY_OMITTED]
+    stmt = select(*cols).where(models.AlarmInfo.alarm_id == alarm_id)
+    row = on_primary(lambda db: db.execute(stmt).first())
+    # deleted meanwhile: the delete is relayed on its own
+    return dict(zip(_RELAY_OMITTED, row)) if row else dict.fromkeys(_RELAY_OMITTED)
+
+
+def _on_remote_alarm_change(data: dict) -> None:
+    old = _revive_alarm_snapshot(data.get("old"))
+    new = _revive_alarm_snapshot(data.get("new"))
+    omitted = dict.fromkeys(_RELAY_OMITTED)
+    if new is not None:
+        omitted = _load_omitted(new["alarm_id"])
+        new.update(omitted)
+    if old is not None:
+        changed = set(data.get("changed") or ())
+        for k in _RELAY_OMITTED:
+            old[k] = RELAY_CHANGED if k in changed else omitted[k]
+    _dispatch_alarm_change(old, new, data.get("id"))
+
+
+def _notify_alarm_change(old: Optional[dict], new: Optional[dict]) -> None:
+    cache.invalidate("alarms")
+    changed = [k for k in _RELAY_OMITTED if old is not None and new is not None and old.get(k) != new.get(k)]
+    change_id = _next_change_id()
+    worker_bus.publish("alarm", {
+        "id": change_id, "old": _relay_snapshot(old), "new": _relay_snapshot(new), "changed": changed,
+    })
+    _dispatch_alarm_change(old, new, change_id)
+
+
+def _dispatch_alarm_change(old: Optional[dict], new: Optional[dict], change_id: Optional[int]) -> None:
+    for fn in list(_alarm_listeners):
+        try:
+            fn(old, new, change_id)
+        except Exception:
+            logger.exception("Alarm listener failed: %s", getattr(fn, "__name__", fn))
+
+
+worker_bus.subscribe("alarm", _on_remote_alarm_change)
+
 
 def _hex_hamming_distance(h1: str, h2: str) -> int:
-    """Compute Hamming distance using WHash; if it fails, fallback to bitwise hex comparison."""
+    """Hamming distance of two WHash hex strings; None if either is not a valid hash."""
     try:
-        return int(_whash.hamming_distance(h1, h2))
+        return whash.hamming_distance(h1, h2)
     except Exception:
         pass
 
@@ -100,9 +215,25 @@ def need_alarm(db: Session, alarm: schemas.AlarmCreate) -> bool:
     return False
     
 
+def _route_match_values(db: Session, longitude, latitude) -> dict:
+    """route_id / route_offset_m / route_distance_m for a location (all None when unmatched)."""
+    m = None
+    try:
+        m = route_matching.match(longitude, latitude)
+    except Exception:
+        logger.exception("Route matching failed for (%s, %s)", longitude, latitude)
+    # the index directory may still hold a route deleted behind our back; keep the FK valid
+    if m is None or db.get(models.Route, m.route_id) is None:
+        return {"route_id": None, "route_offset_m": None, "route_distance_m": None}
+    return {"route_id": m.route_id, "route_offset_m": m.offset_m, "route_distance_m": m.distance_m}
+
+
 def create_alarm(db: Session, alarm: schemas.AlarmCreate, image_url: Optional[str]) -> models.AlarmInfo:
-    address = baidu_reverse_geocode(alarm.latitude, alarm.longitude)
+    with metrics.ALARM_STAGE.time(stage="geocode"):
+        address = baidu_reverse_geocode(alarm.latitude, alarm.longitude)
     addr = address or {}
+    with metrics.ALARM_STAGE.time(stage="route_match"):
+        matched = _route_match_values(db, alarm.longitude, alarm.latitude)
     db_alarm = models.AlarmInfo(
         alarm_time=alarm.alarm_time,
         longitude=alarm.longitude,
@@ -120,10 +251,14 @@ def create_alarm(db: Session, alarm: schemas.AlarmCreate, image_url: Optional[st
         user_code=alarm.user_code,
         address=addr.get("address"),
         simple_address=addr.get("simple_address"),
+        geohash=geohash.encode(alarm.latitude, alarm.longitude),
+        **matched,
     )
-    db.add(db_alarm)
-    _commit(db, "create_alarm.commit")
-    db.refresh(db_alarm)
+    with metrics.ALARM_STAGE.time(stage="insert"):
+        db.add(db_alarm)
+        _commit(db, "create_alarm.commit")
+        db.refresh(db_alarm)
+    _notify_alarm_change(None, _alarm_snapshot(db_alarm))
     return db_alarm
 
 
@@ -166,17 +301,29 @@ def query_alarms_by_process_status(db: Session, user_code: Optional[str], proces
     return list(_execute(db, stmt, "query_alarms_by_process_status").scalars().all())
 
 
-def query_alarms_filtered(
-    db: Session,
+# t_alarm_info columns behind schemas.AlarmRead, for the list queries that skip ORM instances
+ALARM_READ_COLUMNS = [c for c in models.AlarmInfo.__table__.columns if c.name in schemas.AlarmRead.model_fields]
+
+
+def query_alarm_rows_by_process_status(
+    db: Session, user_code: Optional[str], process_status: Optional[str], skip: int, limit: int
+) -> List[dict]:
+    """query_alarms_by_process_status as plain column mappings (see app/serialize.py)."""
+    stmt = select(*ALARM_READ_COLUMNS).where(models.AlarmInfo.process_status == process_status)
+    if user_code:
+        stmt = stmt.where(models.AlarmInfo.user_code == user_code)
+    stmt = stmt.order_by(models.AlarmInfo.alarm_time.desc()).offset(skip).limit(limit)
+    return list(_execute(db, stmt, "query_alarm_rows_by_process_status").mappings().all())
+
+
+def _alarm_filter_conditions(
     start_time: Optional[datetime],
     end_time: Optional[datetime],
     alarm_type: Optional[str],
     process_status: Optional[str],
     user_code: Optional[str],
-    skip: int,
-    limit: int,
-) -> List[models.AlarmInfo]:
-    stmt = select(models.AlarmInfo)
+) -> list:
+    """Shared WHERE conditions for the filtered alarm list, count and export."""
     conditions = []
     if start_time:
         conditions.append(models.AlarmInfo.alarm_time >= start_time)
@@ -191,12 +338,119 @@ def query_alarms_filtered(
         conditions.append(models.AlarmInfo.process_status != "auto_ignore")
     if user_code:
         conditions.append(models.AlarmInfo.user_code == user_code)
+    return conditions
+
+
+def query_alarms_filtered(
+    db: Session,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    alarm_type: Optional[str],
+    process_status: Optional[str],
+    user_code: Optional[str],
+    skip: int,
+    limit: int,
+) -> List[models.AlarmInfo]:
+    stmt = select(models.AlarmInfo)
+    conditions = _alarm_filter_conditions(start_time, end_time, alarm_type, process_status, user_code)
     if conditions:
         stmt = stmt.where(and_(*conditions))
     stmt = stmt.order_by(models.AlarmInfo.alarm_time.desc()).offset(skip).limit(limit)
     return list(_execute(db, stmt, "query_alarms_filtered").scalars().all())
 
 
+def query_alarm_rows_filtered(
+    db: Session,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    alarm_type: Optional[str],
+    process_status: Optional[str],
+    user_code: Optional[str],
+    skip: int,
+    limit: int,
+) -> List[dict]:
+    """query_alarms_filtered as plain column mappings (see app/serialize.py)."""
+    stmt = select(*ALARM_READ_COLUMNS)
+    conditions = _alarm_filter_conditions(start_time, end_time, alarm_type, process_status, user_code)
+    if conditions:
+        stmt = stmt.where(and_(*conditions))
+    stmt = stmt.order_by(models.AlarmInfo.alarm_time.desc()).offset(skip).limit(limit)
+    return list(_execute(db, stmt, "query_alarm_rows_filtered").mappings().all())
+
+
+# search texts behind the trigram GIN indexes (sql/migrations/0009_alarm_search_indexes.sql);
+# they must stay identical to the index expressions or the planner cannot use the indexes
+ALARM_ADDRESS_TEXT = func.coalesce(models.AlarmInfo.address, "") + " " + func.coalesce(models.AlarmInfo.simple_address, "")
+ALARM_NOTES_TEXT = func.coalesce(models.AlarmInfo.process_opinion, "") + " " + func.coalesce(models.AlarmInfo.process_feedback, "")
+ALARM_SEARCH_FIELDS = {
+    "address": (ALARM_ADDRESS_TEXT,),
+    "notes": (ALARM_NOTES_TEXT,),
+    "all": (ALARM_ADDRESS_TEXT, ALARM_NOTES_TEXT),
+}
+
+
+def _contains_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_alarm_rows(
+    db: Session,
+    terms: List[str],
+    fields: str,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    alarm_type: Optional[str],
+    process_status: Optional[str],
+    user_code: Optional[str],
+    after: Optional[tuple],
+    limit: int,
+) -> List[dict]:
+    """Alarms whose address and/or processing notes contain every term (case-insensitive),
+    with the list filters, newest first. Keyset pagination: after is the (alarm_time,
+    alarm_id) of the last row of the previous page."""
+    conditions = _alarm_filter_conditions(start_time, end_time, alarm_type, process_status, user_code)
+    for term in terms:
+        pattern = _contains_pattern(term)
+        conditions.append(or_(*(expr.ilike(pattern, escape="\\") for expr in ALARM_SEARCH_FIELDS[fields])))
+    if after is not None:
+        conditions.append(tuple_(models.AlarmInfo.alarm_time, models.AlarmInfo.alarm_id) < tuple_(*after))
+    stmt = (
+        select(*ALARM_READ_COLUMNS)
+        .where(and_(*conditions))
+        .order_by(models.AlarmInfo.alarm_time.desc(), models.AlarmInfo.alarm_id.desc())
+        .limit(limit)
+    )
+    return list(_execute(db, stmt, "search_alarm_rows").mappings().all())
+
+
+def iter_alarms_filtered(
+    db: Session,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    alarm_type: Optional[str],
+    process_status: Optional[str],
+    user_code: Optional[str],
+    batch_size: int = 1000,
+) -> Iterator[dict]:
+    """Stream alarms matching the same filters as query_alarms_filtered, without offset/limit.
+    Rows are plain column mappings fetched through a server-side cursor in batches of
+    batch_size, so memory stays constant regardless of the time range.
+    """
+    stmt = select(*models.AlarmInfo.__table__.columns)
+    conditions = _alarm_filter_conditions(start_time, end_time, alarm_type, process_status, user_code)
+    if conditions:
+        stmt = stmt.where(and_(*conditions))
+    stmt = stmt.order_by(models.AlarmInfo.alarm_time.desc(), models.AlarmInfo.alarm_id.desc())
+    stmt = stmt.execution_options(yield_per=max(1, int(batch_size)))
+    result = _execute(db, stmt, "iter_alarms_filtered")
+    try:
+        for row in result.mappings():
+            yield row
+    finally:
+        result.close()
+
+
 def count_alarms_filtered(
     db: Session,
     start_time: Optional[datetime],
@@ -206,28 +460,145 @@ def count_alarms_filtered(
     user_code: Optional[str],
 ) -> int:
     stmt = select(func.count()).select_from(models.AlarmInfo)
-    conditions = []
-    if start_time:
-        conditions.append(models.AlarmInfo.alarm_time >= start_time)
-    if end_time:
-        conditions.append(models.AlarmInfo.alarm_time <= end_time)
-    if alarm_type:
-        conditions.append(models.AlarmInfo.alarm_type == alarm_type)
+    conditions = _alarm_filter_conditions(start_time, end_time, alarm_type, process_status, user_code)
+    if conditions:
+        stmt = stmt.where(and_(*conditions))
+    return int(_execute(db, stmt, "count_alarms_filtered").scalar() or 0)
+
+
+def query_alarms_along_route(
+    db: Session,
+    route_id: int,
+    start_m: Optional[float],
+    end_m: Optional[float],
+    process_status: Optional[str],
+    skip: int,
+    limit: int,
+) -> List[models.AlarmInfo]:
+    """Alarms matched to route_id with chainage in [start_m, end_m], ordered along the route
+    (served by idx_alarm_route_offset)."""
+    conditions = [models.AlarmInfo.route_id == route_id]
+    if start_m is not None:
+        conditions.append(models.AlarmInfo.route_offset_m >= start_m)
+    if end_m is not None:
+        conditions.append(models.AlarmInfo.route_offset_m <= end_m)
     if process_status:
         conditions.append(models.AlarmInfo.process_status == process_status)
-    else:
-        conditions.append(models.AlarmInfo.process_status != "auto_ignore")
-    if user_code:
-        conditions.append(models.AlarmInfo.user_code == user_code)
+    stmt = (
+        select(models.AlarmInfo)
+        .where(and_(*conditions))
+        .order_by(models.AlarmInfo.route_offset_m.asc(), models.AlarmInfo.alarm_id.asc())
+        .offset(skip)
+        .limit(limit)
+    )
+    return list(_execute(db, stmt, "query_alarms_along_route").scalars().all())
+
+
+def aggregate_alarm_cells(
+    db: Session,
+    precision: int,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    alarm_type: Optional[str],
+    process_status: Optional[str],
+    user_code: Optional[str],
+) -> list[tuple]:
+    """(geohash prefix, alarm_type, count, sum(latitude), sum(longitude)) for filtered alarms."""
+    cell = func.substr(models.AlarmInfo.geohash, 1, precision).label("cell")
+    stmt = select(
+        cell,
+        models.AlarmInfo.alarm_type,
+        func.count(),
+        func.sum(models.AlarmInfo.latitude),
+        func.sum(models.AlarmInfo.longitude),
+    ).where(models.AlarmInfo.geohash.is_not(None))
+    conditions = _alarm_filter_conditions(start_time, end_time, alarm_type, process_status, user_code)
     if conditions:
         stmt = stmt.where(and_(*conditions))
-    return int(_execute(db, stmt, "count_alarms_filtered").scalar() or 0)
+    stmt = stmt.group_by(cell, models.AlarmInfo.alarm_type)
+    return list(_execute(db, stmt, "aggregate_alarm_cells").all())
+
+
+def query_alarm_points_in_bbox(
+    db: Session,
+    min_lon: float,
+    min_lat: float,
+    max_lon: float,
+    max_lat: float,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    alarm_type: Optional[str],
+    process_status: Optional[str],
+    user_code: Optional[str],
+    limit: int,
+) -> list:
+    """Individual alarms inside a bbox (newest first); geohash prefixes narrow the index scan."""
+    prefixes = [p for p in geohash.cover(min_lon, min_lat, max_lon, max_lat) if p]
+    stmt = select(
+        models.AlarmInfo.alarm_id,
+        models.AlarmInfo.alarm_time,
+        models.AlarmInfo.longitude,
+        models.AlarmInfo.latitude,
+        models.AlarmInfo.alarm_type,
+        models.AlarmInfo.process_status,
+    )
+    conditions = _alarm_filter_conditions(start_time, end_time, alarm_type, process_status, user_code)
+    if prefixes:
+        conditions.append(or_(*[models.AlarmInfo.geohash.like(p + "%") for p in prefixes]))
+    conditions += [
+        models.AlarmInfo.longitude >= min_lon,
+        models.AlarmInfo.longitude <= max_lon,
+        models.AlarmInfo.latitude >= min_lat,
+        models.AlarmInfo.latitude <= max_lat,
+    ]
+    stmt = stmt.where(and_(*conditions)).order_by(models.AlarmInfo.alarm_time.desc()).limit(limit)
+    return list(_execute(db, stmt, "query_alarm_points_in_bbox").mappings().all())
+
+
+def list_alarms_without_geohash(db: Session, limit: int) -> list[tuple]:
+    stmt = (
+        select(models.AlarmInfo.alarm_id, models.AlarmInfo.longitude, models.AlarmInfo.latitude)
+        .where(models.AlarmInfo.geohash.is_(None))
+        .order_by(models.AlarmInfo.alarm_id.asc())
+        .limit(limit)
+    )
+    return list(_execute(db, stmt, "list_alarms_without_geohash").all())
+
+
+def list_alarm_locations(db: Session, after_id: int, limit: int, unmatched_only: bool = True) -> list[tuple]:
+    """(alarm_id, longitude, latitude) batches in alarm_id order, for route-match backfill."""
+    stmt = select(models.AlarmInfo.alarm_id, models.AlarmInfo.longitude, models.AlarmInfo.latitude).where(
+        models.AlarmInfo.alarm_id > after_id
+    )
+    if unmatched_only:
+        stmt = stmt.where(models.AlarmInfo.route_id.is_(None))
+    stmt = stmt.order_by(models.AlarmInfo.alarm_id.asc()).limit(limit)
+    return list(_execute(db, stmt, "list_alarm_locations").all())
+
+
+def set_alarm_route_matches(db: Session, rows: List[dict]) -> None:
+    """Bulk UPDATE by primary key; rows are {alarm_id, route_id, route_offset_m, route_distance_m}."""
+    if not rows:
+        return
+    db.execute(update(models.AlarmInfo), rows)
+    _commit(db, "set_alarm_route_matches.commit")
+    cache.invalidate("alarms")
+
+
+def set_alarm_geohashes(db: Session, rows: List[dict]) -> None:
+    """Bulk UPDATE by primary key; rows are {alarm_id, geohash}."""
+    if not rows:
+        return
+    db.execute(update(models.AlarmInfo), rows)
+    _commit(db, "set_alarm_geohashes.commit")
+    cache.invalidate("alarms")
 
 
 def update_alarm_process(db: Session, alarm_id: int, body: schemas.AlarmProcessUpdate, header_user_code: Optional[str] = None) -> Optional[models.AlarmInfo]:
     alarm = db.get(models.AlarmInfo, alarm_id)
     if not alarm:
         return None
+    before = _alarm_snapshot(alarm)
     # apply updates from body
     if body.process_status is not None:
         alarm.process_status = body.process_status
@@ -238,10 +609,9 @@ def update_alarm_process(db: Session, alarm_id: int, body: schemas.AlarmProcessU
             alarm.process_opinion_person = body.process_opinion_person
         elif header_user_code and not alarm.process_opinion_person:
             try:
-                stmt = select(models.User).where(models.User.user_code == header_user_code)
-                user = _execute(db, stmt, "update_alarm_process.fetch_user_by_code").scalars().first()
+                user = get_user_identity(db, header_user_code)
                 if user is not None:
-                    alarm.process_opinion_person = int(getattr(user, "user_id"))
+                    alarm.process_opinion_person = int(user["user_id"])
             except Exception:
                 pass
     if body.process_feedback is not None:
@@ -251,10 +621,9 @@ def update_alarm_process(db: Session, alarm_id: int, body: schemas.AlarmProcessU
             alarm.process_feedback_person = body.process_feedback_person
         elif header_user_code and not alarm.process_feedback_person:
             try:
-                stmt = select(models.User).where(models.User.user_code == header_user_code)
-                user = _execute(db, stmt, "update_alarm_process.fetch_user_by_code").scalars().first()
+                user = get_user_identity(db, header_user_code)
                 if user is not None:
-                    alarm.process_feedback_person = int(getattr(user, "user_id"))
+                    alarm.process_feedback_person = int(user["user_id"])
             except Exception:
                 pass
     # persist header user_code onto the alarm record if provided
@@ -263,6 +632,7 @@ def update_alarm_process(db: Session, alarm_id: int, body: schemas.AlarmProcessU
     db.add(alarm)
     _commit(db, "update_alarm_process.commit")
     db.refresh(alarm)
+    _notify_alarm_change(before, _alarm_snapshot(alarm))
     return alarm
 
 
@@ -272,19 +642,24 @@ def query_device_id_by_ip(db: Session, device_ip: str) -> Optional[int]:
 
 
 def upsert_config(db: Session, key: str, value: Optional[str]) -> models.ConfigKV:
+    # one config writer at a time until commit, so versions (sequence values) commit in order
+    _execute(db, select(func.pg_advisory_xact_lock(config_store.WRITE_LOCK_KEY)), "upsert_config.lock")
     stmt = select(models.ConfigKV).where(models.ConfigKV.key == key)
     existing = _execute(db, stmt, "upsert_config.select").scalars().first()
     if existing:
         existing.value = value
-        db.add(existing)
-        _commit(db, "upsert_config.update.commit")
-        db.refresh(existing)
-        return existing
-    new_item = models.ConfigKV(key=key, value=value)
-    db.add(new_item)
-    _commit(db, "upsert_config.insert.commit")
-    db.refresh(new_item)
-    return new_item
+        existing.version = models.config_version_seq.next_value()
+        item = existing
+    else:
+        item = models.ConfigKV(key=key, value=value)
+    db.add(item)
+    db.flush()
+    # delivered to every worker's config_store when the transaction commits
+    pg_listener.notify(db, config_store.CHANNEL, str(item.version))
+    _commit(db, "upsert_config.commit")
+    db.refresh(item)
+    config_store.refresh(force=True)
+    return item
 
 
 def stats_today_hourly(db: Session) -> list[tuple]:
@@ -320,6 +695,39 @@ def get_alarm_image_urls_by_ids(db: Session, ids: List[int]) -> List[str]:
     return [row[0] for row in _execute(db, stmt, "get_alarm_image_urls_by_ids").all() if row[0]]
 
 
+# hot-tier image paths; repeated verbatim in queries so the planner matches idx_alarm_hot_image
+HOT_IMAGE = models.AlarmInfo.image_url.like("alarms/%")
+
+
+def list_archive_candidates(db: Session, cutoff: datetime, after_url: str, limit: int) -> list[tuple]:
+    """Distinct hot-tier image_url values (uploads/alarms) whose alarms are all older than cutoff.
+    Returns (image_url, first_alarm_time) ordered by image_url, starting after after_url.
+    Walks idx_alarm_hot_image (partial on HOT_IMAGE) from after_url, so a pass reads each hot
+    row about once instead of aggregating the whole table per batch.
+    """
+    first_time = func.min(models.AlarmInfo.alarm_time)
+    stmt = (
+        select(models.AlarmInfo.image_url, first_time)
+        .where(HOT_IMAGE)
+        .where(models.AlarmInfo.image_url > after_url)
+        .group_by(models.AlarmInfo.image_url)
+        .having(func.max(models.AlarmInfo.alarm_time) < cutoff)
+        .order_by(models.AlarmInfo.image_url.asc())
+        .limit(limit)
+    )
+    return list(_execute(db, stmt, "list_archive_candidates").all())
+
+
+def repoint_alarm_images(db: Session, old_url: str, new_url: str) -> int:
+    """Point every alarm using the hot-tier old_url at new_url (uncommitted); returns affected rows."""
+    stmt = (
+        update(models.AlarmInfo)
+        .where(models.AlarmInfo.image_url == old_url, HOT_IMAGE)
+        .values(image_url=new_url)
+    )
+    return int(_execute(db, stmt, "repoint_alarm_images").rowcount or 0)
+
+
 def delete_alarms_by_ids(db: Session, ids: List[int]) -> int:
     if not ids:
         return 0
@@ -327,9 +735,12 @@ def delete_alarms_by_ids(db: Session, ids: List[int]) -> int:
     # Simpler: load primary keys then delete individually
     stmt = select(models.AlarmInfo).where(models.AlarmInfo.alarm_id.in_(ids))
     items = list(_execute(db, stmt, "delete_alarms_by_ids.select").scalars().all())
+    removed = [_alarm_snapshot(it) for it in items]
     for it in items:
         db.delete(it)
     _commit(db, "delete_alarms_by_ids.commit")
+    for snap in removed:
+        _notify_alarm_change(snap, None)
     return len(items)
 
 
@@ -371,6 +782,7 @@ def update_route(db: Session, route_id: int, body: schemas.RouteUpdate, new_file
         item.route_format = body.route_format
     if new_file_path is not None:
         item.route_file_path = new_file_path
+    item.update_time = datetime.now()
     db.add(item)
     db.commit()
     db.refresh(item)
@@ -414,6 +826,7 @@ def create_user(db: Session, body: schemas.UserCreate) -> models.User:
     )
     db.add(user)
     db.commit()
+    cache.invalidate("users")
     db.refresh(user)
     return user
 
@@ -454,8 +867,10 @@ def update_user(db: Session, user_id: int, body: schemas.UserUpdate) -> Optional
         user.status = body.status
     if body.ext_info is not None:
         user.ext_info = None if (body.ext_info == "") else body.ext_info
+    user.update_time = datetime.now()
     db.add(user)
     db.commit()
+    cache.invalidate("users")
     db.refresh(user)
     return user
 
@@ -466,9 +881,21 @@ def delete_user(db: Session, user_id: int) -> bool:
         return False
     db.delete(user)
     db.commit()
+    cache.invalidate("users")
     return True
 
 
+def get_user_identity(db: Session, user_code: str) -> Optional[dict]:
+    """{"user_id", "status"} for a user_code (None if unknown). Served from the response cache
+    (namespace "users", so create/update/delete_user drop it) to keep auth paths off the DB."""
+    def load():
+        stmt = select(models.User.user_id, models.User.status).where(models.User.user_code == user_code)
+        row = _execute(db, stmt, "get_user_identity").first()
+        return {"user_id": row[0], "status": row[1]} if row else None
+
+    return cache.get_or_load("users", f"identity:{user_code}", USER_IDENTITY_TTL, load)
+
+
 # Lightweight list of all users (id and code and name)
 def get_all_users(db: Session) -> List[dict]:
     stmt = select(models.User.user_id, models.User.user_code, models.User.user_name).order_by(models.User.user_id.asc())
@@ -520,6 +947,7 @@ def create_device(db: Session, body: schemas.DeviceCreate) -> models.Device:
     )
     db.add(item)
     _commit(db, "create_device.commit")
+    cache.invalidate("devices")
     db.refresh(item)
     return item
 
@@ -563,6 +991,7 @@ def update_device(db: Session, device_id: int, body: schemas.DeviceUpdate) -> Op
     item.update_time = datetime.now()
     db.add(item)
     _commit(db, "update_device.commit")
+    cache.invalidate("devices")
     db.refresh(item)
     return item
 
@@ -573,4 +1002,5 @@ def delete_device(db: Session, device_id: int) -> bool:
         return False
     db.delete(item)
     _commit(db, "delete_device.commit")
+    cache.invalidate("devices")
     return True
@@ -1,16 +1,76 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+import itertools
+import logging
+import math
+import threading
+import time
+from typing import Callable, List, Optional, TypeVar
+
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker, DeclarativeBase
+from sqlalchemy.pool import NullPool, QueuePool
 from .config import get_settings
+from . import metrics
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports how long checkouts wait for a free connection."""
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.POOL_CHECKOUT_WAIT.observe(time.perf_counter() - t0)
+
+
+def _worker_share(total: int, minimum: int) -> int:
+    # config.yaml sizes the pool for the whole server; split it across worker processes
+    return max(minimum, math.ceil(total / settings.workers))
+
 
 engine = create_engine(
     settings.sqlalchemy_url,
+    poolclass=TimedQueuePool,
     pool_pre_ping=True,
-    pool_size=settings.pool_size,
-    max_overflow=settings.max_overflow,
+    pool_size=_worker_share(settings.pool_size, 1),
+    max_overflow=_worker_share(settings.max_overflow, 0),
     pool_recycle=settings.pool_recycle,
 )
+metrics.register_pool(engine)
+
+# long-lived per-process connections (LISTEN, leader lock) stay out of the request pool
+dedicated_engine = create_engine(settings.sqlalchemy_url, poolclass=NullPool)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics.observe_statement(statement, time.perf_counter() - conn.info["query_start"].pop())
+
+
+def _handle_error(ctx) -> None:
+    # a failed statement never reaches after_cursor_execute: drop its start time so the stack
+    # on this (pooled) connection stays paired
+    starts = ctx.connection.info.get("query_start") if ctx.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def _instrument(e) -> None:
+    event.listen(e, "before_cursor_execute", _before_cursor_execute)
+    event.listen(e, "after_cursor_execute", _after_cursor_execute)
+    event.listen(e, "handle_error", _handle_error)
+
+
+_instrument(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -25,3 +85,154 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# (in recovery, WAL receiver running, caught up, seconds since the last replayed transaction).
+# Caught up means replayed past the primary's position read just before (:primary_lsn), so an idle
+# primary does not look like lag; without that position, receive = replay is used. A standby whose
+# receiver is gone has also replayed everything it received, so that alone does not mean current.
+REPLICA_STATE_SQL = text(
+    "SELECT pg_is_in_recovery(), "
+    "EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status IS NULL OR status = 'streaming'), "
+    "COALESCE(pg_last_wal_replay_lsn() >= CAST(:primary_lsn AS pg_lsn), "
+    "pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn(), false), "
+    "COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+)
+REPLICA_CONNECT_TIMEOUT = 3
+
+
+class ReadReplica:
+    """One database.read_urls entry: its own pool plus the result of the last health check."""
+
+    def __init__(self, url: str):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine = create_engine(
+            url,
+            poolclass=TimedQueuePool,
+            pool_pre_ping=True,
+            pool_size=_worker_share(settings.pool_size, 1),
+            max_overflow=_worker_share(settings.max_overflow, 0),
+            pool_recycle=settings.pool_recycle,
+            connect_args={"connect_timeout": REPLICA_CONNECT_TIMEOUT},
+        )
+        _instrument(self.engine)
+        self.sessionmaker = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # unused until the first check passes
+        self.healthy = False
+        self.lag: Optional[float] = None
+
+    def check(self, primary_lsn: Optional[str] = None) -> None:
+        try:
+            with self.engine.connect() as conn:
+                in_recovery, receiving, caught_up, since_replay = conn.execute(
+                    REPLICA_STATE_SQL, {"primary_lsn": primary_lsn}
+                ).one()
+        except Exception as e:
+            self.mark_down(e)
+            return
+        if in_recovery and not receiving:
+            # disconnected from the primary: arbitrarily stale however small its replay gap looks
+            self.mark_down(RuntimeError("WAL receiver is not streaming"))
+            return
+        lag = 0.0 if not in_recovery or caught_up else float(since_replay or 0)
+        self.lag = lag
+        healthy = lag <= settings.read_max_lag
+        if healthy != self.healthy:
+            logger.info("Read replica %s %s (lag %.1fs)", self.name, "in use" if healthy else "lagging, skipped", lag)
+        self.healthy = healthy
+
+    def mark_down(self, error: Exception) -> None:
+        if self.healthy:
+            logger.warning("Read replica %s unavailable, reads fall back: %s", self.name, error)
+        self.healthy = False
+        self.lag = None
+
+
+read_replicas: List[ReadReplica] = [ReadReplica(url) for url in settings.read_urls]
+_next_replica = itertools.count()
+_checks_started = False
+
+
+def _replica_stats() -> dict:
+    out = {}
+    for r in read_replicas:
+        out[(r.name, "healthy")] = 1 if r.healthy else 0
+        out[(r.name, "lag_seconds")] = r.lag if r.lag is not None else -1
+    return out
+
+
+if read_replicas:
+    metrics.Gauge("db_read_replica", "Read replica state (healthy 0/1, lag_seconds, -1 when unknown)", ("replica", "state"), fn=_replica_stats)
+
+
+def _primary_lsn() -> Optional[str]:
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT pg_current_wal_lsn()::text")).scalar()
+    except Exception:
+        logger.warning("Primary WAL position unavailable for the replica check", exc_info=True)
+        return None
+
+
+def check_replicas() -> None:
+    # read before the replicas, so "caught up" never credits WAL written after this point
+    primary_lsn = _primary_lsn()
+    for r in read_replicas:
+        r.check(primary_lsn)
+
+
+def _check_replicas_forever() -> None:
+    while True:
+        time.sleep(settings.read_check_interval)
+        check_replicas()
+
+
+def start_replica_checks() -> None:
+    """The first check runs inline so requests are routed to replicas from the start."""
+    global _checks_started
+    if not read_replicas or _checks_started:
+        return
+    _checks_started = True
+    check_replicas()
+    t = threading.Thread(target=_check_replicas_forever, name="read-replica-check", daemon=True)
+    t.start()
+    logger.info("Started background task: read-replica-check (%s replicas)", len(read_replicas))
+
+
+def read_session() -> Session:
+    """Session for read-only work: the healthy replicas in turn, else the primary.
+    Connects up front so a replica that just went away falls back here instead of
+    failing the request."""
+    healthy = [r for r in read_replicas if r.healthy]
+    if healthy:
+        start = next(_next_replica)
+        for i in range(len(healthy)):
+            replica = healthy[(start + i) % len(healthy)]
+            db = replica.sessionmaker()
+            try:
+                db.connection()
+                return db
+            except exc.DBAPIError as e:
+                db.close()
+                replica.mark_down(e)
+    return SessionLocal()
+
+
+def on_primary(fn: Callable[[Session], T]) -> T:
+    """Run fn(db) on a primary session. For cache loaders: right after cache.invalidate() a
+    lagging replica can still return the pre-write rows, which would then stay cached under
+    the new generation for the whole TTL."""
+    db = SessionLocal()
+    try:
+        return fn(db)
+    finally:
+        db.close()
+
+
+def get_read_db():
+    """get_db for list, stats and export endpoints; may be served by a replica, so never write with it."""
+    db = read_session()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -1,8 +1,21 @@
-from typing import Optional, Dict
-from fastapi import Header, Request
+from typing import Optional, Dict, Any
+from fastapi import Depends, Header, Request
+from sqlalchemy.orm import Session
 
+from . import auth, crud
+from .config import get_settings
+from .database import get_db
 
-def parse_auth(request: Request, authorization: Optional[str] = Header(default=None), x_user_code: Optional[str] = Header(default=None)) -> Dict[str, Optional[str]]:
+
+def parse_auth(
+    request: Request,
+    authorization: Optional[str] = Header(default=None),
+    x_user_code: Optional[str] = Header(default=None),
+    db: Session = Depends(get_db),
+) -> Dict[str, Any]:
+    """Header auth for the API routers. A bearer token is verified once per token (cached until
+    its exp, auth.verify_cached) and its user checked against the cached identity of its user_code;
+    the outcome is recorded, not enforced: claims/user_id are None and token_error says why."""
     token = None
     if authorization:
         parts = authorization.split()
@@ -10,5 +23,22 @@ def parse_auth(request: Request, authorization: Optional[str] = Header(default=N
             token = parts[1]
         else:
             token = authorization
-    request.state.auth = {"token": token, "user_code": x_user_code}
+    claims, error, user_id = None, None, None
+    if token:
+        claims, error = auth.verify_cached(token, get_settings().jwt_secret)
+        if claims is not None:
+            user = crud.get_user_identity(db, str(claims.get("user_code"))) if isinstance(claims, dict) else None
+            if user is None:
+                claims, error = None, "unknown user"
+            elif user["status"] == "disabled":
+                claims, error = None, "user disabled"
+            else:
+                user_id = user["user_id"]
+    request.state.auth = {
+        "token": token,
+        "user_code": x_user_code,
+        "claims": claims,
+        "user_id": user_id,
+        "token_error": error,
+    }
     return request.state.auth
@@ -0,0 +1,306 @@
+"""Device metric history: raw samples plus 1-minute / 1-hour rollups.
+
+Samples are taken from the system_info snapshot each device reports in device_info
+(cpu/memory/gpus, see ranqi_server/system_info.py), at most one per device every
+device_metric_interval seconds, buffered and inserted in batches. A background loop
+rolls closed minutes of raw samples into step=60 rows and closed hours of those into
+step=3600 rows (idempotent upserts), then drops data older than each tier's retention.
+Range queries pick the finest tier that answers within max_points per device.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from . import leader, models
+from .config import get_settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+RAW = "raw"
+STEPS = {"1m": 60, "1h": 3600}
+SAMPLE_FIELDS = ("cpu_percent", "mem_percent", "mem_used_mb", "gpu_util", "gpu_mem_percent")
+ROLLUP_FIELDS = ("samples", "cpu_avg", "cpu_max", "mem_avg", "mem_max", "mem_used_avg",
+                 "gpu_util_avg", "gpu_util_max", "gpu_mem_avg", "gpu_mem_max")
+
+_ROLLUP_1M = text("""
+INSERT INTO t_device_metric_rollup
+    (device_id, step, bucket, samples, cpu_avg, cpu_max, mem_avg, mem_max, mem_used_avg,
+     gpu_util_avg, gpu_util_max, gpu_mem_avg, gpu_mem_max)
+SELECT device_id, 60, date_trunc('minute', ts AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', count(*),
+       avg(cpu_percent), max(cpu_percent), avg(mem_percent), max(mem_percent), avg(mem_used_mb),
+       avg(gpu_util), max(gpu_util), avg(gpu_mem_percent), max(gpu_mem_percent)
+FROM t_device_metric
+WHERE ts >= :start AND ts < :end
+GROUP BY 1, 3
+ON CONFLICT (device_id, step, bucket) DO UPDATE SET
+    samples = EXCLUDED.samples, cpu_avg = EXCLUDED.cpu_avg, cpu_max = EXCLUDED.cpu_max,
+    mem_avg = EXCLUDED.mem_avg, mem_max = EXCLUDED.mem_max, mem_used_avg = EXCLUDED.mem_used_avg,
+    gpu_util_avg = EXCLUDED.gpu_util_avg, gpu_util_max = EXCLUDED.gpu_util_max,
+    gpu_mem_avg = EXCLUDED.gpu_mem_avg, gpu_mem_max = EXCLUDED.gpu_mem_max
+""")
+
+# hourly averages are weighted by the number of raw samples behind each minute
+_ROLLUP_1H = text("""
+INSERT INTO t_device_metric_rollup
+    (device_id, step, bucket, samples, cpu_avg, cpu_max, mem_avg, mem_max, mem_used_avg,
+     gpu_util_avg, gpu_util_max, gpu_mem_avg, gpu_mem_max)
+SELECT device_id, 3600, date_trunc('hour', bucket AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', sum(samples),
+       sum(cpu_avg * samples) / nullif(sum(CASE WHEN cpu_avg IS NOT NULL THEN samples END), 0), max(cpu_max),
+       sum(mem_avg * samples) / nullif(sum(CASE WHEN mem_avg IS NOT NULL THEN samples END), 0), max(mem_max),
+       sum(mem_used_avg * samples) / nullif(sum(CASE WHEN mem_used_avg IS NOT NULL THEN samples END), 0),
+       sum(gpu_util_avg * samples) / nullif(sum(CASE WHEN gpu_util_avg IS NOT NULL THEN samples END), 0), max(gpu_util_max),
+       sum(gpu_mem_avg * samples) / nullif(sum(CASE WHEN gpu_mem_avg IS NOT NULL THEN samples END), 0), max(gpu_mem_max)
+FROM t_device_metric_rollup
+WHERE step = 60 AND bucket >= :start AND bucket < :end
+GROUP BY 1, 3
+ON CONFLICT (device_id, step, bucket) DO UPDATE SET
+    samples = EXCLUDED.samples, cpu_avg = EXCLUDED.cpu_avg, cpu_max = EXCLUDED.cpu_max,
+    mem_avg = EXCLUDED.mem_avg, mem_max = EXCLUDED.mem_max, mem_used_avg = EXCLUDED.mem_used_avg,
+    gpu_util_avg = EXCLUDED.gpu_util_avg, gpu_util_max = EXCLUDED.gpu_util_max,
+    gpu_mem_avg = EXCLUDED.gpu_mem_avg, gpu_mem_max = EXCLUDED.gpu_mem_max
+""")
+
+
+def _num(v) -> Optional[float]:
+    try:
+        return None if v is None else float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _max(values) -> Optional[float]:
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def extract_sample(info: Any) -> Optional[Dict[str, Optional[float]]]:
+    """Fixed metric columns from a system_info snapshot; None when it carries no metrics."""
+    if not isinstance(info, dict):
+        return None
+    cpu = info.get("cpu") if isinstance(info.get("cpu"), dict) else {}
+    mem = info.get("memory") if isinstance(info.get("memory"), dict) else {}
+    gpus = [g for g in (info.get("gpus") or []) if isinstance(g, dict)]
+    used = _num(mem.get("used"))
+    sample = {
+        "cpu_percent": _num(cpu.get("percent")),
+        "mem_percent": _num(mem.get("percent")),
+        "mem_used_mb": used / (1024 * 1024) if used is not None else None,
+        # the busiest GPU is the one that drops frames
+        "gpu_util": _max(_num(g.get("util_percent")) for g in gpus),
+        "gpu_mem_percent": _max(_num(g.get("memory_percent")) for g in gpus),
+    }
+    if all(v is None for v in sample.values()):
+        return None
+    return sample
+
+
+_lock = threading.Lock()
+_buffer: List[Dict[str, Any]] = []
+_last_sample: Dict[int, float] = {}
+_watermarks: Dict[int, datetime] = {}
+
+
+def record(device_id: int, info: Any) -> bool:
+    """Buffer one sample from a device report (rate-limited per device); returns True if kept."""
+    now = time.monotonic()
+    interval = max(1, get_settings().device_metric_interval)
+    with _lock:
+        if now - _last_sample.get(device_id, -interval) < interval:
+            return False
+    sample = extract_sample(info)
+    if sample is None:
+        return False
+    sample["device_id"] = device_id
+    sample["ts"] = datetime.now(timezone.utc)
+    with _lock:
+        _last_sample[device_id] = now
+        _buffer.append(sample)
+    return True
+
+
+def flush_samples() -> int:
+    with _lock:
+        rows = list(_buffer)
+        _buffer.clear()
+    if not rows:
+        return 0
+    db = SessionLocal()
+    try:
+        # devices deleted meanwhile would fail the FK; keep only existing ones
+        ids = {r["device_id"] for r in rows}
+        alive = {d for (d,) in db.query(models.Device.device_id).filter(models.Device.device_id.in_(ids))}
+        rows = [r for r in rows if r["device_id"] in alive]
+        if rows:
+            db.execute(pg_insert(models.DeviceMetric).on_conflict_do_nothing(), rows)
+            db.commit()
+        return len(rows)
+    except Exception:
+        db.rollback()
+        logger.exception("Device metric flush failed: rows=%s", len(rows))
+        return 0
+    finally:
+        db.close()
+
+
+def _floor(ts: datetime, step: int) -> datetime:
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % step, tz=timezone.utc)
+
+
+def _watermark(db, step: int) -> Optional[datetime]:
+    wm = _watermarks.get(step)
+    if wm is not None:
+        return wm
+    # resume from the newest rollup (re-rolled, upserts are idempotent) or the oldest source row
+    wm = db.execute(
+        text("SELECT max(bucket) FROM t_device_metric_rollup WHERE step = :step"), {"step": step}
+    ).scalar()
+    if wm is None:
+        if step == 60:
+            wm = db.execute(text("SELECT min(ts) FROM t_device_metric")).scalar()
+        else:
+            wm = db.execute(text("SELECT min(bucket) FROM t_device_metric_rollup WHERE step = 60")).scalar()
+    return _floor(wm, step) if wm is not None else None
+
+
+def rollup(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Roll closed buckets since the last run; returns rows upserted per tier."""
+    now = now or datetime.now(timezone.utc)
+    # buffered samples of a minute may still be in flight for one flush period
+    settle = timedelta(seconds=max(1, get_settings().device_metric_flush_interval) + 5)
+    done = {}
+    db = SessionLocal()
+    try:
+        source_end = _floor(now - settle, 60)
+        for name, step, stmt in (("1m", 60, _ROLLUP_1M), ("1h", 3600, _ROLLUP_1H)):
+            end = _floor(source_end, step)
+            start = _watermark(db, step)
+            if start is None or start >= end:
+                done[name] = 0
+                continue
+            done[name] = db.execute(stmt, {"start": start, "end": end}).rowcount
+            db.commit()
+            _watermarks[step] = end
+            source_end = end
+    except Exception:
+        db.rollback()
+        logger.exception("Device metric rollup failed")
+    finally:
+        db.close()
+    return done
+
+
+def expire(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Delete samples/rollups older than their retention."""
+    settings = get_settings()
+    now = now or datetime.now(timezone.utc)
+    deleted = {}
+    db = SessionLocal()
+    try:
+        deleted[RAW] = db.execute(
+            text("DELETE FROM t_device_metric WHERE ts < :before"),
+            {"before": now - timedelta(days=settings.device_metric_raw_days)},
+        ).rowcount
+        for name, days in (("1m", settings.device_metric_1m_days), ("1h", settings.device_metric_1h_days)):
+            deleted[name] = db.execute(
+                text("DELETE FROM t_device_metric_rollup WHERE step = :step AND bucket < :before"),
+                {"step": STEPS[name], "before": now - timedelta(days=days)},
+            ).rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception("Device metric expiry failed")
+    finally:
+        db.close()
+    if any(deleted.values()):
+        logger.info("Device metrics expired: %s", deleted)
+    return deleted
+
+
+def choose_resolution(start: datetime, end: datetime, max_points: int, now: Optional[datetime] = None) -> str:
+    """Finest tier still retained at start whose point count per device fits max_points."""
+    settings = get_settings()
+    now = now or datetime.now(timezone.utc)
+    span = max(1.0, (end - start).total_seconds())
+    tiers = (
+        (RAW, max(1, settings.device_metric_interval), settings.device_metric_raw_days),
+        ("1m", 60, settings.device_metric_1m_days),
+        ("1h", 3600, settings.device_metric_1h_days),
+    )
+    for name, step, days in tiers:
+        if start >= now - timedelta(days=days) and span / step <= max_points:
+            return name
+    return "1h"
+
+
+def query(device_ids: List[int], start: datetime, end: datetime, resolution: str = "auto",
+          max_points: int = 2000) -> Dict[str, Any]:
+    """Columnar series per device: {"resolution", "step", "series": [{device_id, t: [epoch s], <field>: [...]}]}."""
+    if resolution == "auto":
+        resolution = choose_resolution(start, end, max_points)
+    if resolution == RAW:
+        fields, step = SAMPLE_FIELDS, None
+        sql = text(
+            "SELECT device_id, ts, " + ", ".join(SAMPLE_FIELDS) + " FROM t_device_metric"
+            " WHERE device_id = ANY(:ids) AND ts >= :start AND ts < :end ORDER BY device_id, ts LIMIT :limit"
+        )
+        params = {}
+    else:
+        fields, step = ROLLUP_FIELDS, STEPS[resolution]
+        sql = text(
+            "SELECT device_id, bucket, " + ", ".join(ROLLUP_FIELDS) + " FROM t_device_metric_rollup"
+            " WHERE device_id = ANY(:ids) AND step = :step AND bucket >= :start AND bucket < :end"
+            " ORDER BY device_id, bucket LIMIT :limit"
+        )
+        params = {"step": step}
+    params.update(ids=list(device_ids), start=start, end=end, limit=max_points * max(1, len(device_ids)))
+    series: Dict[int, Dict[str, list]] = {
+        d: dict({"device_id": d, "t": []}, **{f: [] for f in fields}) for d in device_ids
+    }
+    db = SessionLocal()
+    try:
+        for row in db.execute(sql, params):
+            s = series.get(row[0])
+            if s is None:
+                continue
+            s["t"].append(int(row[1].timestamp()))
+            for i, f in enumerate(fields, start=2):
+                v = row[i]
+                s[f].append(round(v, 2) if isinstance(v, float) else v)
+    finally:
+        db.close()
+    return {"resolution": resolution, "step": step, "series": list(series.values())}
+
+
+def _loop():
+    settings = get_settings()
+    flush_every = max(1, settings.device_metric_flush_interval)
+    next_rollup = next_expire = 0.0
+    while True:
+        time.sleep(flush_every)
+        now = time.monotonic()
+        try:
+            flush_samples()
+            # samples are buffered per worker; rollups and retention run in the leader only
+            if not leader.is_leader():
+                continue
+            if now >= next_rollup:
+                rollup()
+                next_rollup = now + 60
+            if now >= next_expire:
+                expire()
+                next_expire = now + 3600
+        except Exception:
+            logger.exception("Device metric loop iteration failed")
+
+
+def start_background() -> None:
+    t = threading.Thread(target=_loop, name="device-metrics", daemon=True)
+    t.start()
+    logger.info("Started background task: device-metrics")
@@ -0,0 +1,221 @@
+"""Registry of devices connected over the control channel (see routers/device_channel.py).
+
+Message protocol (JSON text frames, every message has "type"; requests carry "id"):
+
+  device -> server
+    hello      {device_code, device_ip, device_config?, device_info?}   first frame, full state once
+    heartbeat  {}                                                      keeps the socket alive
+    metrics    {delta: {...}}                                          changed device_info keys only
+    config     {config: {...}}                                         device-side config change
+    ack        {id, ok, error?, config?}                               reply to a server request
+
+  server -> device
+    welcome    {heartbeat_interval, server_time}
+    config     {id, config: {...}}                                     deep-merge patch, expects ack
+
+A socket lives in one worker process; with several workers, push_config for a device held
+by another worker is relayed over app/worker_bus.py and the ack comes back the same way.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from . import worker_bus
+
+logger = logging.getLogger(__name__)
+
+# devices send a heartbeat at this interval; silent sockets are closed after 3 intervals
+HEARTBEAT_INTERVAL = 30
+# relayed pushes: the worker holding the socket must claim the request within this time
+REMOTE_ACCEPT_TIMEOUT = 2.0
+
+
+class DeviceNotConnected(Exception):
+    pass
+
+
+def deep_merge(base: Dict[str, Any], incoming: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge incoming into base (dicts recurse, everything else overwrites); mutates base."""
+    for k, v in incoming.items():
+        if isinstance(v, dict) and isinstance(base.get(k), dict):
+            deep_merge(base[k], v)
+        else:
+            base[k] = v
+    return base
+
+
+class DeviceConnection:
+    def __init__(self, device_code: str, device_ip: Optional[str], websocket, loop: asyncio.AbstractEventLoop):
+        self.device_code = device_code
+        self.device_ip = device_ip
+        self.websocket = websocket
+        self.loop = loop
+        self.device_id: Optional[int] = None
+        self.connected_at = datetime.now(timezone.utc)
+        self.last_seen = time.monotonic()
+        self.messages = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message: dict) -> None:
+        async with self._send_lock:
+            await self.websocket.send_json(message)
+
+    async def request(self, message: dict, timeout: float) -> dict:
+        """Send a request frame and wait for the device's ack."""
+        msg_id = f"s{next(self._ids)}"
+        fut = self.loop.create_future()
+        self._pending[msg_id] = fut
+        try:
+            await self.send(dict(message, id=msg_id))
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self._pending.pop(msg_id, None)
+
+    def resolve(self, message: dict) -> None:
+        fut = self._pending.get(str(message.get("id")))
+        if fut is not None and not fut.done():
+            fut.set_result(message)
+
+    def fail_pending(self) -> None:
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(DeviceNotConnected(self.device_code))
+
+    def snapshot(self) -> dict:
+        return {
+            "device_code": self.device_code,
+            "device_id": self.device_id,
+            "device_ip": self.device_ip,
+            "connected_at": self.connected_at.isoformat(),
+            "idle_seconds": round(time.monotonic() - self.last_seen, 1),
+            "messages": self.messages,
+        }
+
+
+class DeviceRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_code: Dict[str, DeviceConnection] = {}
+        # relayed pushes waiting for another worker: request id -> (loop, accepted, result)
+        self._remote: Dict[str, tuple] = {}
+
+    def register(self, conn: DeviceConnection) -> Optional[DeviceConnection]:
+        """Add a connection; returns the connection it replaces (same device reconnecting)."""
+        with self._lock:
+            old = self._by_code.get(conn.device_code)
+            self._by_code[conn.device_code] = conn
+        return old
+
+    def unregister(self, conn: DeviceConnection) -> bool:
+        """Remove conn unless a newer connection for the same device already replaced it."""
+        with self._lock:
+            if self._by_code.get(conn.device_code) is conn:
+                del self._by_code[conn.device_code]
+                return True
+        return False
+
+    def get(self, device_code: str) -> Optional[DeviceConnection]:
+        with self._lock:
+            return self._by_code.get(device_code)
+
+    def is_connected(self, device_code: str) -> bool:
+        return self.get(device_code) is not None
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            conns = list(self._by_code.values())
+        return [c.snapshot() for c in conns]
+
+    async def push_config(self, device_code: str, config: dict, timeout: float = 10.0) -> dict:
+        conn = self.get(device_code)
+        if conn is None:
+            if worker_bus.enabled():
+                return await self._push_remote(device_code, config, timeout)
+            raise DeviceNotConnected(device_code)
+        return await conn.request({"type": "config", "config": config}, timeout)
+
+    async def _push_remote(self, device_code: str, config: dict, timeout: float) -> dict:
+        loop = asyncio.get_running_loop()
+        request_id = uuid.uuid4().hex
+        accepted, result = loop.create_future(), loop.create_future()
+        with self._lock:
+            self._remote[request_id] = (loop, accepted, result)
+        try:
+            message = {"id": request_id, "device_code": device_code, "config": config, "timeout": timeout}
+            if not await loop.run_in_executor(None, worker_bus.publish, "device_push", message):
+                raise DeviceNotConnected(device_code)
+            try:
+                await asyncio.wait_for(accepted, REMOTE_ACCEPT_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise DeviceNotConnected(device_code)  # no worker holds its socket
+            reply = await asyncio.wait_for(result, timeout + 1)
+        finally:
+            with self._lock:
+                self._remote.pop(request_id, None)
+        if reply.get("error") == "not_connected":
+            raise DeviceNotConnected(device_code)
+        if reply.get("error") == "timeout":
+            raise asyncio.TimeoutError()
+        if "ack" not in reply:
+            return {"ok": False, "error": reply.get("error")}
+        return reply["ack"]
+
+    def _on_remote_push(self, message: dict) -> None:
+        # pg-listener thread: only the worker holding the socket answers
+        device_code = message.get("device_code")
+        if self.get(device_code) is None:
+            return
+        worker_bus.publish("device_push_reply", {"id": message["id"], "accepted": True})
+
+        def relay():
+            reply: Dict[str, Any] = {"id": message["id"]}
+            try:
+                reply["ack"] = self.push_config_threadsafe(device_code, message["config"], float(message["timeout"]))
+            except DeviceNotConnected:
+                reply["error"] = "not_connected"
+            except TimeoutError:
+                reply["error"] = "timeout"
+            except Exception as e:
+                logger.exception("Relayed config push failed: code=%s", device_code)
+                reply["error"] = str(e)
+            worker_bus.publish("device_push_reply", reply)
+
+        threading.Thread(target=relay, name="device-push-relay", daemon=True).start()
+
+    def _on_remote_reply(self, message: dict) -> None:
+        with self._lock:
+            entry = self._remote.get(message.get("id"))
+        if entry is None:
+            return
+        loop, accepted, result = entry
+        try:
+            loop.call_soon_threadsafe(_settle, accepted, message)
+            if not message.get("accepted"):
+                loop.call_soon_threadsafe(_settle, result, message)
+        except RuntimeError:
+            pass  # loop closed
+
+    def push_config_threadsafe(self, device_code: str, config: dict, timeout: float = 10.0) -> dict:
+        """push_config for synchronous callers on worker threads (not on the event loop)."""
+        conn = self.get(device_code)
+        if conn is None:
+            raise DeviceNotConnected(device_code)
+        fut = asyncio.run_coroutine_threadsafe(self.push_config(device_code, config, timeout), conn.loop)
+        return fut.result(timeout + 1)
+
+
+def _settle(fut: asyncio.Future, value: Any) -> None:
+    if not fut.done():
+        fut.set_result(value)
+
+
+registry = DeviceRegistry()
+worker_bus.subscribe("device_push", registry._on_remote_push)
+worker_bus.subscribe("device_push_reply", registry._on_remote_reply)
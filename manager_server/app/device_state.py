@@ -0,0 +1,336 @@
+"""Write-behind device state: heartbeats update memory, a flusher batches changes into t_device.
+
+Each known device keeps its last row values, content hashes of device_config/device_info,
+last_seen and a dict of pending (changed, unflushed) columns. Heartbeats that change
+nothing cost a hash comparison; changes are written by flush() in one batched UPDATE.
+Online/offline follows heartbeats: a device silent for device_offline_after seconds is
+flushed as offline (fault/maintenance set by an operator are left alone).
+With several workers a device's reports spread over all of them; every write is
+announced on the worker bus and the other workers drop their copy of that device,
+including unflushed changes older than that write (so a worker that stopped receiving a
+device neither times it out nor writes older values over the newer ones).
+"""
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import update
+
+from . import cache, crud, models, schemas, device_metrics, worker_bus
+from .config import get_settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+_ROW_FIELDS = ("device_id", "device_code", "device_ip", "rtsp_urls", "note", "device_config", "device_info",
+               "status", "create_time", "update_time", "last_seen")
+_TRACKED = ("device_ip", "rtsp_urls", "note", "device_config", "device_info", "status")
+# keys of device_info that change on every report without meaning anything changed
+_VOLATILE_INFO_KEYS = ("timestamp",)
+
+
+def _digest(field: str, value: Any) -> str:
+    if field == "device_info" and isinstance(value, dict):
+        value = {k: v for k, v in value.items() if k not in _VOLATILE_INFO_KEYS}
+    raw = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class DeviceState:
+    def __init__(self, row: Dict[str, Any]):
+        self.row = row
+        self.hashes = {f: _digest(f, row.get(f)) for f in _TRACKED}
+        self.pending: Dict[str, Any] = {}
+        # monotonic times of the latest pending change here and of the latest write by another worker
+        self.pending_mono = 0.0
+        self.remote_write_mono = 0.0
+        self.last_seen_mono = time.monotonic()
+        self.last_seen_flushed = row.get("last_seen")
+        self.info_flushed_mono = 0.0
+
+
+_lock = threading.Lock()
+_states: Dict[str, DeviceState] = {}
+_stats = {"heartbeats": 0, "unchanged": 0, "flushes": 0, "rows_flushed": 0}
+
+
+def _row_of(item: models.Device) -> Dict[str, Any]:
+    return {f: copy.deepcopy(getattr(item, f, None)) for f in _ROW_FIELDS}
+
+
+def _load(device_code: str, defaults: Dict[str, Any]) -> DeviceState:
+    """Load (or create) the row for device_code outside the lock."""
+    db = SessionLocal()
+    try:
+        item = crud.get_device_by_code(db, device_code)
+        if not item:
+            item = crud.create_device(db, schemas.DeviceCreate(
+                device_code=device_code,
+                device_ip=defaults.get("device_ip") or "",
+                rtsp_urls=defaults.get("rtsp_urls") or [],
+                note=defaults.get("note") or "",
+                device_config=defaults.get("device_config") or {},
+                device_info=defaults.get("device_info") or {},
+                status=defaults.get("status") or "online",
+            ))
+            logger.info("Device created by heartbeat: code=%s id=%s", device_code, item.device_id)
+        return DeviceState(_row_of(item))
+    finally:
+        db.close()
+
+
+def _write_now(device_id: int, **values) -> None:
+    db = SessionLocal()
+    try:
+        crud.update_device(db, device_id, schemas.DeviceUpdate(**values))
+    finally:
+        db.close()
+    worker_bus.publish("device_state", [device_id])
+
+
+def heartbeat(device_code: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Absorb a device report (DeviceUpdate fields that are not None); returns the current row."""
+    fields = {k: v for k, v in fields.items() if k in _TRACKED and v is not None}
+    with _lock:
+        st = _states.get(device_code)
+    if st is None:
+        loaded = _load(device_code, fields)
+        with _lock:
+            st = _states.setdefault(device_code, loaded)
+    ip_hash = _digest("device_ip", fields["device_ip"]) if fields.get("device_ip") else None
+    if ip_hash and ip_hash != st.hashes.get("device_ip"):
+        # device_ip is unique: write it now so a conflict reaches the caller instead of the batch
+        _write_now(st.row["device_id"], device_ip=fields["device_ip"])
+        with _lock:
+            st.row["device_ip"] = fields["device_ip"]
+            st.hashes["device_ip"] = ip_hash
+    now_wall = datetime.now(timezone.utc)
+    with _lock:
+        _stats["heartbeats"] += 1
+        st.last_seen_mono = time.monotonic()
+        st.row["last_seen"] = now_wall
+        if "status" not in fields and st.row.get("status") == "offline":
+            fields["status"] = "online"
+        changed = False
+        for f, v in fields.items():
+            h = _digest(f, v)
+            if h == st.hashes.get(f):
+                continue
+            st.hashes[f] = h
+            st.row[f] = v
+            st.pending[f] = v
+            changed = True
+        if changed:
+            st.pending_mono = st.last_seen_mono
+        else:
+            _stats["unchanged"] += 1
+        row = dict(st.row)
+    if "device_info" in fields:
+        # metric history is sampled from every report, even when the snapshot hash is unchanged
+        device_metrics.record(row["device_id"], fields["device_info"])
+    return row
+
+
+def touch(device_code: str) -> None:
+    """Record liveness only (e.g. a control-channel heartbeat) for an already known device."""
+    with _lock:
+        st = _states.get(device_code)
+        if st is not None:
+            st.last_seen_mono = time.monotonic()
+            st.row["last_seen"] = datetime.now(timezone.utc)
+            if st.row.get("status") == "offline":
+                st.row["status"] = st.pending["status"] = "online"
+                st.hashes["status"] = _digest("status", "online")
+                st.pending_mono = st.last_seen_mono
+
+
+def mark_offline(device_code: str) -> None:
+    """The device went away (e.g. its control channel closed); may hit the DB when not cached."""
+    with _lock:
+        st = _states.get(device_code)
+        if st is not None:
+            if st.row.get("status") == "online":
+                st.row["status"] = st.pending["status"] = "offline"
+                st.hashes["status"] = _digest("status", "offline")
+                st.pending_mono = time.monotonic()
+            return
+    db = SessionLocal()
+    try:
+        item = crud.get_device_by_code(db, device_code)
+        if item and item.status == "online":
+            crud.update_device(db, item.device_id, schemas.DeviceUpdate(status="offline"))
+    finally:
+        db.close()
+
+
+def invalidate(device_code: Optional[str] = None) -> None:
+    """Drop cached state after a direct edit/delete of t_device (reloaded on next heartbeat)."""
+    with _lock:
+        if device_code is None:
+            _states.clear()
+        else:
+            _states.pop(device_code, None)
+
+
+def _forget_ids(device_ids, keep_pending: bool = False) -> None:
+    ids = set(device_ids)
+    now_mono = time.monotonic()
+    with _lock:
+        for code, st in list(_states.items()):
+            if st.row["device_id"] not in ids:
+                continue
+            if keep_pending and st.pending:
+                st.remote_write_mono = now_mono
+            else:
+                del _states[code]
+
+
+def _on_remote_write(device_ids) -> None:
+    # another worker wrote these devices: drop our copies so hashes/status are reloaded from
+    # t_device; entries with unflushed changes stay until _collect, which writes them only if
+    # they are newer than that write
+    _forget_ids(device_ids, keep_pending=True)
+
+
+def invalidate_id(device_id: int) -> None:
+    _forget_ids([device_id])
+    worker_bus.publish("device_state", [device_id])
+
+
+worker_bus.subscribe("device_state", _on_remote_write)
+
+
+def _collect(now_mono: float, now_wall: datetime) -> List[Dict[str, Any]]:
+    settings = get_settings()
+    offline_after = max(1, settings.device_offline_after)
+    info_interval = max(0, settings.device_info_flush_interval)
+    last_seen_interval = max(1, settings.device_last_seen_flush_interval)
+    rows = []
+    with _lock:
+        for code, st in list(_states.items()):
+            if st.remote_write_mono > st.pending_mono:
+                # another worker wrote the device after our last change: our pending values (and
+                # our last_seen) are older than what it wrote, so drop them; the next report reloads
+                del _states[code]
+                continue
+            if st.row.get("status") == "online" and now_mono - st.last_seen_mono > offline_after:
+                st.row["status"] = st.pending["status"] = "offline"
+                st.hashes["status"] = _digest("status", "offline")
+            values = dict(st.pending)
+            # metrics-like info changes every report; write them at a slower cadence
+            if "device_info" in values and now_mono - st.info_flushed_mono < info_interval and len(values) == 1:
+                values = {}
+            last_seen = st.row.get("last_seen")
+            if last_seen is not None and (
+                values
+                or st.last_seen_flushed is None
+                or (last_seen - st.last_seen_flushed).total_seconds() >= last_seen_interval
+            ):
+                values["last_seen"] = last_seen
+            if not values:
+                continue
+            for f in values:
+                st.pending.pop(f, None)
+            if "device_info" in values:
+                st.info_flushed_mono = now_mono
+            if "last_seen" in values:
+                st.last_seen_flushed = last_seen
+            if any(f != "last_seen" for f in values):
+                values["update_time"] = now_wall
+                st.row["update_time"] = now_wall
+            values["device_id"] = st.row["device_id"]
+            rows.append(values)
+    return rows
+
+
+def _restore(rows: List[Dict[str, Any]]) -> None:
+    # failed flush: put the values back unless a newer heartbeat already replaced them
+    with _lock:
+        by_id = {st.row["device_id"]: st for st in _states.values()}
+        for values in rows:
+            st = by_id.get(values["device_id"])
+            if st is None:
+                continue
+            for f, v in values.items():
+                if f in _TRACKED:
+                    st.pending.setdefault(f, v)
+            st.last_seen_flushed = None
+
+
+def flush() -> int:
+    """Write pending changes to t_device in one batched UPDATE; returns rows written."""
+    rows = _collect(time.monotonic(), datetime.now(timezone.utc))
+    if not rows:
+        return 0
+    written = len(rows)
+    db = SessionLocal()
+    try:
+        try:
+            db.execute(update(models.Device), rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning("Device state batch flush failed, retrying per row: rows=%s err=%s", len(rows), e)
+            written, failed = _flush_rows(db, rows)
+            _restore(failed)
+    finally:
+        db.close()
+    if written:
+        # bulk UPDATE bypasses crud.update_device
+        cache.invalidate("devices")
+        ids = [r["device_id"] for r in rows]
+        for i in range(0, len(ids), 500):  # stay under the NOTIFY payload limit
+            worker_bus.publish("device_state", ids[i:i + 500])
+    with _lock:
+        _stats["flushes"] += 1
+        _stats["rows_flushed"] += written
+    logger.debug("Device state flushed: rows=%s", written)
+    return written
+
+
+def _flush_rows(db, rows: List[Dict[str, Any]]) -> tuple:
+    # one bad row (e.g. a deleted device) must not hold back the rest of the batch
+    written, failed = 0, []
+    for values in rows:
+        try:
+            db.execute(update(models.Device), [values])
+            db.commit()
+            written += 1
+        except Exception:
+            db.rollback()
+            if db.get(models.Device, values["device_id"]) is None:
+                # deleted behind our back: forget it instead of retrying forever
+                invalidate_id(values["device_id"])
+                continue
+            failed.append(values)
+            logger.exception("Device state flush failed: device_id=%s", values.get("device_id"))
+    return written, failed
+
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        online = sum(1 for st in _states.values() if st.row.get("status") == "online")
+        pending = sum(1 for st in _states.values() if st.pending)
+        return dict(_stats, tracked=len(_states), online=online, pending=pending)
+
+
+def _flush_loop():
+    interval = max(1, get_settings().device_flush_interval)
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Device state flush loop iteration failed")
+
+
+def start_background() -> None:
+    t = threading.Thread(target=_flush_loop, name="device-state-flusher", daemon=True)
+    t.start()
+    logger.info("Started background task: device-state-flusher")
@@ -0,0 +1,152 @@
+"""In-process fan-out of committed alarm changes to streaming clients (SSE).
+
+crud notifies listeners after each alarm insert/update/delete commits; publish()
+may run on any thread (threadpool endpoints, background loops), so events are
+handed to each subscriber's event loop with call_soon_threadsafe. With several workers,
+changes committed elsewhere arrive through crud's worker-bus relay. Event ids are the
+change ids crud assigns on the committing worker (microsecond timestamps), so a change
+carries the same id on every worker. Resuming from Last-Event-ID is exact on the same
+worker. On another worker it replays that worker's buffered changes with larger ids, so
+nothing is sent twice, but a change still in flight between workers when the client
+switched (NOTIFY latency, a listener reconnect) can be missed.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import crud, schemas
+
+logger = logging.getLogger(__name__)
+
+# replay window for reconnecting clients (Last-Event-ID)
+HISTORY_SIZE = 1000
+# events buffered per slow client before it is dropped (it reconnects and replays)
+QUEUE_SIZE = 500
+
+
+class Event:
+    __slots__ = ("id", "type", "rows", "data")
+
+    def __init__(self, event_id: int, event_type: str, rows: Tuple[dict, ...], data: dict):
+        self.id = event_id
+        self.type = event_type
+        self.rows = rows  # column snapshots (before/after) used for filter matching
+        self.data = data
+
+    def encode(self) -> bytes:
+        payload = json.dumps(self.data, ensure_ascii=False, separators=(",", ":"), default=str)
+        return f"id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n".encode("utf-8")
+
+
+class Subscription:
+    def __init__(self, loop: asyncio.AbstractEventLoop, filters: Dict[str, Optional[List[str]]]):
+        self.loop = loop
+        self.filters = filters
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def _matches_row(self, row: dict) -> bool:
+        for key, allowed in self.filters.items():
+            if allowed and str(row.get(key)) not in allowed:
+                return False
+        # like the alarm list: auto_ignore only when asked for explicitly
+        if not self.filters.get("process_status") and row.get("process_status") == "auto_ignore":
+            return False
+        return True
+
+    def matches(self, event: Event) -> bool:
+        # an update is relevant if the alarm was or now is in the subscribed set
+        return any(self._matches_row(r) for r in event.rows)
+
+    def _offer(self, event: Event) -> None:
+        # runs on the subscriber's loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            logger.warning("Alarm stream subscriber too slow; dropping it")
+
+
+class Broadcaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._evicted_id = 0  # newest id already dropped from the replay window
+        self._history: "deque[Event]" = deque(maxlen=HISTORY_SIZE)
+        self._subs: List[Subscription] = []
+
+    def subscribe(self, filters: Dict[str, Optional[List[str]]], last_event_id: Optional[int] = None):
+        """Register a subscriber on the running loop. Returns (subscription, backlog, complete):
+        backlog holds buffered events after last_event_id; complete is False if some were already
+        evicted from the replay window (the client should reload its data).
+        """
+        sub = Subscription(asyncio.get_running_loop(), filters)
+        with self._lock:
+            self._subs.append(sub)
+            backlog: List[Event] = []
+            complete = True
+            if last_event_id is not None:
+                backlog = [e for e in self._history if e.id > last_event_id and sub.matches(e)]
+                complete = last_event_id >= self._evicted_id
+        return sub, backlog, complete
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+
+    def publish(self, event_type: str, rows: Tuple[dict, ...], data: dict, event_id: Optional[int] = None) -> None:
+        """event_id: the change's id from the committing worker; assigned here if None."""
+        with self._lock:
+            if event_id is None:
+                event_id = max(self._last_id + 1, time.time_ns() // 1000)
+            self._last_id = max(self._last_id, event_id)
+            event = Event(event_id, event_type, rows, data)
+            if len(self._history) == self._history.maxlen:
+                # relayed changes can arrive slightly out of id order
+                self._evicted_id = max(self._evicted_id, self._history[0].id)
+            self._history.append(event)
+            subs = list(self._subs)
+        for sub in subs:
+            if not sub.matches(event):
+                continue
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, event)
+            except RuntimeError:
+                # loop closed (shutdown)
+                self.unsubscribe(sub)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subs)
+
+
+broadcaster = Broadcaster()
+
+
+def _alarm_payload(row: dict) -> Dict[str, Any]:
+    return schemas.AlarmRead.model_validate(row).model_dump(mode="json")
+
+
+def _on_alarm_change(old: Optional[dict], new: Optional[dict], change_id: Optional[int]) -> None:
+    if new is None:
+        broadcaster.publish("alarm.deleted", (old,), {"alarm_id": old["alarm_id"]}, change_id)
+        return
+    data = _alarm_payload(new)
+    if old is None:
+        broadcaster.publish("alarm.created", (new,), data, change_id)
+        return
+    changed = sorted(k for k in new if k != "update_time" and new.get(k) != old.get(k))
+    if not changed:
+        return
+    broadcaster.publish("alarm.updated", (old, new), {"changed": changed, "alarm": data}, change_id)
+
+
+crud.add_alarm_listener(_on_alarm_change)
@@ -0,0 +1,199 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Iterable, Iterator, Mapping
+
+from . import storage
+
+# Column order of exported alarm rows (mirrors schemas.AlarmRead)
+ALARM_EXPORT_COLUMNS = [
+    "alarm_id",
+    "alarm_time",
+    "longitude",
+    "latitude",
+    "alarm_type",
+    "confidence",
+    "process_opinion",
+    "process_opinion_person",
+    "process_status",
+    "process_feedback",
+    "process_feedback_person",
+    "image_url",
+    "image_hash",
+    "device_ip",
+    "user_code",
+    "address",
+    "simple_address",
+    "route_id",
+    "route_offset_m",
+    "route_distance_m",
+    "create_time",
+    "update_time",
+]
+
+# flush encoded rows to the client roughly every this many bytes
+CHUNK_BYTES = 64 * 1024
+# images up to this size are read completely before their zip member is started, so a read
+# error leaves no member behind; larger ones are streamed and may end up truncated
+IMAGE_BUFFER_BYTES = 8 * 1024 * 1024
+
+
+def _plain_value(v: Any) -> Any:
+    if isinstance(v, datetime):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    return v
+
+
+def _export_record(row: Mapping[str, Any]) -> dict:
+    return {k: _plain_value(row.get(k)) for k in ALARM_EXPORT_COLUMNS}
+
+
+def iter_ndjson(rows: Iterable[Mapping[str, Any]]) -> Iterator[bytes]:
+    """Encode rows as newline-delimited JSON, yielding ~CHUNK_BYTES sized chunks."""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write(json.dumps(_export_record(row), ensure_ascii=False, separators=(",", ":")))
+        buf.write("\n")
+        if buf.tell() >= CHUNK_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def iter_csv(rows: Iterable[Mapping[str, Any]]) -> Iterator[bytes]:
+    """Encode rows as CSV with a header line, yielding ~CHUNK_BYTES sized chunks.
+    A UTF-8 BOM is prepended so Excel opens Chinese addresses correctly.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")
+    writer.writerow(ALARM_EXPORT_COLUMNS)
+    for row in rows:
+        rec = _export_record(row)
+        writer.writerow(["" if rec[k] is None else rec[k] for k in ALARM_EXPORT_COLUMNS])
+        if buf.tell() >= CHUNK_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+class _ZipSink:
+    """Write-only, non-seekable target for zipfile that hands bytes back to a generator.
+    zipfile detects the missing tell()/seek() and switches to data descriptors, so each
+    member is emitted as soon as it is written and nothing but the current chunk is held.
+    """
+
+    def __init__(self):
+        self._parts: list = []
+
+    def write(self, data) -> int:
+        if data:
+            self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        if self._parts:
+            parts, self._parts = self._parts, []
+            yield b"".join(parts)
+
+
+IMAGE_MANIFEST_COLUMNS = [
+    "alarm_id",
+    "alarm_time",
+    "alarm_type",
+    "process_status",
+    "device_ip",
+    "longitude",
+    "latitude",
+    "address",
+    "image_url",
+    "archive_name",
+    "size",
+    "status",
+]
+
+
+def _zip_date_time(v: Any) -> tuple:
+    if isinstance(v, datetime) and v.year >= 1980:
+        return (v.year, v.month, v.day, v.hour, v.minute, v.second)
+    return (1980, 1, 1, 0, 0, 0)
+
+
+def iter_images_zip(rows: Iterable[Mapping[str, Any]]) -> Iterator[bytes]:
+    """Build a ZIP (store mode) of the images behind rows on the fly, plus manifest.csv.
+    Image files are copied in CHUNK_BYTES pieces and every piece is yielded immediately;
+    the manifest is spooled (to a temp file once large) and appended as the last member.
+    Manifest status: ok, missing, unreadable (no member written) or truncated (a streamed
+    image failed part way; archive_name/size describe the partial member).
+    """
+    sink = _ZipSink()
+    manifest = tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode="w+", encoding="utf-8", newline="")
+    try:
+        mwriter = csv.writer(manifest)
+        mwriter.writerow(IMAGE_MANIFEST_COLUMNS)
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for row in rows:
+                rec = {k: _plain_value(row.get(k)) for k in IMAGE_MANIFEST_COLUMNS if k in row}
+                rel = row.get("image_url") or ""
+                arcname = ""
+                size = ""
+                status = "missing"
+                opened = storage.open_image(rel) if rel else None
+                if opened:
+                    src, src_size = opened
+                    arcname = f"images/{row.get('alarm_id')}{os.path.splitext(rel)[1]}"
+                    written = None  # bytes in the zip member, once it is started
+                    try:
+                        with src:
+                            head = src.read(IMAGE_BUFFER_BYTES if src_size <= IMAGE_BUFFER_BYTES else CHUNK_BYTES)
+                            zinfo = zipfile.ZipInfo(arcname, date_time=_zip_date_time(row.get("alarm_time")))
+                            zinfo.compress_type = zipfile.ZIP_STORED
+                            zinfo.file_size = src_size
+                            with zf.open(zinfo, "w") as dst:
+                                written = 0
+                                chunk = head
+                                while chunk:
+                                    dst.write(chunk)
+                                    written += len(chunk)
+                                    yield from sink.drain()
+                                    chunk = src.read(CHUNK_BYTES)
+                        size = written
+                        status = "ok"
+                    except OSError:
+                        if written is None:
+                            status = "unreadable"
+                        else:
+                            size = written
+                            status = "truncated"
+                    yield from sink.drain()
+                rec.update({"archive_name": arcname if status in ("ok", "truncated") else "", "size": size, "status": status})
+                mwriter.writerow(["" if rec.get(k) is None else rec.get(k) for k in IMAGE_MANIFEST_COLUMNS])
+            manifest.seek(0)
+            zinfo = zipfile.ZipInfo("manifest.csv", date_time=_zip_date_time(datetime.now()))
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with zf.open(zinfo, "w", force_zip64=True) as dst:
+                dst.write("\ufeff".encode("utf-8"))
+                while True:
+                    text = manifest.read(CHUNK_BYTES)
+                    if not text:
+                        break
+                    dst.write(text.encode("utf-8"))
+                    yield from sink.drain()
+        # closing the archive writes the central directory
+        yield from sink.drain()
+    finally:
+        manifest.close()
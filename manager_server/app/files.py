@@ -0,0 +1,86 @@
+import os
+import re
+from email.utils import formatdate
+from typing import Iterator, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag(st: os.stat_result) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _iter_file(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _parse_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """Parse a single 'bytes=a-b' range into (start, end) inclusive.
+    Returns None when absent or unsupported (multi-range); raises ValueError when unsatisfiable.
+    """
+    if not header:
+        return None
+    m = _RANGE_RE.match(header.strip())
+    if not m:
+        return None
+    first, last = m.group(1), m.group(2)
+    if first == "" and last == "":
+        return None
+    if first == "":
+        # suffix range: last N bytes
+        n = int(last)
+        if n == 0:
+            raise ValueError("unsatisfiable range")
+        return max(0, size - n), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("unsatisfiable range")
+    return start, min(end, size - 1)
+
+
+def file_response(request: Request, path: str, media_type: str, max_age: int = 86400) -> Response:
+    """Serve a local file with ETag/Last-Modified validators, Cache-Control and single-range support."""
+    st = os.stat(path)
+    etag = _etag(st)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": f"public, max-age={int(max_age)}",
+        "Accept-Ranges": "bytes",
+    }
+    inm = request.headers.get("if-none-match")
+    if inm and (inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    size = st.st_size
+    rng_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if rng_header and if_range and if_range.strip() != etag:
+        rng_header = None
+    try:
+        rng = _parse_range(rng_header, size)
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    if rng is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_iter_file(path, 0, size), media_type=media_type, headers=headers)
+    start, end = rng
+    length = end - start + 1
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(_iter_file(path, start, length), status_code=206, media_type=media_type, headers=headers)
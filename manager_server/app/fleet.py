@@ -0,0 +1,254 @@
+"""Concurrent fan-out to the device fleet (refresh device info, push config).
+
+Each job visits its devices with at most fleet_concurrency requests in flight,
+a per-host connect timeout plus an overall per-device deadline, so one dead
+device only costs its own timeout. Periodic sweeps spread their start times
+with random jitter instead of hitting every device at once.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from . import crud, schemas, device_state
+from .config import get_settings
+from .database import SessionLocal
+from .device_registry import registry, deep_merge
+
+if TYPE_CHECKING:
+    import httpx  # imported in run_job: keeps it off the server's startup path
+
+logger = logging.getLogger(__name__)
+
+# finished jobs kept for progress/result queries
+_MAX_JOBS = 50
+
+
+class FleetJob:
+    def __init__(self, kind: str, devices: List[dict]):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.devices = devices
+        self.total = len(devices)
+        self.done = 0
+        self.ok = 0
+        self.failed = 0
+        self.state = "pending"
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.results: Dict[int, dict] = {}
+        # strong reference to the task started by start_job (the loop only keeps a weak one)
+        self.task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+    def record(self, device: dict, ok: bool, via: str, elapsed: float, status: Optional[int] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.results[device["device_id"]] = {
+                "device_id": device["device_id"],
+                "device_ip": device["device_ip"],
+                "ok": ok,
+                "via": via,
+                "status": status,
+                "error": error,
+                "elapsed_ms": int(elapsed * 1000),
+            }
+            self.done += 1
+            if ok:
+                self.ok += 1
+            else:
+                self.failed += 1
+
+    def _elapsed(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        end = self.finished_at or datetime.now(timezone.utc)
+        return round((end - self.started_at).total_seconds(), 3)
+
+    def to_dict(self, results: str = "failed") -> dict:
+        """results: 'all', 'failed' or 'none'."""
+        with self._lock:
+            out = {
+                "job_id": self.job_id,
+                "kind": self.kind,
+                "state": self.state,
+                "total": self.total,
+                "done": self.done,
+                "ok": self.ok,
+                "failed": self.failed,
+                "progress": round(self.done / self.total, 4) if self.total else 1.0,
+                "started_at": self.started_at.isoformat() if self.started_at else None,
+                "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+                "elapsed_sec": self._elapsed(),
+            }
+            if results != "none":
+                out["results"] = [r for r in self.results.values() if results == "all" or not r["ok"]]
+        return out
+
+
+_jobs_lock = threading.Lock()
+_jobs: "OrderedDict[str, FleetJob]" = OrderedDict()
+
+
+def _remember(job: FleetJob) -> None:
+    with _jobs_lock:
+        _jobs[job.job_id] = job
+        while len(_jobs) > _MAX_JOBS:
+            oldest = next(iter(_jobs))
+            if _jobs[oldest].state != "finished":
+                break
+            _jobs.popitem(last=False)
+
+
+def get_job(job_id: str) -> Optional[FleetJob]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def list_jobs() -> List[FleetJob]:
+    with _jobs_lock:
+        return list(reversed(_jobs.values()))
+
+
+def load_devices(device_ids: Optional[List[int]] = None) -> List[dict]:
+    db = SessionLocal()
+    try:
+        items = crud.list_devices(db)
+    finally:
+        db.close()
+    wanted = set(device_ids) if device_ids else None
+    return [
+        {"device_id": d.device_id, "device_code": d.device_code, "device_ip": d.device_ip, "device_config": d.device_config}
+        for d in items
+        if d.device_ip and (wanted is None or d.device_id in wanted)
+    ]
+
+
+def _save_device(device_id: int, body: schemas.DeviceUpdate) -> None:
+    db = SessionLocal()
+    try:
+        crud.update_device(db, device_id, body)
+    finally:
+        db.close()
+    device_state.invalidate_id(device_id)
+
+
+def _device_url(device: dict, path: str) -> str:
+    return f"http://{device['device_ip']}:{get_settings().device_listen_port}{path}"
+
+
+async def _refresh_one(client: "httpx.AsyncClient", device: dict) -> tuple:
+    r = await client.get(_device_url(device, "/api/v1/client/device"))
+    if r.status_code != 200:
+        return False, r.status_code, f"HTTP {r.status_code}"
+    body = r.json() or {}
+    update = schemas.DeviceUpdate(device_config=body.get("device_config"), device_info=body.get("device_info"))
+    await asyncio.get_running_loop().run_in_executor(None, _save_device, device["device_id"], update)
+    return True, r.status_code, None
+
+
+async def _push_one(client: "httpx.AsyncClient", device: dict, config: dict) -> tuple:
+    r = await client.put(_device_url(device, "/api/v1/client/config"), json=config)
+    if r.status_code != 200:
+        return False, r.status_code, f"HTTP {r.status_code}: {r.text[:200]}"
+    merged = deep_merge(dict(device.get("device_config") or {}), config)
+    await asyncio.get_running_loop().run_in_executor(
+        None, _save_device, device["device_id"], schemas.DeviceUpdate(device_config=merged)
+    )
+    return True, r.status_code, None
+
+
+async def _push_over_channel(conn, config: dict, timeout: float) -> tuple:
+    # the socket may live on another event loop (API loop vs. background sweep thread)
+    fut = asyncio.run_coroutine_threadsafe(registry.push_config(conn.device_code, config, timeout), conn.loop)
+    ack = await asyncio.wait_for(asyncio.wrap_future(fut), timeout + 1)
+    if not ack.get("ok"):
+        return False, None, f"device rejected config: {ack.get('error')}"
+    # the device_config column is updated by the channel handler from the ack
+    return True, None, None
+
+
+async def run_job(job: FleetJob, config: Optional[dict] = None, spread_sec: float = 0.0) -> FleetJob:
+    """Execute job on the running loop; returns it when every device has a result."""
+    import httpx
+
+    settings = get_settings()
+    sem = asyncio.Semaphore(max(1, settings.fleet_concurrency))
+    deadline = max(0.5, settings.fleet_timeout)
+    timeout = httpx.Timeout(deadline, connect=min(deadline, settings.fleet_connect_timeout))
+    limits = httpx.Limits(max_connections=max(1, settings.fleet_concurrency), max_keepalive_connections=0)
+    job.state = "running"
+    job.started_at = datetime.now(timezone.utc)
+
+    async def visit(client: "httpx.AsyncClient", device: dict):
+        if spread_sec > 0:
+            await asyncio.sleep(random.uniform(0, spread_sec))
+        async with sem:
+            t0 = time.monotonic()
+            via = "http"
+            conn = registry.get(device["device_code"]) if job.kind == "config_push" else None
+            try:
+                if conn is not None:
+                    via = "channel"
+                    ok, status, err = await _push_over_channel(conn, config or {}, deadline)
+                elif job.kind == "config_push":
+                    ok, status, err = await asyncio.wait_for(_push_one(client, device, config or {}), deadline)
+                else:
+                    ok, status, err = await asyncio.wait_for(_refresh_one(client, device), deadline)
+            except asyncio.TimeoutError:
+                ok, status, err = False, None, "timeout"
+            except Exception as e:
+                ok, status, err = False, None, f"{type(e).__name__}: {e}"
+            job.record(device, ok, via, time.monotonic() - t0, status, err)
+
+    try:
+        async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+            await asyncio.gather(*(visit(client, d) for d in job.devices))
+    finally:
+        job.state = "finished"
+        job.finished_at = datetime.now(timezone.utc)
+    logger.info(
+        "Fleet %s %s: %s/%s ok, %s failed in %.1fs",
+        job.kind, job.job_id, job.ok, job.total, job.failed, job._elapsed(),
+    )
+    return job
+
+
+def start_job(kind: str, devices: List[dict], config: Optional[dict] = None) -> FleetJob:
+    """Create a job and schedule it on the current event loop (call from async endpoints)."""
+    job = FleetJob(kind, devices)
+    _remember(job)
+    job.task = asyncio.get_running_loop().create_task(run_job(job, config))
+    job.task.add_done_callback(lambda task: _task_done(job, task))
+    return job
+
+
+def _task_done(job: FleetJob, task: "asyncio.Task") -> None:
+    # a job that failed before it started (e.g. httpx missing) must not stay pending forever
+    if job.state != "finished":
+        job.state = "finished"
+        job.finished_at = datetime.now(timezone.utc)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Fleet %s %s failed", job.kind, job.job_id, exc_info=task.exception())
+
+
+def refresh_forever() -> None:
+    """Blocking periodic refresh sweep (for a background thread) with jittered scheduling."""
+    settings = get_settings()
+    interval = max(1, int(settings.device_refresh_time))
+    while True:
+        started = time.monotonic()
+        try:
+            # devices on the control channel already push their state
+            devices = [d for d in load_devices() if not registry.is_connected(d["device_code"])]
+            job = FleetJob("refresh", devices)
+            _remember(job)
+            asyncio.run(run_job(job, spread_sec=min(interval * 0.5, settings.fleet_jitter)))
+        except Exception:
+            logger.exception("Device refresher sweep failed")
+        elapsed = time.monotonic() - started
+        time.sleep(max(1.0, interval - elapsed) * random.uniform(0.9, 1.1))
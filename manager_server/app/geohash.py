@@ -0,0 +1,98 @@
+"""Minimal geohash (base32, lat/lon interleaved) helpers for map clustering."""
+from typing import List, Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE = {c: i for i, c in enumerate(_BASE32)}
+
+# precision stored on t_alarm_info.geohash
+STORED_PRECISION = 9
+
+
+def encode(latitude: float, longitude: float, precision: int = STORED_PRECISION) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    out = []
+    bits = 0
+    ch = 0
+    even = True
+    lat, lon = float(latitude), float(longitude)
+    while len(out) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch])
+            bits = 0
+            ch = 0
+    return "".join(out)
+
+
+def bounds(code: str) -> Tuple[float, float, float, float]:
+    """(min_lon, min_lat, max_lon, max_lat) of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for c in code:
+        v = _DECODE[c]
+        for shift in (4, 3, 2, 1, 0):
+            bit = (v >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lon_lo, lat_lo, lon_hi, lat_hi
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """(width_deg, height_deg) of cells at a precision."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 360.0 / (1 << lon_bits), 180.0 / (1 << lat_bits)
+
+
+def cover(min_lon: float, min_lat: float, max_lon: float, max_lat: float, max_cells: int = 16) -> List[str]:
+    """Geohash prefixes covering a bbox: the finest precision needing at most max_cells cells."""
+    min_lat, max_lat = max(-90.0, min_lat), min(90.0, max_lat)
+    min_lon, max_lon = max(-180.0, min_lon), min(180.0, max_lon)
+    best: List[str] = [""]
+    for precision in range(1, STORED_PRECISION + 1):
+        w, h = cell_size(precision)
+        nx = int(max_lon // w) - int(min_lon // w) + 1
+        ny = int(max_lat // h) - int(min_lat // h) + 1
+        if nx * ny > max_cells:
+            break
+        cells = set()
+        for iy in range(ny):
+            lat = min(max_lat, min_lat + iy * h)
+            for ix in range(nx):
+                cells.add(encode(lat, min(max_lon, min_lon + ix * w), precision))
+            cells.add(encode(lat, max_lon, precision))
+        for ix in range(nx):
+            cells.add(encode(max_lat, min(max_lon, min_lon + ix * w), precision))
+        cells.add(encode(max_lat, max_lon, precision))
+        best = sorted(cells)
+    return best
@@ -0,0 +1,179 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from PIL import Image, features
+
+from . import crud, leader, storage, thumbs
+from .config import get_settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_last_report: Optional[dict] = None
+_totals = {"runs": 0, "images": 0, "bytes_before": 0, "bytes_after": 0, "reclaimed": 0}
+
+
+class IOBudget:
+    """Token bucket limiting archive reads+writes to bytes_per_sec."""
+
+    def __init__(self, bytes_per_sec: float):
+        self.rate = max(1.0, float(bytes_per_sec))
+        self.tokens = self.rate
+        self.stamp = time.monotonic()
+
+    def consume(self, nbytes: int) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= nbytes
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
+
+
+def _reencode(data: bytes, fmt: str, quality: int) -> Tuple[Optional[bytes], str]:
+    if fmt == "webp" and not features.check("webp"):
+        fmt = "jpeg"
+    out = io.BytesIO()
+    with Image.open(io.BytesIO(data)) as im:
+        im = im.convert("RGB")
+        if fmt == "webp":
+            im.save(out, format="WEBP", quality=quality, method=4)
+            return out.getvalue(), ".webp"
+        im.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue(), ".jpg"
+
+
+def _append_to_pack(day: datetime, data: bytes, ext: str, digest: str, old_url: str) -> str:
+    """Append data to the per-day pack file and its offset index; returns the packed image_url."""
+    pack_rel = f"packs/{day:%Y}/{day:%m}/{day:%Y-%m-%d}.pack"
+    pack_abs = storage.abs_path(pack_rel)
+    os.makedirs(os.path.dirname(pack_abs), exist_ok=True)
+    with open(pack_abs, "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    # index line: offset, length, ext, sha256, original image_url
+    with open(pack_abs[:-5] + ".idx", "a", encoding="utf-8") as idx:
+        idx.write(f"{offset}\t{len(data)}\t{ext}\t{digest}\t{old_url}\n")
+    return storage.pack_url(pack_rel, offset, len(data), ext)
+
+
+def _archive_one(db, image_url: str, first_time: datetime, settings, budget: IOBudget, report: dict) -> None:
+    opened = storage.open_image(image_url)
+    if not opened:
+        report["missing"] += 1
+        return
+    src, _ = opened
+    with src:
+        data = src.read()
+    budget.consume(len(data))
+    new_data, ext = _reencode(data, settings.archive_format, settings.archive_quality)
+    if not new_data or len(new_data) >= len(data):
+        # not worth re-encoding; still move it out of the hot tier so it is not picked up again
+        new_data, ext = data, storage.normalize_ext(image_url)
+    budget.consume(len(new_data))
+    digest = hashlib.sha256(new_data).hexdigest()
+
+    if settings.archive_mode == "pack":
+        new_url = _append_to_pack(first_time, new_data, ext, digest, image_url)
+        refs = crud.repoint_alarm_images(db, image_url, new_url)
+    else:
+        new_url = storage.sharded_rel_path("cold", digest, ext)
+        refs = crud.repoint_alarm_images(db, image_url, new_url)
+        if refs:
+            storage.store_bytes(db, new_data, ext, "cold", refs=refs)
+    if not refs:
+        # alarms were deleted meanwhile
+        db.rollback()
+        return
+    # commits the repoint together with the reference move; raises (not counted) if that fails,
+    # and only then unlinks the hot file
+    if storage.release(db, image_url, refs=refs):
+        thumbs.remove_thumbnails(storage.abs_path(image_url))
+    report["images"] += 1
+    report["alarms"] += refs
+    report["bytes_before"] += len(data)
+    report["bytes_after"] += len(new_data)
+
+
+def run_once() -> dict:
+    """Archive one pass of hot-tier images older than archive_after_days; returns a report."""
+    global _last_report
+    settings = get_settings()
+    budget = IOBudget(settings.archive_io_mb_per_sec * 1024 * 1024)
+    cutoff = datetime.now(timezone.utc) - timedelta(days=settings.archive_after_days)
+    started = time.monotonic()
+    report = {
+        "mode": settings.archive_mode,
+        "format": settings.archive_format,
+        "cutoff": cutoff.isoformat(),
+        "images": 0,
+        "alarms": 0,
+        "missing": 0,
+        "failed": 0,
+        "bytes_before": 0,
+        "bytes_after": 0,
+    }
+    db = SessionLocal()
+    try:
+        after = ""
+        while True:
+            rows = crud.list_archive_candidates(db, cutoff, after, max(1, settings.archive_batch_size))
+            db.rollback()  # end the read transaction; each image commits on its own
+            if not rows:
+                break
+            for image_url, first_time in rows:
+                after = image_url
+                try:
+                    _archive_one(db, image_url, first_time, settings, budget, report)
+                except Exception:
+                    db.rollback()
+                    report["failed"] += 1
+                    logger.exception("Archive image failed: %s", image_url)
+    finally:
+        db.close()
+    report["reclaimed"] = report["bytes_before"] - report["bytes_after"]
+    report["elapsed_sec"] = round(time.monotonic() - started, 3)
+    report["finished_at"] = datetime.now(timezone.utc).isoformat()
+    with _lock:
+        _last_report = report
+        _totals["runs"] += 1
+        for k in ("images", "bytes_before", "bytes_after", "reclaimed"):
+            _totals[k] += report[k]
+    logger.info(
+        "Image archive pass: images=%s alarms=%s reclaimed=%.1fMB failed=%s missing=%s in %ss",
+        report["images"], report["alarms"], report["reclaimed"] / 1048576.0,
+        report["failed"], report["missing"], report["elapsed_sec"],
+    )
+    return report
+
+
+def get_report() -> dict:
+    with _lock:
+        return {"enabled": get_settings().archive_enabled, "last": _last_report, "totals": dict(_totals)}
+
+
+def _archive_loop():
+    interval = max(60, int(get_settings().archive_interval))
+    while True:
+        try:
+            # one archiver across worker processes (app/leader.py)
+            if leader.is_leader():
+                run_once()
+        except Exception:
+            logger.exception("Image archive loop iteration failed")
+        time.sleep(interval)
+
+
+def start_background() -> None:
+    t = threading.Thread(target=_archive_loop, name="image-archiver", daemon=True)
+    t.start()
+    logger.info("Started background task: image-archiver")
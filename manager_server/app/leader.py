@@ -0,0 +1,83 @@
+"""Leader election among worker processes for the jobs that must run exactly once
+(image archiving, device metric rollups and retention).
+
+Leadership is a session-level pg_try_advisory_lock held on a dedicated connection. When
+the leader exits or its connection drops, PostgreSQL releases the lock and another worker
+takes it over within CHECK_INTERVAL seconds. A single-process server becomes leader at
+startup. Jobs check is_leader() on every iteration.
+"""
+import logging
+import threading
+import time
+
+from .database import dedicated_engine
+
+logger = logging.getLogger(__name__)
+
+# arbitrary application-wide key for pg_advisory_lock
+LOCK_KEY = 7_010_044
+CHECK_INTERVAL = 15.0
+
+_leader = False
+_raw = None  # DBAPI connection holding the lock session
+_started = False
+_lock = threading.Lock()
+
+
+def is_leader() -> bool:
+    return _leader
+
+
+def _check() -> None:
+    """Take the lock if we do not hold it; otherwise prove the session holding it is alive."""
+    global _raw, _leader
+    if _raw is None:
+        _raw = dedicated_engine.raw_connection()
+        _raw.driver_connection.autocommit = True
+    with _raw.driver_connection.cursor() as cur:
+        if _leader:
+            cur.execute("SELECT 1")
+            return
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_KEY,))
+        if cur.fetchone()[0]:
+            _leader = True
+            logger.info("This worker is now leader for singleton background jobs")
+
+
+def _reset(error: Exception) -> None:
+    global _raw, _leader
+    if _leader:
+        logger.warning("Leader lock lost: %s", error)
+    _leader = False
+    if _raw is not None:
+        try:
+            _raw.invalidate()
+        except Exception:
+            pass
+    _raw = None
+
+
+def _run() -> None:
+    while True:
+        time.sleep(CHECK_INTERVAL)
+        try:
+            _check()
+        except Exception as e:
+            _reset(e)
+
+
+def start_background() -> None:
+    """The first attempt runs inline so a leader knows its role before its jobs start."""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    try:
+        _check()
+    except Exception as e:
+        logger.warning("Leader election unavailable for now: %s", e)
+        _reset(e)
+    t = threading.Thread(target=_run, name="leader-election", daemon=True)
+    t.start()
+    logger.info("Started background task: leader-election (leader=%s)", _leader)
@@ -0,0 +1,66 @@
+"""Root logger setup: log_dir/manager_server.log (rotating) plus the console.
+
+With several worker processes (run_server.py --workers N) only the supervisor owns the
+file: each worker swaps its handlers for a QueueHandler (to_queue) and the supervisor's
+QueueListener (start_listener) writes the records. Rotation renames the file, which is
+unsafe from several processes and fails on Windows while another process holds it open.
+"""
+import logging
+import os
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from .config import get_settings
+
+LOG_FILE = "manager_server.log"
+
+
+def _level() -> int:
+    return getattr(logging, str(getattr(get_settings(), "log_level", "INFO")).upper(), logging.INFO)
+
+
+def setup() -> None:
+    """Attach the file and console handlers to the root logger once per process; a worker
+    that already forwards to the supervisor (to_queue) is left alone."""
+    root = logging.getLogger()
+    if any(isinstance(h, QueueHandler) for h in root.handlers):
+        return
+    settings = get_settings()
+    log_dir = getattr(settings, "log_dir", "./logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    log_path = os.path.join(log_dir, LOG_FILE)
+
+    formatter = logging.Formatter(
+        fmt="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    file_handler = RotatingFileHandler(log_path, maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8")
+    file_handler.setFormatter(formatter)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    if not any(isinstance(h, RotatingFileHandler) for h in root.handlers):
+        root.addHandler(file_handler)
+    if not any(isinstance(h, logging.StreamHandler) for h in root.handlers):
+        root.addHandler(console_handler)
+    root.setLevel(_level())
+
+
+def start_listener(queue) -> QueueListener:
+    """Supervisor side: write the workers' records through this process's root handlers."""
+    setup()
+    listener = QueueListener(queue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def to_queue(queue) -> None:
+    """Worker side: replace the root handlers (inherited over fork) with one that sends to the supervisor."""
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+        h.close()  # this process's copy of an inherited file handle
+    root.addHandler(QueueHandler(queue))
+    root.setLevel(_level())
@@ -1,53 +1,26 @@
-import os
 import logging
-from logging.handlers import RotatingFileHandler
 import threading
-import time
-import requests
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from .database import engine, Base, SessionLocal
-from .routers import alarms, config, users, routes, devices
+from .routers import alarms, config, users, routes, devices, device_channel
 from .config import get_settings
-from . import crud, schemas
+from . import image_archiver, fleet, log_setup, device_state, device_metrics, config_store, metrics, leader, worker_bus, database
+from .compression import GZipMiddleware
 
-Base.metadata.create_all(bind=engine)
+# the schema is created by the explicit migrate step (app/migrate.py), not at startup
 
-
-def _setup_logging():
-    settings = get_settings()
-    log_dir = getattr(settings, "log_dir", "./logs")
-    log_level = getattr(settings, "log_level", "INFO")
-    os.makedirs(log_dir, exist_ok=True)
-
-    log_path = os.path.join(log_dir, "manager_server.log")
-
-    formatter = logging.Formatter(
-        fmt="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
-
-    file_handler = RotatingFileHandler(log_path, maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8")
-    file_handler.setFormatter(formatter)
-
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-
-    root = logging.getLogger()
-    if not any(isinstance(h, RotatingFileHandler) for h in root.handlers):
-        root.addHandler(file_handler)
-    if not any(isinstance(h, logging.StreamHandler) for h in root.handlers):
-        root.addHandler(console_handler)
-    root.setLevel(getattr(logging, str(log_level).upper(), logging.INFO))
-
-
-_setup_logging()
+# workers under run_server.py --workers forward to the supervisor instead (app/log_setup.py)
+log_setup.setup()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Alarm Service", version="0.1.0")
 logger.info("FastAPI application initialized")
 
+app.add_middleware(metrics.MetricsMiddleware)
+if get_settings().gzip_min_size > 0:
+    # complete JSON/text bodies only; streams and files pass through (app/compression.py)
+    app.add_middleware(GZipMiddleware, minimum_size=get_settings().gzip_min_size)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -61,6 +34,7 @@ app.include_router(config.router)
 app.include_router(users.router)
 app.include_router(routes.router)
 app.include_router(devices.router)
+app.include_router(device_channel.router)
 
 
 @app.get("/health")
@@ -68,43 +42,15 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus text exposition of this worker's metrics (see app/metrics.py)."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 def _refresh_devices_loop():
-    settings = get_settings()
-    interval = max(1, int(getattr(settings, "device_refresh_time", 180)))
-    listen_port = int(getattr(settings, "device_listen_port", 9000))
-    while True:
-        try:
-            db = SessionLocal()
-            try:
-                items = crud.list_devices(db)
-                for d in items:
-                    ip = getattr(d, "device_ip", None)
-                    if not ip:
-                        continue
-                    url = f"http://{ip}:{listen_port}/api/v1/client/device"
-                    try:
-                        r = requests.get(url, timeout=5)
-                        if r.status_code == 200:
-                            body = r.json() or {}
-                            dev_cfg = body.get("device_config")
-                            dev_info = body.get("device_info")
-                            update = schemas.DeviceUpdate(
-                                device_config=dev_cfg,
-                                device_info=dev_info,
-                            )
-                            crud.update_device(db, d.device_id, update)
-                            logger.debug("Refreshed device info from %s", ip)
-                        else:
-                            logger.warning("Device %s responded with status %s", ip, r.status_code)
-                    except Exception:
-                        # ignore failures for individual devices
-                        logger.exception("Failed to refresh device info from %s", ip)
-            finally:
-                db.close()
-        except Exception:
-            # ignore loop-level failures
-            logger.exception("Device refresher loop iteration failed")
-        time.sleep(interval)
+    # concurrent, jittered sweeps over all devices (see app/fleet.py)
+    fleet.refresh_forever()
 
 
 def _start_background_tasks():
@@ -115,3 +61,28 @@ def _start_background_tasks():
 
 # todo 暂时不使用主动刷新，设备信息使用设备主动上传信息的方式
 # _start_background_tasks()
+
+
+@app.on_event("startup")
+def _start_background():
+    # started per worker process, so a preloading supervisor (run_server.py) holds no threads
+    # singleton jobs (archiving, metric rollups) run only in the leader worker
+    leader.start_background()
+    # health/lag checks of database.read_urls (get_read_db falls back to the primary)
+    database.start_replica_checks()
+    # cache/alarm/device-state changes from other workers
+    worker_bus.start_background()
+    if get_settings().archive_enabled:
+        image_archiver.start_background()
+    # batched write-behind of device heartbeats into t_device
+    device_state.start_background()
+    # device metric samples, 1m/1h rollups and retention
+    device_metrics.start_background()
+    # config_kv snapshot follows NOTIFY config_kv (polling as fallback)
+    config_store.start_background()
+
+
+@app.on_event("shutdown")
+def _flush_device_state():
+    device_state.flush()
+    device_metrics.flush_samples()
@@ -1,4 +1,3 @@
-import requests
 from .config import get_settings
 
 settings = get_settings()
@@ -11,6 +10,7 @@ def baidu_reverse_geocode(latitude, longitude):
     :param ak: 百度地图开放平台获取的 API 密钥（AK）
     :return: 解析成功返回地点信息字典，失败返回 None
     """
+    import requests  # 按需导入，不拖慢服务启动
     # 百度逆地理解析 API 接口地址（JSON 格式返回，更易解析）
     # api_url = "http://api.map.baidu.com/geocoder/v2/"
     api_url = "https://api.map.baidu.com/reverse_geocoding/v3/"
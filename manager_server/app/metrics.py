@@ -0,0 +1,240 @@
+"""Minimal Prometheus text-format metrics (no client library needed).
+
+    REQUEST_LATENCY.observe(0.012, method="GET", route="/api/v1/devices", status="200")
+    with ALARM_STAGE.time(stage="geocode"): ...
+    GET /metrics  -> text/plain; version=0.0.4
+
+Metrics are per process; with several workers each one exposes its own series
+(scrape every worker or sum them downstream).
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("manager_server.slow_query")
+
+# seconds; covers cache hits (sub-ms) up to slow exports
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+
+# op name of the crud call currently executing (labels slow-query log lines)
+current_op: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_op", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Set/inc/dec gauge, or a callback gauge: fn() -> {label tuple: value}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), fn: Optional[Callable[[], Dict[Tuple, float]]] = None):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple, float] = {}
+        self._fn = fn
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        if self._fn is not None:
+            try:
+                items = list(self._fn().items())
+            except Exception:
+                logger.exception("Gauge callback failed: %s", self.name)
+                items = []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            s[0][idx] += 1
+            s[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(s[0]), s[1]) for k, s in self._series.items()]
+        out = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = 'le="%s"' % bound
+                out.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            cumulative += counts[-1]
+            le = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+            out.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return out
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in list(_registry):
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status")
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served", ("method",))
+DB_OP_LATENCY = Histogram("db_op_duration_seconds", "crud statement/commit time by op name", ("op",))
+DB_OP_ERRORS = Counter("db_op_errors_total", "crud statements/commits that raised, by op name", ("op",))
+DB_STATEMENT_LATENCY = Histogram("db_statement_duration_seconds", "Time of every SQL statement on the engine")
+DB_SLOW_STATEMENTS = Counter("db_slow_statements_total", "SQL statements above slow_query_ms")
+POOL_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection")
+ALARM_STAGE = Histogram(
+    "alarm_ingest_stage_seconds", "create_alarm time per stage (image_write, image_hash, thumbnails, "
+    "similarity, geocode, route_match, insert)", ("stage",)
+)
+
+
+def observe_db_op(op: str, elapsed: float, ok: bool = True) -> None:
+    DB_OP_LATENCY.observe(elapsed, op=op)
+    if not ok:
+        DB_OP_ERRORS.inc(op=op)
+
+
+def observe_statement(statement: str, elapsed: float) -> None:
+    DB_STATEMENT_LATENCY.observe(elapsed)
+    threshold = get_settings().slow_query_ms
+    if threshold > 0 and elapsed * 1000 >= threshold:
+        DB_SLOW_STATEMENTS.inc()
+        slow_logger.warning(
+            "Slow query %.0f ms op=%s: %s", elapsed * 1000, current_op.get() or "-", " ".join(str(statement).split())[:2000]
+        )
+
+
+def register_pool(engine) -> None:
+    """Pool gauges read from engine.pool at scrape time."""
+    pool = engine.pool
+
+    def stats() -> Dict[Tuple, float]:
+        return {
+            ("size",): pool.size(),
+            ("checked_out",): pool.checkedout(),
+            ("checked_in",): pool.checkedin(),
+            # QueuePool.overflow() is negative until pool_size connections exist
+            ("overflow",): max(0, pool.overflow()),
+        }
+
+    Gauge("db_pool_connections", "SQLAlchemy pool state (size, checked_out, checked_in, overflow)", ("state",), fn=stats)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: per-route latency histogram and in-flight gauge for HTTP requests.
+    Routes are labelled by their template (/api/v1/alarms/{alarm_id}); unmatched paths share one label."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope.get("method", "")
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(method=method)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec(method=method)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_LATENCY.observe(time.perf_counter() - t0, method=method, route=route, status=str(status["code"]))
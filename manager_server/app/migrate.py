@@ -0,0 +1,152 @@
+"""Explicit schema step, run once per deployment/upgrade instead of on every server start:
+
+    python run_server.py migrate            (manager_server.exe migrate)
+
+Creates the tables the models have and the database lacks, then applies the pending
+versioned scripts in sql/migrations (NNNN_name.sql, in version order) and records
+each in schema_migrations. Scripts are idempotent (IF NOT EXISTS), so databases that
+ran some of them by hand before versioning are upgraded safely. A script whose first
+line is "-- migrate: no-transaction" runs statement by statement in autocommit (for
+CREATE INDEX CONCURRENTLY, which keeps alarm ingest writing while indexes build);
+every other script runs in one transaction together with its record.
+"""
+import hashlib
+import logging
+import os
+import re
+import sys
+import time
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy.engine import Engine
+
+from . import models  # noqa: F401  (registers the tables on Base.metadata)
+from .config import BASE_DIR
+from .database import Base, dedicated_engine, engine
+
+logger = logging.getLogger(__name__)
+
+# bundled next to the code in the frozen exe (build_onedir.bat --add-data)
+MIGRATIONS_DIR = os.path.join(getattr(sys, "_MEIPASS", BASE_DIR), "sql", "migrations")
+NO_TRANSACTION = "-- migrate: no-transaction"
+# pg_advisory_lock key, so two concurrent migrate runs apply each script once
+LOCK_KEY = 7_010_049
+
+TRACKING_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(128) NOT NULL,
+    checksum CHAR(64) NOT NULL,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+INVALID_INDEXES_SQL = """
+SELECT c.relname FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE NOT i.indisvalid AND n.nspname = current_schema()
+"""
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sql: str
+    checksum: str
+
+    @property
+    def transactional(self) -> bool:
+        return not self.sql.lstrip().startswith(NO_TRANSACTION)
+
+
+def discover(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    out = []
+    for filename in sorted(os.listdir(directory)):
+        m = re.match(r"^(\d+)_(\w+)\.sql$", filename)
+        if not m:
+            continue
+        with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+            sql = f.read()
+        out.append(Migration(int(m.group(1)), m.group(2), sql, hashlib.sha256(sql.encode("utf-8")).hexdigest()))
+    versions = [mig.version for mig in out]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return sorted(out)
+
+
+def statements(sql: str) -> List[str]:
+    """Split a no-transaction script on ';' (such scripts hold plain statements only, no DO blocks)."""
+    lines = [line for line in sql.splitlines() if not line.lstrip().startswith("--")]
+    return [s.strip() for s in "\n".join(lines).split(";") if s.strip()]
+
+
+def _record(cur, migration: Migration) -> None:
+    cur.execute(
+        "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+        (migration.version, migration.name, migration.checksum),
+    )
+
+
+def apply(cur, migration: Migration, record: bool = True) -> None:
+    """Run one script on a psycopg2 cursor whose connection is in autocommit mode."""
+    if migration.transactional:
+        cur.execute("BEGIN")
+        try:
+            cur.execute(migration.sql)
+            if record:
+                _record(cur, migration)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        return
+    for stmt in statements(migration.sql):
+        cur.execute(stmt)
+    # an interrupted CREATE INDEX CONCURRENTLY leaves an INVALID index that IF NOT EXISTS would skip
+    cur.execute(INVALID_INDEXES_SQL)
+    invalid = [r[0] for r in cur.fetchall()]
+    if invalid:
+        raise RuntimeError(
+            f"Invalid indexes after migration {migration.version}: {', '.join(invalid)}; "
+            "DROP INDEX CONCURRENTLY them and run migrate again"
+        )
+    if record:
+        _record(cur, migration)
+
+
+def run(bind: Optional[Engine] = None) -> None:
+    """Bring the database behind bind (default: the configured one) up to date."""
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    migrations = discover()
+    raw = (dedicated_engine if bind is engine else bind).raw_connection()
+    conn = raw.driver_connection
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+            try:
+                cur.execute(TRACKING_SQL)
+                cur.execute("SELECT version, checksum FROM schema_migrations")
+                applied = dict(cur.fetchall())
+                for mig in migrations:
+                    label = f"{mig.version:04d}_{mig.name}"
+                    if mig.version in applied:
+                        if applied[mig.version].strip() != mig.checksum:
+                            logger.warning("Migration %s was changed after it was applied", label)
+                        continue
+                    logger.info("Applying migration %s", label)
+                    t0 = time.perf_counter()
+                    apply(cur, mig)
+                    logger.info("Applied migration %s in %.1fs", label, time.perf_counter() - t0)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+    finally:
+        conn.autocommit = False
+        raw.close()
+    logger.info(
+        "Schema up to date: %s tables, migration %s",
+        len(Base.metadata.tables),
+        migrations[-1].version if migrations else 0,
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, LargeBinary, Float, Numeric
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, DateTime, Text, ForeignKey, LargeBinary, Float, Numeric, Index, Sequence, text
 from sqlalchemy.dialects.postgresql import ENUM as PG_ENUM, JSONB
 from sqlalchemy.sql import func
 from .database import Base
@@ -43,6 +43,39 @@ class Device(Base):
     status = Column(device_status_enum, nullable=False, server_default="offline")
     create_time = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     update_time = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_seen = Column(DateTime(timezone=True), nullable=True)
+
+
+class DeviceMetric(Base):
+    """Raw device metric samples (see app/device_metrics.py), kept for device_metric_raw_days."""
+    __tablename__ = "t_device_metric"
+
+    device_id = Column(Integer, ForeignKey("t_device.device_id", ondelete="CASCADE"), primary_key=True)
+    ts = Column(DateTime(timezone=True), primary_key=True)
+    cpu_percent = Column(Float, nullable=True)
+    mem_percent = Column(Float, nullable=True)
+    mem_used_mb = Column(Float, nullable=True)
+    gpu_util = Column(Float, nullable=True)
+    gpu_mem_percent = Column(Float, nullable=True)
+
+
+class DeviceMetricRollup(Base):
+    """Downsampled device metrics; step is the bucket width in seconds (60 or 3600)."""
+    __tablename__ = "t_device_metric_rollup"
+
+    device_id = Column(Integer, ForeignKey("t_device.device_id", ondelete="CASCADE"), primary_key=True)
+    step = Column(SmallInteger, primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    samples = Column(Integer, nullable=False)
+    cpu_avg = Column(Float, nullable=True)
+    cpu_max = Column(Float, nullable=True)
+    mem_avg = Column(Float, nullable=True)
+    mem_max = Column(Float, nullable=True)
+    mem_used_avg = Column(Float, nullable=True)
+    gpu_util_avg = Column(Float, nullable=True)
+    gpu_util_max = Column(Float, nullable=True)
+    gpu_mem_avg = Column(Float, nullable=True)
+    gpu_mem_max = Column(Float, nullable=True)
 
 
 class AlarmInfo(Base):
@@ -66,9 +99,41 @@ class AlarmInfo(Base):
     user_code = Column(String(64), ForeignKey("t_user.user_code", onupdate="CASCADE", ondelete="SET NULL"), nullable=True)
     address = Column(String(1024), nullable=True)
     simple_address = Column(String(1024), nullable=True)
+    # nearest patrol route (see app/route_matching.py): chainage along it and distance off it, meters
+    route_id = Column(Integer, ForeignKey("t_route.route_id", ondelete="SET NULL"), nullable=True)
+    route_offset_m = Column(Float, nullable=True)
+    route_distance_m = Column(Float, nullable=True)
+    # geohash of (latitude, longitude) at app.geohash.STORED_PRECISION, for map clustering
+    geohash = Column(String(12), nullable=True)
     create_time = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     update_time = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
 
+    __table_args__ = (
+        Index("idx_alarm_route_offset", "route_id", "route_offset_m"),
+        Index("idx_alarm_geohash", "geohash", postgresql_ops={"geohash": "varchar_pattern_ops"}),
+        # list/count/need_alarm query shapes in app/crud.py (sql/migrations/0007_alarm_query_indexes.sql)
+        Index("idx_alarm_time", "alarm_time"),
+        Index("idx_alarm_active_time", "alarm_time", postgresql_where=text("process_status <> 'auto_ignore'")),
+        Index("idx_alarm_status_time", "process_status", "alarm_time"),
+        Index("idx_alarm_user_status_time", "user_code", "process_status", "alarm_time"),
+        Index("idx_alarm_user_active_time", "user_code", "alarm_time", postgresql_where=text("process_status <> 'auto_ignore'")),
+        Index("idx_alarm_type_active_time", "alarm_type", "alarm_time", postgresql_where=text("process_status <> 'auto_ignore'")),
+        Index(
+            "idx_alarm_ignored_time",
+            "alarm_time",
+            postgresql_include=["image_hash", "latitude", "longitude"],
+            postgresql_where=text("process_status = 'ignore'"),
+        ),
+        # hot-tier images for the archiver (crud.list_archive_candidates / repoint_alarm_images)
+        Index("idx_alarm_hot_image", "image_url", "alarm_time", postgresql_where=text("image_url LIKE 'alarms/%'")),
+        # the trigram search indexes (idx_alarm_address_trgm, idx_alarm_notes_trgm) need pg_trgm, which
+        # create_all runs before; sql/migrations/0009_alarm_search_indexes.sql owns them
+    )
+
+
+# every config_kv write takes the next value, so max(version) versions the whole table
+config_version_seq = Sequence("config_kv_version_seq")
+
 
 class ConfigKV(Base):
     __tablename__ = "config_kv"
@@ -76,6 +141,7 @@ class ConfigKV(Base):
     id = Column(Integer, primary_key=True, index=True)
     key = Column(String(100), unique=True, index=True, nullable=False)
     value = Column(Text, nullable=True)
+    version = Column(BigInteger, config_version_seq, nullable=False, server_default=config_version_seq.next_value())
 
 
 class User(Base):
@@ -101,9 +167,21 @@ class Route(Base):
 
     route_id = Column(Integer, primary_key=True, index=True)
     route_name = Column(String(128), nullable=False)
-    route_file_path = Column(String(1024), nullable=False, unique=True)
+    # content-addressed (app/storage.py): routes uploading identical files share one path
+    route_file_path = Column(String(1024), nullable=False)
     upload_user_code = Column(String(64), ForeignKey("t_user.user_code", onupdate="CASCADE", ondelete="SET NULL"), nullable=True)
     route_desc = Column(Text, nullable=True)
     route_format = Column(file_format_enum, nullable=False, server_default="gps")
     create_time = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     update_time = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class StoredFile(Base):
+    """Reference-counted content-addressed upload (see app/storage.py)."""
+    __tablename__ = "t_stored_file"
+
+    file_path = Column(String(1024), primary_key=True)
+    sha256 = Column(String(64), nullable=False, index=True)
+    file_size = Column(BigInteger, nullable=False, server_default="0")
+    ref_count = Column(Integer, nullable=False, server_default="0")
+    create_time = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
@@ -0,0 +1,130 @@
+"""Background PostgreSQL LISTEN loop shared by modules that react to NOTIFY.
+
+    pg_listener.subscribe("config_kv", on_notify, on_idle=poll)
+
+on_notify(payload) runs on the listener thread for every NOTIFY on the channel.
+on_idle() runs every POLL_INTERVAL seconds and after (re)connecting, so a missed
+notification (listener down, connection dropped) is caught up by polling. If LISTEN
+cannot be established at all the loop keeps polling and retries with backoff.
+"""
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from .database import dedicated_engine
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 30.0
+_RETRY_MAX = 60.0
+
+_lock = threading.Lock()
+_handlers: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+_idle: List[Callable[[], None]] = []
+_thread: Optional[threading.Thread] = None
+_connected = False
+
+
+def subscribe(channel: str, on_notify: Callable[[str], None], on_idle: Optional[Callable[[], None]] = None) -> None:
+    """Register handlers and make sure the listener thread runs (channel is a plain identifier)."""
+    global _thread
+    if not channel.replace("_", "").isalnum():
+        raise ValueError(f"invalid channel name: {channel!r}")
+    with _lock:
+        _handlers[channel].append(on_notify)
+        if on_idle is not None:
+            _idle.append(on_idle)
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="pg-listener", daemon=True)
+            _thread.start()
+            logger.info("Started background task: pg-listener")
+
+
+def notify(db, channel: str, payload: str) -> None:
+    """Queue a NOTIFY in db's transaction (delivered to listeners when it commits)."""
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+
+
+def is_connected() -> bool:
+    return _connected
+
+
+def _run_idle() -> None:
+    with _lock:
+        callbacks = list(_idle)
+    for fn in callbacks:
+        try:
+            fn()
+        except Exception:
+            logger.exception("pg-listener idle callback failed: %s", getattr(fn, "__name__", fn))
+
+
+def _dispatch(channel: str, payload: str) -> None:
+    with _lock:
+        callbacks = list(_handlers.get(channel, ()))
+    for fn in callbacks:
+        try:
+            fn(payload)
+        except Exception:
+            logger.exception("pg-listener handler failed: channel=%s", channel)
+
+
+def _listen_once() -> None:
+    """One LISTEN session on a dedicated connection; returns/raises when it drops."""
+    global _connected
+    raw = dedicated_engine.raw_connection()
+    try:
+        conn = raw.driver_connection
+        conn.autocommit = True
+        with _lock:
+            channels = list(_handlers)
+        with conn.cursor() as cur:
+            for channel in channels:
+                cur.execute(f'LISTEN "{channel}"')
+        _connected = True
+        logger.info("pg-listener listening: %s", ", ".join(channels))
+        _run_idle()
+        next_idle = time.monotonic() + POLL_INTERVAL
+        while True:
+            with _lock:
+                if set(_handlers) != set(channels):
+                    return  # new channel subscribed: reconnect to LISTEN on it
+            timeout = max(0.0, next_idle - time.monotonic())
+            if select.select([conn], [], [], min(timeout, 5.0)) != ([], [], []):
+                conn.poll()
+                while conn.notifies:
+                    n = conn.notifies.pop(0)
+                    _dispatch(n.channel, n.payload)
+            if time.monotonic() >= next_idle:
+                _run_idle()
+                next_idle = time.monotonic() + POLL_INTERVAL
+    finally:
+        _connected = False
+        try:
+            raw.invalidate()
+        except Exception:
+            pass
+
+
+def _run() -> None:
+    delay = 1.0
+    while True:
+        started = time.monotonic()
+        try:
+            _listen_once()
+            continue
+        except Exception as e:
+            logger.warning("pg-listener connection lost: %s (polling until reconnect)", e)
+        if time.monotonic() - started > _RETRY_MAX:
+            delay = 1.0
+        # keep callers fresh by polling while LISTEN is unavailable
+        deadline = time.monotonic() + delay
+        while time.monotonic() < deadline:
+            _run_idle()
+            time.sleep(min(POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+        delay = min(delay * 2, _RETRY_MAX)
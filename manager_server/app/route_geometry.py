@@ -0,0 +1,221 @@
+import json
+import math
+import os
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+# meters per pixel at zoom 0 on the equator (256 px web-mercator tiles)
+_M_PER_PX_Z0 = 156543.03392
+_MAX_ZOOM = 22
+_EARTH_R = 6371000.0
+
+
+class RouteGeometry:
+    """Compact route polyline: lon/lat in parallel float arrays, plus Douglas-Peucker
+    significance weights computed once so every simplification level is a cheap filter.
+    """
+
+    def __init__(self, lons: array, lats: array, weights: Optional[array] = None):
+        self.lons = lons
+        self.lats = lats
+        self._weights: Optional[array] = weights
+        self._levels: Dict[int, array] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.lons)
+
+    def _xy(self):
+        # local equirectangular projection in meters; accurate enough for route-scale extents
+        import numpy as np
+
+        lons = np.frombuffer(self.lons, dtype=np.float64)
+        lats = np.frombuffer(self.lats, dtype=np.float64)
+        lat0 = math.radians(float(lats.mean())) if len(lats) else 0.0
+        kx = _EARTH_R * math.cos(lat0) * math.pi / 180.0
+        ky = _EARTH_R * math.pi / 180.0
+        return lons * kx, lats * ky
+
+    def weights(self) -> array:
+        """Per-point DP significance in meters (endpoints = inf). A point survives tolerance t
+        iff weight > t; children are clamped to their parent so levels nest."""
+        if self._weights is not None:
+            return self._weights
+        import numpy as np
+
+        n = len(self.lons)
+        w = np.zeros(n, dtype=np.float64)
+        if n:
+            w[0] = w[n - 1] = np.inf
+        if n > 2:
+            xs, ys = self._xy()
+            lx, ly = xs.tolist(), ys.tolist()
+            stack = [(0, n - 1, math.inf)]
+            while stack:
+                a, b, cap = stack.pop()
+                if b - a < 2:
+                    continue
+                if b - a < 64:
+                    # numpy call overhead dominates on short spans
+                    best_i, d2max = _farthest(lx, ly, a, b)
+                else:
+                    ax, ay = xs[a], ys[a]
+                    dx, dy = xs[b] - ax, ys[b] - ay
+                    seg2 = dx * dx + dy * dy
+                    px = xs[a + 1:b] - ax
+                    py = ys[a + 1:b] - ay
+                    if seg2 > 0.0:
+                        t = np.clip((px * dx + py * dy) / seg2, 0.0, 1.0)
+                        px = px - t * dx
+                        py = py - t * dy
+                    d2 = px * px + py * py
+                    k = int(np.argmax(d2))
+                    best_i, d2max = a + 1 + k, float(d2[k])
+                dist = min(math.sqrt(d2max), cap)
+                w[best_i] = dist
+                stack.append((a, best_i, dist))
+                stack.append((best_i, b, dist))
+        self._weights = array("d", w.tobytes())
+        return self._weights
+
+    def indices_for_tolerance(self, tolerance_m: float) -> array:
+        import numpy as np
+
+        w = np.frombuffer(self.weights(), dtype=np.float64)
+        return array("I", np.flatnonzero(w > tolerance_m).astype(np.uint32).tobytes())
+
+    def indices_for_zoom(self, zoom: int) -> array:
+        """Point indices kept at a web-map zoom level (1 px tolerance), cached per level."""
+        zoom = max(0, min(_MAX_ZOOM, int(zoom)))
+        with self._lock:
+            cached = self._levels.get(zoom)
+        if cached is not None:
+            return cached
+        lat0 = sum(self.lats) / len(self.lats) if len(self.lats) else 0.0
+        tol = _M_PER_PX_Z0 * math.cos(math.radians(lat0)) / (2 ** zoom)
+        idx = self.indices_for_tolerance(tol)
+        with self._lock:
+            self._levels[zoom] = idx
+        return idx
+
+    def coords(self, indices=None) -> List[List[float]]:
+        if indices is None:
+            return [[lo, la] for lo, la in zip(self.lons, self.lats)]
+        return [[self.lons[i], self.lats[i]] for i in indices]
+
+    def encoded(self, indices=None, precision: int = 5) -> str:
+        seq = range(len(self.lons)) if indices is None else indices
+        return encode_polyline(((self.lats[i], self.lons[i]) for i in seq), precision)
+
+
+def _farthest(xs: List[float], ys: List[float], a: int, b: int):
+    """Index in (a, b) farthest from segment a-b, and its squared distance."""
+    ax, ay = xs[a], ys[a]
+    dx, dy = xs[b] - ax, ys[b] - ay
+    seg2 = dx * dx + dy * dy
+    best, best_i = -1.0, a + 1
+    for i in range(a + 1, b):
+        px, py = xs[i] - ax, ys[i] - ay
+        if seg2 > 0.0:
+            t = (px * dx + py * dy) / seg2
+            t = 0.0 if t < 0.0 else (1.0 if t > 1.0 else t)
+            px, py = px - t * dx, py - t * dy
+        d = px * px + py * py
+        if d > best:
+            best, best_i = d, i
+    return best_i, best
+
+
+def _encode_value(v: int, out: List[str]) -> None:
+    v = ~(v << 1) if v < 0 else (v << 1)
+    while v >= 0x20:
+        out.append(chr((0x20 | (v & 0x1F)) + 63))
+        v >>= 5
+    out.append(chr(v + 63))
+
+
+def encode_polyline(lat_lon_pairs, precision: int = 5) -> str:
+    """Google encoded polyline algorithm (lat, lon order)."""
+    factor = 10 ** precision
+    out: List[str] = []
+    plat = plon = 0
+    for lat, lon in lat_lon_pairs:
+        ilat = int(round(lat * factor))
+        ilon = int(round(lon * factor))
+        _encode_value(ilat - plat, out)
+        _encode_value(ilon - plon, out)
+        plat, plon = ilat, ilon
+    return "".join(out)
+
+
+def from_points(points) -> RouteGeometry:
+    """Build geometry from [[lon, lat], ...] / [{"lon":..,"lat":..}, ...]; raises ValueError."""
+    lons = array("d")
+    lats = array("d")
+    for item in points:
+        if isinstance(item, (list, tuple)) and len(item) >= 2:
+            lons.append(float(item[0]))
+            lats.append(float(item[1]))
+        elif isinstance(item, dict) and "lon" in item and "lat" in item:
+            lons.append(float(item["lon"]))
+            lats.append(float(item["lat"]))
+    return RouteGeometry(lons, lats)
+
+
+# ---- routes_file source (parsed once per file mtime) ----
+_file_lock = threading.Lock()
+_file_state: Dict[str, object] = {"path": None, "mtime": None, "raw": None}
+_route_cache: Dict[str, RouteGeometry] = {}
+
+
+def _load_routes_file(path: str) -> dict:
+    st = os.stat(path)
+    with _file_lock:
+        if _file_state["path"] == path and _file_state["mtime"] == st.st_mtime_ns:
+            return _file_state["raw"]  # type: ignore[return-value]
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    # Expected structure examples:
+    # { "123": [[lon, lat], ...], "124": [...] }
+    # or { "routes": { "123": [...] } }
+    raw = {}
+    if isinstance(data, dict):
+        if isinstance(data.get("routes"), dict):
+            raw.update(data["routes"])
+        for k, v in data.items():
+            if k != "routes" and isinstance(v, list):
+                raw[k] = v
+    with _file_lock:
+        _file_state.update(path=path, mtime=st.st_mtime_ns, raw=raw)
+        _route_cache.clear()
+    return raw
+
+
+def get_from_routes_file(path: str, route_id: int) -> Optional[RouteGeometry]:
+    """Geometry for route_id from the temporary routes_file, cached until the file changes.
+    Raises OSError/ValueError if the file cannot be read or has invalid coordinates.
+    """
+    raw = _load_routes_file(path)
+    key = str(route_id)
+    with _file_lock:
+        geo = _route_cache.get(key)
+    if geo is not None:
+        return geo
+    coords = raw.get(key)
+    if not coords:
+        return None
+    geo = from_points(coords)
+    if not len(geo):
+        return None
+    with _file_lock:
+        _route_cache[key] = geo
+    return geo
+
+
+def invalidate(route_id: Optional[int] = None) -> None:
+    with _file_lock:
+        if route_id is None:
+            _route_cache.clear()
+        else:
+            _route_cache.pop(str(route_id), None)
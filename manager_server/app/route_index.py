@@ -0,0 +1,391 @@
+"""Parsed route point storage with a segment grid index.
+
+Each uploaded route file is parsed (in the background) into
+<upload_dir>/routes/index/<route_id>.rtx, a little-endian binary file:
+
+    header   <4sHHIIIddd  magic b"KKRT", version, reserved, n_points, nx, ny, min_lon, min_lat, cell_deg
+    lons     float64[n]
+    lats     float64[n]
+    weights  float64[n]   Douglas-Peucker significance (see route_geometry.RouteGeometry.weights)
+    offsets  uint32[nx*ny + 1]
+    seg_ids  uint32[...]  CSR layout: segments (i, i+1) overlapping cell c are seg_ids[offsets[c]:offsets[c+1]]
+
+plus <route_id>.json with parse status/metadata (source file, format, status pending/ready/failed).
+"""
+import json
+import logging
+import math
+import os
+import re
+import struct
+import threading
+import uuid
+from array import array
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import storage
+from .config import get_settings
+from .route_geometry import RouteGeometry, from_points
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"KKRT"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHHIIIddd")
+# aim for a handful of segments per grid cell
+_SEGMENTS_PER_CELL = 4
+_MAX_CELLS = 1 << 20
+_EARTH_R = 6371000.0
+# a build still "pending" after this many seconds is treated as interrupted
+PENDING_TIMEOUT = 600
+
+_NUM_RE = re.compile(r"[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+
+
+class SegmentGrid:
+    """Uniform lon/lat grid over route segments (CSR cell -> segment ids)."""
+
+    def __init__(self, min_lon: float, min_lat: float, cell: float, nx: int, ny: int, offsets: array, seg_ids: array):
+        self.min_lon = min_lon
+        self.min_lat = min_lat
+        self.cell = cell
+        self.nx = nx
+        self.ny = ny
+        self.offsets = offsets
+        self.seg_ids = seg_ids
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        return (self.min_lon, self.min_lat, self.min_lon + self.nx * self.cell, self.min_lat + self.ny * self.cell)
+
+    def candidates(self, lon: float, lat: float, radius_deg: float) -> List[int]:
+        """Segment ids whose cells intersect the square of radius_deg around (lon, lat)."""
+        ix0 = max(0, int(math.floor((lon - radius_deg - self.min_lon) / self.cell)))
+        ix1 = min(self.nx - 1, int(math.floor((lon + radius_deg - self.min_lon) / self.cell)))
+        iy0 = max(0, int(math.floor((lat - radius_deg - self.min_lat) / self.cell)))
+        iy1 = min(self.ny - 1, int(math.floor((lat + radius_deg - self.min_lat) / self.cell)))
+        if ix0 > ix1 or iy0 > iy1:
+            return []
+        out = set()
+        for iy in range(iy0, iy1 + 1):
+            base = iy * self.nx
+            for ix in range(ix0, ix1 + 1):
+                c = base + ix
+                out.update(self.seg_ids[self.offsets[c]:self.offsets[c + 1]])
+        return sorted(out)
+
+
+class IndexedRoute:
+    def __init__(self, route_id: int, geometry: RouteGeometry, grid: SegmentGrid):
+        self.route_id = route_id
+        self.geometry = geometry
+        self.grid = grid
+        self._cumulative: Optional[array] = None
+
+    def cumulative_m(self) -> array:
+        """Distance along the route (meters) at each point, computed once."""
+        if self._cumulative is None:
+            import numpy as np
+
+            lons = np.radians(np.frombuffer(self.geometry.lons, dtype=np.float64))
+            lats = np.radians(np.frombuffer(self.geometry.lats, dtype=np.float64))
+            cum = np.zeros(len(lons), dtype=np.float64)
+            if len(lons) > 1:
+                # equirectangular per segment, matching route_matching's projection
+                dx = np.diff(lons) * np.cos((lats[:-1] + lats[1:]) / 2.0)
+                dy = np.diff(lats)
+                np.cumsum(np.hypot(dx, dy) * _EARTH_R, out=cum[1:])
+            self._cumulative = array("d", cum.tobytes())
+        return self._cumulative
+
+
+# ---------------- parsing ----------------
+
+def _nmea_coord(value: str, hemi: str) -> Optional[float]:
+    if not value:
+        return None
+    v = float(value)
+    deg = int(v // 100)
+    out = deg + (v - deg * 100) / 60.0
+    return -out if hemi in ("S", "W") else out
+
+
+def _parse_nmea(line: str) -> Optional[Tuple[float, float]]:
+    parts = line.split("*", 1)[0].split(",")
+    kind = parts[0][3:] if len(parts[0]) >= 6 else ""
+    try:
+        if kind == "GGA" and len(parts) > 6 and parts[6] not in ("", "0"):
+            lat, lon = _nmea_coord(parts[2], parts[3]), _nmea_coord(parts[4], parts[5])
+        elif kind == "RMC" and len(parts) > 6 and parts[2] == "A":
+            lat, lon = _nmea_coord(parts[3], parts[4]), _nmea_coord(parts[5], parts[6])
+        else:
+            return None
+    except ValueError:
+        return None
+    if lat is None or lon is None:
+        return None
+    return lon, lat
+
+
+def _iter_text_points(path: str) -> Iterator[Tuple[float, float]]:
+    """Line-oriented gps/txt: NMEA GGA/RMC sentences or 'lon,lat' / 'lon lat' pairs.
+    A pair is taken as 'lat,lon' only when the first value fits latitude and the second does not.
+    """
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("$"):
+                p = _parse_nmea(line)
+                if p:
+                    yield p
+                continue
+            nums = _NUM_RE.findall(line)
+            if len(nums) < 2:
+                continue
+            a, b = float(nums[0]), float(nums[1])
+            if abs(a) <= 90 < abs(b) <= 180:
+                a, b = b, a
+            if abs(a) <= 180 and abs(b) <= 90:
+                yield a, b
+
+
+def _json_points(data) -> list:
+    """Accept [[lon,lat],..], [{lon,lat},..], {"points"|"coordinates"|"route": [...]} and GeoJSON lines."""
+    if isinstance(data, list):
+        return data
+    if not isinstance(data, dict):
+        return []
+    t = data.get("type")
+    if t == "FeatureCollection":
+        out: list = []
+        for feat in data.get("features") or []:
+            out.extend(_json_points(feat))
+        return out
+    if t == "Feature":
+        return _json_points(data.get("geometry") or {})
+    if t == "LineString":
+        return data.get("coordinates") or []
+    if t == "MultiLineString":
+        return [p for line in data.get("coordinates") or [] for p in line]
+    for key in ("points", "coordinates", "route", "gps"):
+        if isinstance(data.get(key), list):
+            return data[key]
+    return []
+
+
+def parse_route_file(path: str, route_format: str) -> RouteGeometry:
+    if route_format == "json":
+        with open(path, "r", encoding="utf-8") as f:
+            geo = from_points(_json_points(json.load(f)))
+    else:
+        lons, lats = array("d"), array("d")
+        for lon, lat in _iter_text_points(path):
+            lons.append(lon)
+            lats.append(lat)
+        geo = RouteGeometry(lons, lats)
+    if len(geo) < 1:
+        raise ValueError("no coordinates found in route file")
+    return geo
+
+
+# ---------------- grid build / persistence ----------------
+
+def build_grid(geo: RouteGeometry) -> SegmentGrid:
+    import numpy as np
+
+    lons = np.frombuffer(geo.lons, dtype=np.float64)
+    lats = np.frombuffer(geo.lats, dtype=np.float64)
+    min_lon, max_lon = float(lons.min()), float(lons.max())
+    min_lat, max_lat = float(lats.min()), float(lats.max())
+    m = max(0, len(lons) - 1)
+    w, h = max(max_lon - min_lon, 1e-9), max(max_lat - min_lat, 1e-9)
+    target = max(1, min(_MAX_CELLS, m // _SEGMENTS_PER_CELL or 1))
+    cell = max(math.sqrt(w * h / target), max(w, h) / _MAX_CELLS ** 0.5, 1e-7)
+    nx = max(1, int(math.floor(w / cell)) + 1)
+    ny = max(1, int(math.floor(h / cell)) + 1)
+    if m == 0:
+        return SegmentGrid(min_lon, min_lat, cell, nx, ny, array("I", [0] * (nx * ny + 1)), array("I"))
+
+    x0, x1 = lons[:-1], lons[1:]
+    y0, y1 = lats[:-1], lats[1:]
+    ix0 = np.clip(((np.minimum(x0, x1) - min_lon) / cell).astype(np.int64), 0, nx - 1)
+    ix1 = np.clip(((np.maximum(x0, x1) - min_lon) / cell).astype(np.int64), 0, nx - 1)
+    iy0 = np.clip(((np.minimum(y0, y1) - min_lat) / cell).astype(np.int64), 0, ny - 1)
+    iy1 = np.clip(((np.maximum(y0, y1) - min_lat) / cell).astype(np.int64), 0, ny - 1)
+    wx = ix1 - ix0 + 1
+    cnt = wx * (iy1 - iy0 + 1)
+    total = int(cnt.sum())
+    seg = np.repeat(np.arange(m, dtype=np.int64), cnt)
+    k = np.arange(total, dtype=np.int64) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+    wx_r = np.repeat(wx, cnt)
+    cells = (np.repeat(iy0, cnt) + k // wx_r) * nx + np.repeat(ix0, cnt) + k % wx_r
+    order = np.argsort(cells, kind="stable")
+    seg_ids = seg[order].astype(np.uint32)
+    offsets = np.searchsorted(cells[order], np.arange(nx * ny + 1)).astype(np.uint32)
+    return SegmentGrid(
+        min_lon, min_lat, cell, nx, ny,
+        array("I", offsets.tobytes()), array("I", seg_ids.tobytes()),
+    )
+
+
+def _index_dir() -> str:
+    d = os.path.join(get_settings().upload_dir, "routes", "index")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def _paths(route_id: int) -> Tuple[str, str]:
+    base = os.path.join(_index_dir(), str(int(route_id)))
+    return base + ".rtx", base + ".json"
+
+
+def _write_meta(route_id: int, meta: dict) -> None:
+    _, meta_path = _paths(route_id)
+    tmp = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, meta_path)
+
+
+def read_meta(route_id: int) -> Optional[dict]:
+    _, meta_path = _paths(route_id)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_index(route_id: int, geo: RouteGeometry, grid: SegmentGrid) -> str:
+    data_path, _ = _paths(route_id)
+    tmp = f"{data_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, 0, len(geo), grid.nx, grid.ny, grid.min_lon, grid.min_lat, grid.cell))
+        for arr in (geo.lons, geo.lats, geo.weights(), grid.offsets, grid.seg_ids):
+            arr.tofile(f)
+    os.replace(tmp, data_path)
+    return data_path
+
+
+def parse_source(route_file_path: str, route_format: str) -> RouteGeometry:
+    """Parse the uploaded route file without building or writing an index."""
+    src = storage.resolve(route_file_path)
+    if not src or not os.path.isfile(src):
+        raise FileNotFoundError(route_file_path)
+    return parse_route_file(src, route_format)
+
+
+def is_current(meta: Optional[dict], route_file_path: str, route_format: str) -> bool:
+    """meta describes a build (finished or in progress) of this file in this format."""
+    return bool(meta) and meta.get("source") == route_file_path and meta.get("format") == route_format
+
+
+def is_stuck(meta: dict) -> bool:
+    """A pending build older than PENDING_TIMEOUT was interrupted (e.g. the worker exited)."""
+    try:
+        started = datetime.fromisoformat(meta["started_at"])
+    except (KeyError, TypeError, ValueError):
+        return True
+    return (datetime.now() - started).total_seconds() > PENDING_TIMEOUT
+
+
+def build(route_id: int, route_file_path: str, route_format: str) -> dict:
+    """Parse the uploaded route file into the point/grid index. Safe to run in a background task."""
+    meta = {
+        "route_id": route_id,
+        "source": route_file_path,
+        "format": route_format,
+        "status": "pending",
+        "started_at": datetime.now().isoformat(),
+    }
+    _write_meta(route_id, meta)
+    try:
+        geo = parse_source(route_file_path, route_format)
+        grid = build_grid(geo)
+        _write_index(route_id, geo, grid)
+        meta.update(status="ready", points=len(geo), bbox=[min(geo.lons), min(geo.lats), max(geo.lons), max(geo.lats)], parsed_at=datetime.now().isoformat())
+        logger.info("Route %s parsed: points=%s cells=%sx%s", route_id, len(geo), grid.nx, grid.ny)
+    except Exception as e:
+        meta.update(status="failed", error=str(e))
+        logger.exception("Route %s parse failed: %s", route_id, route_file_path)
+        # never keep serving/matching the geometry of a previous file
+        data_path, _ = _paths(route_id)
+        if os.path.exists(data_path):
+            os.remove(data_path)
+    _write_meta(route_id, meta)
+    invalidate(route_id)
+    return meta
+
+
+_lock = threading.Lock()
+_cache: Dict[int, Tuple[int, IndexedRoute]] = {}
+
+
+def load(route_id: int) -> Optional[IndexedRoute]:
+    """Load the parsed route (cached until its index file changes); None if not built."""
+    data_path, _ = _paths(route_id)
+    try:
+        mtime = os.stat(data_path).st_mtime_ns
+    except OSError:
+        return None
+    with _lock:
+        hit = _cache.get(route_id)
+    if hit and hit[0] == mtime:
+        return hit[1]
+    try:
+        with open(data_path, "rb") as f:
+            magic, version, _, n, nx, ny, min_lon, min_lat, cell = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                logger.warning("Route index %s has unknown format", data_path)
+                return None
+            lons, lats, weights, offsets, seg_ids = array("d"), array("d"), array("d"), array("I"), array("I")
+            lons.fromfile(f, n)
+            lats.fromfile(f, n)
+            weights.fromfile(f, n)
+            offsets.fromfile(f, nx * ny + 1)
+            seg_ids.frombytes(f.read())
+    except (OSError, EOFError, ValueError, struct.error) as e:
+        # truncated or corrupt file (struct.error: short header, EOFError: short arrays)
+        logger.warning("Route index %s is unreadable: %s", data_path, e)
+        return None
+    item = IndexedRoute(route_id, RouteGeometry(lons, lats, weights), SegmentGrid(min_lon, min_lat, cell, nx, ny, offsets, seg_ids))
+    with _lock:
+        _cache[route_id] = (mtime, item)
+    return item
+
+
+_ids_state: Dict[str, object] = {"mtime": None, "ids": []}
+
+
+def indexed_route_ids() -> List[int]:
+    """Ids of routes with a built index, re-listed only when the index directory changes."""
+    d = _index_dir()
+    mtime = os.stat(d).st_mtime_ns
+    with _lock:
+        if _ids_state["mtime"] == mtime:
+            return list(_ids_state["ids"])  # type: ignore[arg-type]
+    ids = sorted(int(name[:-4]) for name in os.listdir(d) if name.endswith(".rtx") and name[:-4].isdigit())
+    with _lock:
+        _ids_state.update(mtime=mtime, ids=ids)
+    return list(ids)
+
+
+def invalidate(route_id: Optional[int] = None) -> None:
+    with _lock:
+        if route_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(route_id, None)
+
+
+def remove(route_id: int) -> None:
+    invalidate(route_id)
+    for p in _paths(route_id):
+        try:
+            if os.path.exists(p):
+                os.remove(p)
+        except Exception:
+            pass
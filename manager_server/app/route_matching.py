@@ -0,0 +1,69 @@
+import math
+from typing import Iterable, NamedTuple, Optional
+
+from . import route_index
+from .config import get_settings
+
+_EARTH_R = 6371000.0
+_M_PER_DEG = _EARTH_R * math.pi / 180.0
+
+
+class RouteMatch(NamedTuple):
+    route_id: int
+    offset_m: float  # chainage from the first route point
+    distance_m: float  # perpendicular distance from the route
+
+
+def _match_route(item: route_index.IndexedRoute, lon: float, lat: float, max_distance_m: float) -> Optional[RouteMatch]:
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    radius_deg = max_distance_m / (_M_PER_DEG * cos_lat)
+    min_lon, min_lat, max_lon, max_lat = item.grid.bbox
+    if lon < min_lon - radius_deg or lon > max_lon + radius_deg or lat < min_lat - radius_deg or lat > max_lat + radius_deg:
+        return None
+    lons, lats = item.geometry.lons, item.geometry.lats
+    n = len(lons)
+    if n == 1:
+        candidates: Iterable[int] = ()
+        best = (math.hypot((lons[0] - lon) * cos_lat, lats[0] - lat) * _M_PER_DEG, 0, 0.0)
+    else:
+        candidates = item.grid.candidates(lon, lat, radius_deg)
+        best = None
+    # local equirectangular frame centred on the alarm, in meters
+    kx = _M_PER_DEG * cos_lat
+    for i in candidates:
+        ax, ay = (lons[i] - lon) * kx, (lats[i] - lat) * _M_PER_DEG
+        bx, by = (lons[i + 1] - lon) * kx, (lats[i + 1] - lat) * _M_PER_DEG
+        dx, dy = bx - ax, by - ay
+        seg2 = dx * dx + dy * dy
+        t = 0.0
+        if seg2 > 0.0:
+            t = min(1.0, max(0.0, -(ax * dx + ay * dy) / seg2))
+        d = math.hypot(ax + t * dx, ay + t * dy)
+        if best is None or d < best[0]:
+            best = (d, i, t)
+    if best is None or best[0] > max_distance_m:
+        return None
+    d, i, t = best
+    cum = item.cumulative_m()
+    offset = cum[i] + (t * (cum[i + 1] - cum[i]) if i + 1 < n else 0.0)
+    return RouteMatch(item.route_id, offset, d)
+
+
+def match(lon: float, lat: float, max_distance_m: Optional[float] = None) -> Optional[RouteMatch]:
+    """Snap a point to the nearest segment of any indexed route (see route_index).
+    Returns None when no route lies within max_distance_m (default: server.route_match_distance).
+    """
+    if lon is None or lat is None:
+        return None
+    if max_distance_m is None:
+        max_distance_m = get_settings().route_match_distance
+    lon, lat = float(lon), float(lat)
+    best: Optional[RouteMatch] = None
+    for route_id in route_index.indexed_route_ids():
+        item = route_index.load(route_id)
+        if item is None:
+            continue
+        m = _match_route(item, lon, lat, max_distance_m)
+        if m is not None and (best is None or m.distance_m < best.distance_m):
+            best = m
+    return best
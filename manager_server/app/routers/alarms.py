@@ -1,15 +1,17 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Request
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Request, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Optional, List
 import os
-import uuid
-from imagededup.methods import WHash  # type: ignore
-_whash = WHash()
+import asyncio
+import hashlib
 import logging
 
-from ..database import get_db
+from ..database import get_db, get_read_db, on_primary, read_session
 from ..config import get_settings
-from .. import schemas, crud
+from .. import schemas, crud, models, export, thumbs, files, storage, image_archiver, clustering, events, cache, metrics, whash, serialize, listing
 from ..deps import parse_auth
 
 router = APIRouter(prefix="/api/v1/alarms", tags=["alarms"], dependencies=[Depends(parse_auth)]) 
@@ -20,6 +22,16 @@ settings = get_settings()
 UPLOAD_DIR = os.path.join(settings.upload_dir, "alarms")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# response cache lifetimes (s); alarm writes invalidate the "alarms" namespace immediately
+TODAY_EVENTS_TTL = 10
+TODAY_HOURLY_TTL = 30
+
+# search: (alarm_time, alarm_id) keyset cursor; terms shorter than this yield no trigram to
+# look up in the index, so a search made only of such terms needs a time range
+SEARCH_KEYSET = listing.Listing(models.AlarmInfo, ("alarm_time", "alarm_id"), ("alarm_time", "alarm_id"), descending=True)
+SEARCH_MIN_INDEXED_TERM = 3
+SEARCH_MAX_TERMS = 5
+
 
 @router.post("", response_model=schemas.AlarmRead)
 async def create_alarm(
@@ -39,17 +51,22 @@ async def create_alarm(
     image_url: Optional[str] = None
     image_hash: Optional[str] = None
     if image is not None:
-        ext = os.path.splitext(image.filename)[1] or ".bin"
-        file_name = f"{uuid.uuid4().hex}{ext}"
-        dst_path = os.path.join(UPLOAD_DIR, file_name)
-        # save file first
+        # save file first (content-addressed, deduplicated; the reference commits with the alarm)
         content = await image.read()
-        with open(dst_path, "wb") as f:
-            f.write(content)
-        # compute hash: use WHash; 
-        image_hash = _whash.encode_image(dst_path)
-        # store url as relative to save_path root (e.g., 'alarms/<file>')
-        image_url = os.path.join("alarms", file_name).replace("\\", "/")
+        with metrics.ALARM_STAGE.time(stage="image_write"):
+            image_url = storage.store_bytes(db, content, storage.normalize_ext(image.filename, ".bin"), "alarms")
+        dst_path = storage.abs_path(image_url)
+        # compute hash: WHash (app/whash.py)
+        with metrics.ALARM_STAGE.time(stage="image_hash"):
+            image_hash = whash.encode_image(dst_path)
+        if settings.thumb_on_ingest:
+            try:
+                with metrics.ALARM_STAGE.time(stage="thumbnails"):
+                    # decode + resize is CPU-bound; keep it off the event loop
+                    await run_in_threadpool(thumbs.generate_thumbnails, dst_path)
+            except Exception:
+                # thumbnails are regenerated lazily on first request
+                logger.exception("Thumbnail generation failed: %s", dst_path)
 
     from datetime import datetime
     alarm_dt = datetime.fromisoformat(alarm_time)
@@ -66,22 +83,36 @@ async def create_alarm(
     )
     # Similarity check: if similar to ignored ones, mark as ignore before insert
     try:
-        if crud.need_alarm(db, alarm_in):
+        with metrics.ALARM_STAGE.time(stage="similarity"):
+            need_ignore = crud.need_alarm(db, alarm_in)
+        if need_ignore:
             alarm_in.process_status = "auto_ignore"
             logger.info("Alarm marked ignore by similarity: device_ip=%s type=%s", device_ip, alarm_type)
     except Exception:
         logger.exception("need_alarm check failed; proceeding without ignore")
-    new_alarm = crud.create_alarm(db, alarm_in, image_url=image_url)
+    try:
+        new_alarm = crud.create_alarm(db, alarm_in, image_url=image_url)
+    except Exception:
+        if image_url:
+            storage.discard_if_unreferenced(db, image_url)
+        raise
     logger.info("Alarm created: id=%s device_ip=%s type=%s", getattr(new_alarm, "alarm_id", None), device_ip, alarm_type)
     return new_alarm
 
 
 @router.get("/today-events")
-def list_today_events(db: Session = Depends(get_db)):
+def list_today_events():
     """Return today's alarms with:
     - items: list of AlarmRead objects
     - summary: {total, processed, feedback_confirmed, ignored, auto_ignored, unprocessed}
     """
+    from datetime import date
+    key = f"today-events:{date.today().isoformat()}"
+    # cached, so loaded from the primary (database.on_primary)
+    return cache.get_or_load("alarms", key, TODAY_EVENTS_TTL, lambda: on_primary(_today_events))
+
+
+def _today_events(db: Session) -> dict:
     from datetime import datetime
     now = datetime.now()
     start = now.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -112,11 +143,17 @@ def list_today_events(db: Session = Depends(get_db)):
         "unprocessed": total - processed,
     }
     logger.info("Today events retrieved: count=%s, summary=%s", len(items), summary)
-    return {"summary": summary, "items": items}
+    return jsonable_encoder({"summary": summary, "items": [schemas.AlarmRead.model_validate(it) for it in items]})
 
 
 @router.get("/stats/today-hourly")
-def stats_today_hourly(db: Session = Depends(get_db), request: Request = None):
+def stats_today_hourly(request: Request = None):
+    from datetime import date
+    key = f"today-hourly:{date.today().isoformat()}"
+    return cache.get_or_load("alarms", key, TODAY_HOURLY_TTL, lambda: on_primary(_today_hourly))
+
+
+def _today_hourly(db: Session) -> list:
     rows = crud.stats_today_hourly(db)
     # Build a map: hour (0-23) -> count
     counts_by_hour: dict[int, int] = {}
@@ -150,7 +187,7 @@ def list_alarms_by_process_status(
     process_status: str = "unprocessed",
     skip: int = 0,
     limit: int = 50,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     request: Request = None,
 ):
     """
@@ -166,9 +203,10 @@ def list_alarms_by_process_status(
     except Exception:
         pass
 
-    items = crud.query_alarms_by_process_status(db, user_code, process_status, skip, min(limit, 200))
-    logger.info("List alarms by status: status=%s count=%s", process_status, len(items))
-    return items
+    # plain rows + orjson; same document as AlarmRead (app/serialize.py)
+    rows = crud.query_alarm_rows_by_process_status(db, user_code, process_status, skip, min(limit, 200))
+    logger.info("List alarms by status: status=%s count=%s", process_status, len(rows))
+    return serialize.json_response([serialize.alarm_item(r) for r in rows])
 
 
 @router.get("")
@@ -180,7 +218,7 @@ def list_alarms(
     user_code: Optional[str] = None,
     skip: int = 0,
     limit: int = 50,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     request: Request = None,
 ):
     """
@@ -204,10 +242,257 @@ def list_alarms(
     st = datetime.fromisoformat(start_time) if start_time else None
     et = datetime.fromisoformat(end_time) if end_time else None
     lim = min(limit, 200)
-    items = crud.query_alarms_filtered(db, st, et, alarm_type, process_status, user_code, skip, lim)
+    rows = crud.query_alarm_rows_filtered(db, st, et, alarm_type, process_status, user_code, skip, lim)
     total = crud.count_alarms_filtered(db, st, et, alarm_type, process_status, user_code)
-    logger.info("List alarms: items=%s total=%s process_status=%s type=%s", len(items), total, process_status, alarm_type)
-    return {"items": items, "total": total}
+    logger.info("List alarms: items=%s total=%s process_status=%s type=%s", len(rows), total, process_status, alarm_type)
+    # plain rows + orjson; same document as AlarmRead (app/serialize.py)
+    return serialize.json_response({"items": [serialize.alarm_item(r) for r in rows], "total": total})
+
+
+def _header_user_code(request: Optional[Request]) -> Optional[str]:
+    try:
+        return getattr(getattr(request, "state", None), "auth", {}).get("user_code") if request else None
+    except Exception:
+        return None
+
+
+def _iter_export_rows(st, et, alarm_type, process_status, user_code):
+    # The response body is produced after the endpoint returns, so the stream owns its session
+    db = read_session()
+    try:
+        yield from crud.iter_alarms_filtered(db, st, et, alarm_type, process_status, user_code)
+    finally:
+        db.close()
+
+
+@router.get("/search")
+def search_alarms(
+    q: str = Query(..., min_length=2, max_length=100),
+    fields: str = Query("all", pattern="^(all|address|notes)$"),
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    alarm_type: Optional[str] = None,
+    process_status: Optional[str] = None,
+    user_code: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    db: Session = Depends(get_read_db),
+    request: Request = None,
+):
+    """
+    Search alarms by words in the address (address, simple_address) and/or the processing
+    notes (process_opinion, process_feedback); every whitespace-separated term of q must
+    appear (case-insensitive substring). Same filters as GET /api/v1/alarms.
+    Returns { items, next_cursor }, newest first; pass next_cursor back as cursor for the
+    next page (null on the last page). Terms of 3+ characters are served by trigram
+    indexes; a query made only of shorter terms needs start_time.
+    """
+    from datetime import datetime
+
+    terms = q.split()[:SEARCH_MAX_TERMS]
+    if not terms:
+        raise HTTPException(status_code=400, detail="q must contain a search term")
+    header_uc = _header_user_code(request)
+    if header_uc:
+        user_code = header_uc
+    try:
+        st = datetime.fromisoformat(start_time) if start_time else None
+        et = datetime.fromisoformat(end_time) if end_time else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid time: {e}")
+    if st is None and all(len(t) < SEARCH_MIN_INDEXED_TERM for t in terms):
+        raise HTTPException(
+            status_code=400, detail=f"search terms shorter than {SEARCH_MIN_INDEXED_TERM} characters need start_time"
+        )
+    after = tuple(SEARCH_KEYSET.decode_cursor(cursor)) if cursor else None
+    lim = max(1, min(limit, 200))
+    rows = crud.search_alarm_rows(db, terms, fields, st, et, alarm_type, process_status, user_code, after, lim + 1)
+    next_cursor = SEARCH_KEYSET.encode_cursor(rows[lim - 1]) if len(rows) > lim else None
+    rows = rows[:lim]
+    logger.info("Search alarms: terms=%s fields=%s items=%s more=%s", terms, fields, len(rows), next_cursor is not None)
+    # plain rows + orjson; same document as AlarmRead (app/serialize.py)
+    return serialize.json_response({"items": [serialize.alarm_item(r) for r in rows], "next_cursor": next_cursor})
+
+
+@router.get("/export")
+def export_alarms(
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    alarm_type: Optional[str] = None,
+    process_status: Optional[str] = None,
+    user_code: Optional[str] = None,
+    fmt: str = Query("ndjson", alias="format"),
+    request: Request = None,
+):
+    """
+    Stream all alarms matching the list filters as NDJSON (default) or CSV.
+    Same filter semantics as GET /api/v1/alarms, but without the 200-row cap;
+    rows are read through a server-side cursor so memory stays flat for any range.
+    """
+    from datetime import datetime
+
+    fmt = (fmt or "ndjson").lower()
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    header_uc = _header_user_code(request)
+    if header_uc:
+        user_code = header_uc
+    try:
+        st = datetime.fromisoformat(start_time) if start_time else None
+        et = datetime.fromisoformat(end_time) if end_time else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid time: {e}")
+
+    rows = _iter_export_rows(st, et, alarm_type, process_status, user_code)
+    stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    if fmt == "csv":
+        body = export.iter_csv(rows)
+        media_type = "text/csv; charset=utf-8"
+    else:
+        body = export.iter_ndjson(rows)
+        media_type = "application/x-ndjson"
+    logger.info("Export alarms: format=%s start=%s end=%s type=%s status=%s", fmt, start_time, end_time, alarm_type, process_status)
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="alarms_{stamp}.{fmt}"'},
+    )
+
+
+@router.get("/export/images")
+def export_alarm_images(
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    alarm_type: Optional[str] = None,
+    process_status: Optional[str] = None,
+    user_code: Optional[str] = None,
+    request: Request = None,
+):
+    """
+    Stream a ZIP (store mode) of the images behind the filtered alarm set, with a
+    manifest.csv listing every alarm and whether its image was included.
+    The archive is assembled chunk by chunk while it is sent; at most one image (up to
+    export.IMAGE_BUFFER_BYTES) is held in memory, so a failed read leaves no partial member.
+    """
+    from datetime import datetime
+
+    header_uc = _header_user_code(request)
+    if header_uc:
+        user_code = header_uc
+    try:
+        st = datetime.fromisoformat(start_time) if start_time else None
+        et = datetime.fromisoformat(end_time) if end_time else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"invalid time: {e}")
+
+    rows = _iter_export_rows(st, et, alarm_type, process_status, user_code)
+    stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    logger.info("Export alarm images: start=%s end=%s type=%s status=%s", start_time, end_time, alarm_type, process_status)
+    return StreamingResponse(
+        export.iter_images_zip(rows),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="alarm_images_{stamp}.zip"'},
+    )
+
+
+# comment line sent when idle so proxies keep the stream open
+STREAM_HEARTBEAT_SECONDS = 15
+
+
+def _split_filter(value: Optional[str]) -> Optional[List[str]]:
+    return [v.strip() for v in value.split(",") if v.strip()] if value else None
+
+
+@router.get("/stream")
+async def alarm_stream(
+    request: Request,
+    alarm_type: Optional[str] = None,
+    process_status: Optional[str] = None,
+    device_ip: Optional[str] = None,
+    user_code: Optional[str] = None,
+    last_event_id: Optional[int] = None,
+):
+    """Server-Sent Events stream of committed alarm changes.
+
+    Events: alarm.created (AlarmRead), alarm.updated ({changed, alarm}), alarm.deleted ({alarm_id}).
+    Filters take comma-separated values; without process_status, auto_ignore alarms are skipped.
+    Reconnecting clients resume from the Last-Event-ID header (or last_event_id); if the
+    gap is no longer buffered an `event: reset` is sent first and the client should reload.
+    """
+    header_id = request.headers.get("last-event-id")
+    if header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+    filters = {
+        "alarm_type": _split_filter(alarm_type),
+        "process_status": _split_filter(process_status),
+        "device_ip": _split_filter(device_ip),
+        "user_code": _split_filter(_header_user_code(request) or user_code),
+    }
+    sub, backlog, complete = events.broadcaster.subscribe(filters, last_event_id)
+
+    async def _gen():
+        try:
+            yield b"retry: 3000\n\n"
+            if not complete:
+                yield b"event: reset\ndata: {}\n\n"
+            for e in backlog:
+                yield e.encode()
+            while not sub.overflowed:
+                try:
+                    e = await asyncio.wait_for(sub.queue.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield b": ping\n\n"
+                    continue
+                yield e.encode()
+        finally:
+            events.broadcaster.unsubscribe(sub)
+
+    return StreamingResponse(
+        _gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/clusters")
+def alarm_clusters(
+    bbox: str,
+    zoom: int = Query(..., ge=0, le=22),
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    alarm_type: Optional[str] = None,
+    process_status: Optional[str] = None,
+    user_code: Optional[str] = None,
+    limit: int = Query(2000, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    request: Request = None,
+):
+    """Map view of alarms inside bbox=min_lon,min_lat,max_lon,max_lat with the usual list filters.
+
+    - zoom < cluster_point_zoom: {mode: "clusters", clusters: [{geohash, count, latitude, longitude, types, bbox}]}
+      from the cached per-level geohash aggregates (kept current as alarms are written)
+    - otherwise: {mode: "points", points: [...], truncated} with at most `limit` newest alarms
+    """
+    from datetime import datetime
+
+    try:
+        box = clustering.parse_bbox(bbox)
+        st = datetime.fromisoformat(start_time) if start_time else None
+        et = datetime.fromisoformat(end_time) if end_time else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filters = clustering.AlarmFilters(st, et, alarm_type, process_status, _header_user_code(request) or user_code)
+    if zoom >= settings.cluster_point_zoom:
+        return clustering.points(db, box, zoom, filters, limit)
+    return clustering.clusters(db, box, zoom, filters)
+
+
+@router.get("/archive/report")
+def get_archive_report():
+    """Last image archive pass (images moved, bytes reclaimed) and running totals."""
+    return image_archiver.get_report()
 
 
 @router.get("/{alarm_id}", response_model=schemas.AlarmRead)
@@ -220,6 +505,51 @@ def get_alarm(alarm_id: int, db: Session = Depends(get_db), request: Request = N
     return alarm
 
 
+@router.get("/{alarm_id}/image")
+def get_alarm_image(alarm_id: int, db: Session = Depends(get_db), request: Request = None):
+    """Serve the stored alarm image, wherever it currently lives (hot file, cold tier or day pack)."""
+    image_urls = crud.get_alarm_image_urls_by_ids(db, [alarm_id])
+    if not image_urls:
+        raise HTTPException(status_code=404, detail="Alarm image not found")
+    rel = image_urls[0]
+    media_type = storage.media_type(rel)
+    if not storage.parse_pack_url(rel):
+        abs_path = storage.resolve(rel)
+        if not abs_path or not os.path.isfile(abs_path):
+            raise HTTPException(status_code=404, detail="Alarm image file missing")
+        return files.file_response(request, abs_path, media_type=media_type, max_age=7 * 24 * 3600)
+    opened = storage.open_image(rel)
+    if not opened:
+        raise HTTPException(status_code=404, detail="Alarm image file missing")
+    src, _ = opened
+    with src:
+        data = src.read()
+    # packed members are immutable, so the url itself is a strong validator
+    etag = '"%s"' % hashlib.sha1(rel.encode("utf-8")).hexdigest()
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=604800"}
+    if request is not None and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=media_type, headers=headers)
+
+
+@router.get("/{alarm_id}/thumb")
+def get_alarm_thumb(alarm_id: int, size: Optional[int] = None, db: Session = Depends(get_db), request: Request = None):
+    """Serve a JPEG thumbnail of the alarm image (ETag/Cache-Control/Range aware).
+    size is snapped to the closest configured thumb_sizes entry; generated on first request if absent.
+    """
+    image_urls = crud.get_alarm_image_urls_by_ids(db, [alarm_id])
+    if not image_urls:
+        raise HTTPException(status_code=404, detail="Alarm image not found")
+    try:
+        thumb_abs = thumbs.ensure_thumbnail(image_urls[0], thumbs.pick_size(size))
+    except Exception:
+        logger.exception("Thumbnail render failed: alarm_id=%s", alarm_id)
+        raise HTTPException(status_code=500, detail="Thumbnail generation failed")
+    if not thumb_abs:
+        raise HTTPException(status_code=404, detail="Alarm image file missing")
+    return files.file_response(request, thumb_abs, media_type="image/jpeg", max_age=7 * 24 * 3600)
+
+
 @router.put("/{alarm_id}/process", response_model=schemas.AlarmRead)
 def update_alarm_process(
     alarm_id: int,
@@ -241,16 +571,15 @@ def update_alarm_process(
 
 
 
-def _remove_local_images(image_urls: List[str]):
+def _remove_local_images(db: Session, image_urls: List[str]):
     for rel in image_urls:
-        # stored image_url is relative to save_path; resolve under settings.upload_dir
-        abs_path = os.path.normpath(os.path.join(settings.upload_dir, rel))
+        # stored image_url is relative to save_path; shared files are only removed with their last reference
         try:
-            if os.path.exists(abs_path):
-                os.remove(abs_path)
+            if storage.release(db, rel):
+                thumbs.remove_thumbnails(storage.abs_path(rel))
         except Exception:
-            # ignore individual file errors
-            pass
+            # the alarms are already deleted; a kept file is only wasted space
+            logger.exception("Release alarm image failed: %s", rel)
 
 
 @router.delete("/{alarm_id}")
@@ -260,7 +589,7 @@ def delete_alarm(alarm_id: int, db: Session = Depends(get_db), request: Request
     if deleted == 0:
         logger.warning("Delete alarm not found: id=%s", alarm_id)
         raise HTTPException(status_code=404, detail="Alarm not found")
-    _remove_local_images(image_urls)
+    _remove_local_images(db, image_urls)
     logger.info("Alarm deleted: id=%s", alarm_id)
     return {"deleted": deleted}
 
@@ -271,6 +600,6 @@ def delete_alarms(ids: List[int], db: Session = Depends(get_db), request: Reques
         raise HTTPException(status_code=400, detail="ids is required")
     image_urls = crud.get_alarm_image_urls_by_ids(db, ids)
     deleted = crud.delete_alarms_by_ids(db, ids)
-    _remove_local_images(image_urls)
+    _remove_local_images(db, image_urls)
     logger.info("Alarms batch deleted: ids=%s deleted=%s", ids, deleted)
     return {"deleted": deleted}
@@ -1,28 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from typing import List
 
 from ..database import get_db
-from .. import schemas, crud
+from .. import schemas, crud, config_store
 
-router = APIRouter(prefix="/api/v1/config", tags=["config"]) 
+router = APIRouter(prefix="/api/v1/config", tags=["config"])
+
+# reads come from the in-process snapshot (app/config_store.py); every response carries its version
+VERSION_HEADER = "X-Config-Version"
+
+
+def _versioned(response: Response, version: int) -> None:
+    response.headers[VERSION_HEADER] = str(version)
+    response.headers["Access-Control-Expose-Headers"] = VERSION_HEADER
 
 
 @router.get("", response_model=List[schemas.ConfigItemRead])
-def list_config(db: Session = Depends(get_db)):
-    return crud.list_configs(db)
+def list_config(response: Response):
+    version, items = config_store.list_items()
+    _versioned(response, version)
+    return items
+
+
+@router.get("/changes")
+async def wait_config_changes(response: Response, since: int, timeout: float = 30.0):
+    """Long-poll: answers as soon as the config version differs from since (or after timeout,
+    max 60 s) with {version, changed, items}; pass the returned version as the next since."""
+    await run_in_threadpool(config_store.version)  # first call loads the snapshot
+    version = await config_store.wait_for_change(since, min(max(timeout, 0.0), 60.0))
+    version, items = config_store.list_items()
+    _versioned(response, version)
+    changed = version != since
+    return {"version": version, "changed": changed, "items": items if changed else []}
 
 
 @router.get("/{key}", response_model=schemas.ConfigItemRead)
-def get_config(key: str, db: Session = Depends(get_db)):
-    item = crud.get_config(db, key)
+def get_config(key: str, response: Response):
+    version, item = config_store.get(key)
     if not item:
         raise HTTPException(status_code=404, detail="Config not found")
+    _versioned(response, version)
     return item
 
 
 @router.put("/{key}", response_model=schemas.ConfigItemRead)
-def put_config(key: str, body: schemas.ConfigItem, db: Session = Depends(get_db)):
+def put_config(key: str, body: schemas.ConfigItem, response: Response, db: Session = Depends(get_db)):
     if key != body.key:
         raise HTTPException(status_code=400, detail="Key mismatch")
-    return crud.upsert_config(db, key=body.key, value=body.value)
+    item = crud.upsert_config(db, key=body.key, value=body.value)
+    _versioned(response, config_store.version())
+    return item
@@ -0,0 +1,104 @@
+import asyncio
+import copy
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from .. import device_state
+from ..device_registry import registry, DeviceConnection, HEARTBEAT_INTERVAL, deep_merge
+
+# no parse_auth here: header dependencies built on Request do not apply to WebSocket scopes
+router = APIRouter(prefix="/api/v1/devices", tags=["devices"])
+logger = logging.getLogger(__name__)
+
+
+def _device_online(device_code: str, device_ip: Optional[str], device_config, device_info) -> tuple:
+    """Create/update the device from a hello frame; returns (device_id, device_info)."""
+    row = device_state.heartbeat(device_code, {
+        "device_ip": device_ip or None,
+        "device_config": device_config,
+        "device_info": device_info,
+        "status": "online",
+    })
+    return row["device_id"], copy.deepcopy(row.get("device_info") or {})
+
+
+@router.websocket("/channel")
+async def device_channel(websocket: WebSocket):
+    """Long-lived control channel for one device (protocol: app/device_registry.py)."""
+    await websocket.accept()
+    try:
+        hello = await asyncio.wait_for(websocket.receive_json(), timeout=HEARTBEAT_INTERVAL)
+    except (asyncio.TimeoutError, WebSocketDisconnect, ValueError):
+        await websocket.close(code=1002)
+        return
+    if not isinstance(hello, dict):
+        hello = {}
+    device_code = str(hello.get("device_code") or "").strip()
+    if hello.get("type") != "hello" or not device_code:
+        await websocket.close(code=1002, reason="expected hello with device_code")
+        return
+
+    conn = DeviceConnection(device_code, hello.get("device_ip"), websocket, asyncio.get_running_loop())
+    try:
+        conn.device_id, info = await run_in_threadpool(
+            _device_online, device_code, conn.device_ip, hello.get("device_config"), hello.get("device_info")
+        )
+    except Exception:
+        logger.exception("Device channel hello failed: code=%s", device_code)
+        await websocket.close(code=1011)
+        return
+    replaced = registry.register(conn)
+    if replaced is not None:
+        # same device reconnected before its old socket timed out
+        replaced.fail_pending()
+        try:
+            await replaced.websocket.close(code=1000, reason="replaced")
+        except Exception:
+            pass
+    logger.info("Device channel connected: code=%s ip=%s", device_code, conn.device_ip)
+    await conn.send({
+        "type": "welcome",
+        "heartbeat_interval": HEARTBEAT_INTERVAL,
+        "server_time": datetime.now(timezone.utc).isoformat(),
+    })
+
+    # heartbeats, metrics and config frames go to device_state, which batches the t_device writes
+    try:
+        while True:
+            msg = await asyncio.wait_for(websocket.receive_json(), timeout=HEARTBEAT_INTERVAL * 3)
+            conn.last_seen = time.monotonic()
+            conn.messages += 1
+            kind = msg.get("type") if isinstance(msg, dict) else None
+            if kind == "heartbeat":
+                device_state.touch(device_code)
+            elif kind == "metrics" and isinstance(msg.get("delta"), dict):
+                deep_merge(info, msg["delta"])
+                await run_in_threadpool(device_state.heartbeat, device_code, {"device_info": copy.deepcopy(info)})
+            elif kind == "config" and isinstance(msg.get("config"), dict):
+                await run_in_threadpool(device_state.heartbeat, device_code, {"device_config": msg["config"]})
+            elif kind == "ack":
+                conn.resolve(msg)
+                if msg.get("ok") and isinstance(msg.get("config"), dict):
+                    await run_in_threadpool(device_state.heartbeat, device_code, {"device_config": msg["config"]})
+            else:
+                logger.debug("Device channel %s: ignored message type %r", device_code, kind)
+    except asyncio.TimeoutError:
+        logger.warning("Device channel timed out: code=%s", device_code)
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        logger.exception("Device channel failed: code=%s", device_code)
+    finally:
+        conn.fail_pending()
+        if registry.unregister(conn):
+            await run_in_threadpool(device_state.mark_offline, device_code)
+            logger.info("Device channel disconnected: code=%s", device_code)
+        try:
+            await websocket.close()
+        except Exception:
+            pass
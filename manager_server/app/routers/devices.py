@@ -1,15 +1,28 @@
-from typing import List
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import asyncio
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from ..deps import parse_auth
-from ..database import get_db
-from .. import schemas, crud
+from ..database import get_db, get_read_db
+from .. import schemas, crud, models, fleet, device_state, device_metrics, listing
+from ..device_registry import registry, DeviceNotConnected
 
 router = APIRouter(prefix="/api/v1/devices", tags=["devices"], dependencies=[Depends(parse_auth)])
 logger = logging.getLogger(__name__)
 
+DEVICE_LISTING = listing.Listing(
+    models.Device,
+    columns=list(schemas.DeviceRead.model_fields),
+    sort=("create_time", "device_id"),
+    descending=True,
+    version_columns=("update_time", "last_seen"),
+    cache_namespace="devices",
+)
+
 
 @router.post("", response_model=schemas.DeviceRead)
 def create_device(body: schemas.DeviceCreate, db: Session = Depends(get_db)):
@@ -24,10 +37,16 @@ def create_device(body: schemas.DeviceCreate, db: Session = Depends(get_db)):
 
 
 @router.get("", response_model=List[schemas.DeviceRead])
-def list_devices(db: Session = Depends(get_db)):
-    items = crud.list_devices(db)
-    logger.info("List devices: count=%s", len(items))
-    return items
+def list_devices(
+    request: Request,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+):
+    """Devices, newest first. fields=a,b selects columns; limit/cursor paginate (next page
+    cursor in X-Next-Cursor); If-None-Match with the last ETag answers 304 when unchanged."""
+    return listing.respond(request, db, DEVICE_LISTING, fields, cursor, limit)
 
 
 @router.get("/webrtc")
@@ -54,6 +73,118 @@ def get_webrtc_urls_by_query(device_id: int | None = None, device_ip: str | None
     return result
 
 
+@router.get("/connected")
+def list_connected_devices():
+    """Devices holding a control channel (WebSocket /api/v1/devices/channel) to this worker process."""
+    items = registry.snapshot()
+    return {"total": len(items), "items": items}
+
+
+@router.get("/state/stats")
+def device_state_stats():
+    """Counters of the in-memory heartbeat table (tracked devices, unchanged reports, batched flushes)."""
+    return device_state.stats()
+
+
+def _metrics_range(start: Optional[datetime], end: Optional[datetime], resolution: str, max_points: int) -> tuple:
+    if resolution not in ("auto", device_metrics.RAW, *device_metrics.STEPS):
+        raise HTTPException(status_code=400, detail="resolution must be auto, raw, 1m or 1h")
+    if not 1 <= max_points <= 20000:
+        raise HTTPException(status_code=400, detail="max_points must be within 1..20000")
+    # naive datetimes are server-local time, like the rest of the API
+    end = (end or datetime.now()).astimezone()
+    start = (start or end - timedelta(hours=1)).astimezone()
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return start, end
+
+
+@router.get("/metrics")
+def query_fleet_metrics(
+    device_ids: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: str = "auto",
+    max_points: int = 2000,
+):
+    """CPU/memory/GPU history for several devices (device_ids=1,2,3); default range is the last hour.
+    resolution=auto picks raw, 1m or 1h so each device gets at most max_points points."""
+    try:
+        ids = sorted({int(x) for x in device_ids.split(",") if x.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="device_ids must be comma-separated integers")
+    if not ids or len(ids) > 500:
+        raise HTTPException(status_code=400, detail="device_ids must list 1..500 devices")
+    start, end = _metrics_range(start, end, resolution, max_points)
+    return device_metrics.query(ids, start, end, resolution, max_points)
+
+
+@router.post("/refresh")
+async def refresh_fleet(body: schemas.FleetRefresh = Body(default_factory=schemas.FleetRefresh)):
+    """Start a concurrent refresh of device_config/device_info from each device; poll /jobs/{job_id}."""
+    devices = await run_in_threadpool(fleet.load_devices, body.device_ids)
+    job = fleet.start_job("refresh", devices)
+    logger.info("Fleet refresh started: job=%s devices=%s", job.job_id, job.total)
+    return job.to_dict(results="none")
+
+
+@router.post("/config/push")
+async def push_fleet_config(body: schemas.FleetConfigPush):
+    """Push a config patch to many devices (control channel when connected, else PUT /api/v1/client/config)."""
+    devices = await run_in_threadpool(fleet.load_devices, body.device_ids)
+    job = fleet.start_job("config_push", devices, body.config)
+    logger.info("Fleet config push started: job=%s devices=%s", job.job_id, job.total)
+    return job.to_dict(results="none")
+
+
+@router.get("/jobs")
+def list_fleet_jobs():
+    return [j.to_dict(results="none") for j in fleet.list_jobs()]
+
+
+@router.get("/jobs/{job_id}")
+def get_fleet_job(job_id: str, results: str = "failed"):
+    """Job progress; results=all|failed|none selects which per-device results to include."""
+    job = fleet.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict(results=results)
+
+
+@router.post("/{device_id}/config/push")
+async def push_device_config(device_id: int, config: Dict[str, Any] = Body(...), timeout: float = 10.0, db: Session = Depends(get_db)):
+    """Push a config patch (deep-merged on the device) over the control channel and wait for the ack."""
+    item = await run_in_threadpool(crud.get_device, db, device_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Device not found")
+    try:
+        ack = await registry.push_config(item.device_code, config, timeout=min(max(timeout, 1.0), 60.0))
+    except DeviceNotConnected:
+        raise HTTPException(status_code=409, detail="Device not connected to control channel")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Device did not acknowledge in time")
+    if not ack.get("ok"):
+        logger.warning("Device rejected config push: id=%s err=%s", device_id, ack.get("error"))
+        raise HTTPException(status_code=502, detail=f"Device rejected config: {ack.get('error')}")
+    logger.info("Config pushed over channel: id=%s code=%s", device_id, item.device_code)
+    return {"delivered": True, "device_id": device_id, "config": ack.get("config")}
+
+
+@router.get("/{device_id}/metrics")
+def query_device_metrics(
+    device_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: str = "auto",
+    max_points: int = 2000,
+):
+    """CPU/memory/GPU history of one device (same parameters as GET /metrics)."""
+    start, end = _metrics_range(start, end, resolution, max_points)
+    result = device_metrics.query([device_id], start, end, resolution, max_points)
+    result.update(result.pop("series")[0])
+    return result
+
+
 @router.get("/{device_id}", response_model=schemas.DeviceRead)
 def get_device(device_id: int, db: Session = Depends(get_db)):
     item = crud.get_device(db, device_id)
@@ -71,6 +202,7 @@ def update_device(device_id: int, body: schemas.DeviceUpdate, db: Session = Depe
         if not item:
             logger.warning("Update device missed: id=%s", device_id)
             raise HTTPException(status_code=404, detail="Device not found")
+        device_state.invalidate_id(device_id)
         logger.info("Device updated: id=%s", device_id)
         return item
     except Exception as e:
@@ -87,6 +219,7 @@ def update_device_by_ip(device_ip: str, body: schemas.DeviceUpdate, db: Session
         raise HTTPException(status_code=404, detail="Device not found")
     try:
         updated = crud.update_device(db, item.device_id, body)
+        device_state.invalidate_id(item.device_id)
         logger.info("Device updated by ip: ip=%s id=%s", device_ip, item.device_id)
         return updated
     except Exception as e:
@@ -95,30 +228,17 @@ def update_device_by_ip(device_ip: str, body: schemas.DeviceUpdate, db: Session
 
 
 @router.put("/by-code/{device_code}", response_model=schemas.DeviceRead)
-def update_device_by_code(device_code: str, body: schemas.DeviceUpdate, db: Session = Depends(get_db)):
-    # 先根据 device_code 定位设备，再重用 update_device 逻辑
-    item = crud.get_device_by_code(db, device_code)
-    if not item:
-        logger.info("Device not found for update by code: %s, now create", device_code)
-        create = schemas.DeviceCreate(
-            device_code=device_code,
-            device_ip=body.device_ip,
-            rtsp_urls=body.rtsp_urls or [],
-            note=body.note or "",
-            device_config=body.device_config or {},
-            device_info=body.device_info or {},
-            status=body.status or "offline",
-        )
-        item = crud.create_device(db, create)
-        logger.info("Device created by code: code=%s id=%s", device_code, item.device_id)
-        return item
+def update_device_by_code(device_code: str, body: schemas.DeviceUpdate):
+    """Device self-report (heartbeat). Absorbed by app/device_state.py: unchanged reports touch
+    only memory, changed fields are written to t_device by the periodic batch flush.
+    Unknown codes are created on the spot."""
     try:
-        updated = crud.update_device(db, item.device_id, body)
-        logger.info("Device updated by code: code=%s id=%s", device_code, item.device_id)
-        return updated
+        row = device_state.heartbeat(device_code, body.model_dump(exclude_none=True))
     except Exception as e:
         logger.warning("Device update by code failed: code=%s err=%s", device_code, e)
         raise HTTPException(status_code=400, detail=str(e))
+    logger.debug("Device heartbeat by code: code=%s id=%s", device_code, row["device_id"])
+    return row
 
 
 @router.get("/by-ip/{device_ip}", response_model=schemas.DeviceRead)
@@ -134,6 +254,7 @@ def get_device_by_ip(device_ip: str, db: Session = Depends(get_db)):
 @router.delete("/{device_id}")
 def delete_device(device_id: int, db: Session = Depends(get_db)):
     ok = crud.delete_device(db, device_id)
+    device_state.invalidate_id(device_id)
     if not ok:
         logger.warning("Delete device not found: id=%s", device_id)
         raise HTTPException(status_code=404, detail="Device not found")
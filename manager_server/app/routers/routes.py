@@ -1,15 +1,18 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, Form, HTTPException, Query, Request
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from typing import Optional, List
+import logging
 import os
-import uuid
 
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..config import get_settings
-from .. import schemas, crud
+from .. import schemas, crud, models, storage, route_geometry, route_index, listing
 from ..deps import parse_auth
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/api/v1/routes", tags=["routes"], dependencies=[Depends(parse_auth)]) 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -17,30 +20,55 @@ settings = get_settings()
 ROUTE_DIR = os.path.join(settings.upload_dir, "routes")
 os.makedirs(ROUTE_DIR, exist_ok=True)
 
+ROUTE_LISTING = listing.Listing(
+    models.Route,
+    columns=list(schemas.RouteRead.model_fields),
+    sort=("create_time", "route_id"),
+    descending=True,
+)
+
 
-def _save_uploaded_file(file: UploadFile) -> str:
-    ext = os.path.splitext(file.filename)[1]
-    name = f"{uuid.uuid4().hex}{ext or ''}"
-    abs_path = os.path.join(ROUTE_DIR, name)
-    with open(abs_path, "wb") as f:
-        f.write(file.file.read())
-    # store as path relative to save_path
-    rel_path = os.path.join("routes", name).replace("\\", "/")
-    return rel_path
+def _save_uploaded_file(db: Session, file: UploadFile) -> str:
+    # stored content-addressed (path relative to save_path); the reference commits with the route row
+    return storage.store_fileobj(db, file.file, storage.normalize_ext(file.filename), "routes")
 
 
-def _remove_files(paths: List[str]):
+def _remove_files(db: Session, paths: List[str]):
     for rel in paths:
-        abs_path = os.path.normpath(os.path.join(settings.upload_dir, rel))
         try:
-            if os.path.exists(abs_path):
-                os.remove(abs_path)
+            storage.release(db, rel)
         except Exception:
-            pass
+            logger.exception("Release route file failed: %s", rel)
+
+
+def _load_indexed(db: Session, route_id: int):
+    """Parsed geometry of the uploaded route file. Builds the index synchronously only when
+    there is none for the current file/format (or it is unreadable); while the background
+    build is running the file is parsed without touching its index files. None if there is
+    no usable upload.
+    """
+    item = crud.get_route(db, route_id)
+    if not item or not item.route_file_path:
+        return None
+    meta = route_index.read_meta(route_id)
+    current = route_index.is_current(meta, item.route_file_path, item.route_format)
+    if current and meta.get("status") == "pending" and not route_index.is_stuck(meta):
+        try:
+            return route_index.parse_source(item.route_file_path, item.route_format)
+        except (OSError, ValueError):
+            return None
+    if current and meta.get("status") == "failed":
+        return None
+    indexed = route_index.load(route_id) if current and meta.get("status") == "ready" else None
+    if indexed is None:
+        meta = route_index.build(route_id, item.route_file_path, item.route_format)
+        indexed = route_index.load(route_id) if meta.get("status") == "ready" else None
+    return indexed.geometry if indexed else None
 
 
 @router.post("", response_model=schemas.RouteRead)
 def create_route(
+    background_tasks: BackgroundTasks,
     route_name: str = Form(...),
     route_format: Optional[str] = Form("gps"),
     upload_user_code: Optional[str] = Form(None),
@@ -48,20 +76,33 @@ def create_route(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
 ):
-    rel_path = _save_uploaded_file(file)
     body = schemas.RouteCreate(
         route_name=route_name,
         route_format=route_format,  # validated by schema default
         upload_user_code=upload_user_code,
         route_desc=route_desc,
     )
-    item = crud.create_route(db, body, rel_path)
+    rel_path = _save_uploaded_file(db, file)
+    try:
+        item = crud.create_route(db, body, rel_path)
+    except IntegrityError:
+        db.rollback()
+        storage.discard_if_unreferenced(db, rel_path)
+        raise HTTPException(status_code=409, detail="upload_user_code invalid")
+    background_tasks.add_task(route_index.build, item.route_id, rel_path, item.route_format)
     return item
 
 
 @router.get("", response_model=List[schemas.RouteRead])
-def list_routes(db: Session = Depends(get_db)):
-    return crud.list_routes(db)
+def list_routes(
+    request: Request,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+):
+    """Routes, newest first; fields/cursor/limit/ETag as in GET /api/v1/devices."""
+    return listing.respond(request, db, ROUTE_LISTING, fields, cursor, limit)
 
 
 #todo 后期增加对各个路径文件的解析，返回list点位数据
@@ -73,55 +114,90 @@ def get_route(route_id: int, db: Session = Depends(get_db)):
     return item
 
 
-# todo 目前使用本地临时文件，后面使用上传的路线文件根据id获取
 @router.get("/{route_id}/gps")
-def get_route_gps(route_id: int):
+def get_route_gps(
+    route_id: int,
+    zoom: Optional[int] = Query(None, ge=0, le=22),
+    tolerance: Optional[float] = Query(None, ge=0),
+    encoding: str = "json",
+    db: Session = Depends(get_db),
+):
     """Return GPS coordinates array [ [lon, lat], ... ] for the given route_id.
-    Data is temporarily loaded from settings.routes_file (JSON).
+    Data comes from the parsed upload (route_index, built in the background after upload);
+    routes without a usable upload fall back to the temporary settings.routes_file (JSON).
+
+    - zoom: Douglas-Peucker simplification to ~1 px at that web-map zoom level (cached per level)
+    - tolerance: simplification tolerance in meters (overrides zoom)
+    - encoding=polyline: return {route_id, points, precision, polyline} using Google encoded polyline (lat,lon)
     """
+    if encoding not in ("json", "polyline"):
+        raise HTTPException(status_code=400, detail="encoding must be 'json' or 'polyline'")
+    geo = _load_indexed(db, route_id)
+    if geo is None:
+        geo = _load_from_routes_file(route_id)
+
+    indices = None
+    if tolerance is not None:
+        indices = geo.indices_for_tolerance(tolerance)
+    elif zoom is not None:
+        indices = geo.indices_for_zoom(zoom)
+    if encoding == "polyline":
+        return {
+            "route_id": route_id,
+            "points": len(geo) if indices is None else len(indices),
+            "precision": 5,
+            "polyline": geo.encoded(indices),
+        }
+    return geo.coords(indices)
+
+
+def _load_from_routes_file(route_id: int):
     if not settings.routes_file:
-        raise HTTPException(status_code=500, detail="routes_file not configured")
+        raise HTTPException(status_code=404, detail="Route has no parsed route file")
     json_path = settings.routes_file
     if not os.path.exists(json_path):
         raise HTTPException(status_code=404, detail="routes_file not found")
     try:
-        import json
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        geo = route_geometry.get_from_routes_file(json_path, route_id)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="invalid coordinates format in routes_file")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"failed to read routes_file: {e}")
-    # Expected structure examples:
-    # { "123": [[lon, lat], ...], "124": [...] }
-    # or { "routes": { "123": [...] } }
-    coords = None
-    if isinstance(data, dict):
-        key = str(route_id)
-        if key in data and isinstance(data[key], list):
-            coords = data[key]
-        elif "routes" in data and isinstance(data["routes"], dict) and key in data["routes"]:
-            coords = data["routes"][key]
-    if not coords:
+    if geo is None:
         raise HTTPException(status_code=404, detail="route_id not found in routes_file")
-    # Normalize: ensure list of [lon, lat] float pairs
-    norm = []
-    try:
-        for item in coords:
-            if isinstance(item, (list, tuple)) and len(item) >= 2:
-                lon = float(item[0])
-                lat = float(item[1])
-                norm.append([lon, lat])
-            elif isinstance(item, dict) and "lon" in item and "lat" in item:
-                lon = float(item["lon"])  # type: ignore[index]
-                lat = float(item["lat"])  # type: ignore[index]
-                norm.append([lon, lat])
-    except Exception:
-        raise HTTPException(status_code=400, detail="invalid coordinates format in routes_file")
-    return norm
+    return geo
+
+
+@router.get("/{route_id}/alarms", response_model=List[schemas.AlarmRead])
+def list_route_alarms(
+    route_id: int,
+    start_km: Optional[float] = Query(None, ge=0),
+    end_km: Optional[float] = Query(None, ge=0),
+    process_status: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=1000),
+    db: Session = Depends(get_read_db),
+):
+    """Alarms attributed to this route with chainage in [start_km, end_km], ordered along the route."""
+    if start_km is not None and end_km is not None and start_km > end_km:
+        raise HTTPException(status_code=400, detail="start_km must not exceed end_km")
+    if not crud.get_route(db, route_id):
+        raise HTTPException(status_code=404, detail="Route not found")
+    return crud.query_alarms_along_route(
+        db,
+        route_id,
+        start_km * 1000.0 if start_km is not None else None,
+        end_km * 1000.0 if end_km is not None else None,
+        process_status,
+        skip,
+        limit,
+    )
 
 
 @router.put("/{route_id}", response_model=schemas.RouteRead)
 def update_route(
     route_id: int,
+    background_tasks: BackgroundTasks,
     route_name: Optional[str] = Form(None),
     route_format: Optional[str] = Form(None),
     upload_user_code: Optional[str] = Form(None),
@@ -129,24 +205,35 @@ def update_route(
     file: Optional[UploadFile] = File(None),
     db: Session = Depends(get_db),
 ):
-    new_rel_path: Optional[str] = None
-    if file is not None:
-        new_rel_path = _save_uploaded_file(file)
     body = schemas.RouteUpdate(
         route_name=route_name,
         route_format=route_format,
         upload_user_code=upload_user_code,
         route_desc=route_desc,
     )
-    # If replacing file, consider removing old one
     old = crud.get_route(db, route_id)
-    item = crud.update_route(db, route_id, body, new_rel_path)
-    if not item:
+    if not old:
+        raise HTTPException(status_code=404, detail="Route not found")
+    old_rel_path = old.route_file_path
+    old_format = old.route_format
+    new_rel_path: Optional[str] = None
+    if file is not None:
+        new_rel_path = _save_uploaded_file(db, file)
+    try:
+        item = crud.update_route(db, route_id, body, new_rel_path)
+    except IntegrityError:
+        db.rollback()
         if new_rel_path:
-            _remove_files([new_rel_path])  # cleanup newly saved file if route missing
+            storage.discard_if_unreferenced(db, new_rel_path)
+        raise HTTPException(status_code=409, detail="upload_user_code invalid")
+    if not item:
         raise HTTPException(status_code=404, detail="Route not found")
-    if new_rel_path and old and old.route_file_path and old.route_file_path != new_rel_path:
-        _remove_files([old.route_file_path])
+    # replacing the file drops the old reference; re-uploading the same content drops the extra one
+    if new_rel_path and old_rel_path:
+        _remove_files(db, [old_rel_path])
+    route_geometry.invalidate(route_id)
+    if new_rel_path or (route_format and route_format != old_format):
+        background_tasks.add_task(route_index.build, route_id, item.route_file_path, item.route_format)
     return item
 
 
@@ -170,7 +257,9 @@ def delete_route(route_id: int, db: Session = Depends(get_db)):
     deleted = crud.delete_routes_by_ids(db, [route_id])
     if deleted == 0:
         raise HTTPException(status_code=404, detail="Route not found")
-    _remove_files(files)
+    _remove_files(db, files)
+    route_geometry.invalidate(route_id)
+    route_index.remove(route_id)
     return {"deleted": deleted}
 
 
@@ -180,5 +269,8 @@ def delete_routes(ids: List[int], db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="ids is required")
     files = crud.get_route_file_paths_by_ids(db, ids)
     deleted = crud.delete_routes_by_ids(db, ids)
-    _remove_files(files)
+    _remove_files(db, files)
+    for rid in ids:
+        route_geometry.invalidate(rid)
+        route_index.remove(rid)
     return {"deleted": deleted}
@@ -1,15 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
 from typing import Optional, List
 
-from ..database import get_db
-from .. import schemas, crud, models
+from ..database import get_db, get_read_db
+from .. import schemas, crud, models, listing, cache
 from ..config import get_settings
 from ..auth import encode_jwt
 import time
 
 router = APIRouter(prefix="/api/v1/users", tags=["users"]) 
 
+# user writes invalidate the cache; the TTL only bounds drift from edits made outside the API
+USERS_TTL = 300
+
+# user_password is not in UserRead, so it can never be projected
+USER_LISTING = listing.Listing(
+    models.User,
+    columns=list(schemas.UserRead.model_fields),
+    sort=("user_id",),
+    descending=False,
+    cache_namespace="users",
+    cache_ttl=USERS_TTL,
+)
+
 
 @router.post("/login", response_model=schemas.LoginResponse)
 def login(body: schemas.LoginRequest, db: Session = Depends(get_db), response: Response = None):
@@ -55,8 +69,21 @@ def get_all_users(db: Session = Depends(get_db)):
     """
     获取所有用户的基本信息
     """
-    users = crud.get_all_users(db)
-    return users
+    return cache.get_or_load("users", "all", USERS_TTL, lambda: jsonable_encoder(crud.get_all_users(db)))
+
+@router.get("", response_model=List[schemas.UserRead])
+def list_users(
+    request: Request,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+):
+    """
+    用户列表（按 user_id 升序）；fields/cursor/limit/ETag 用法同 GET /api/v1/devices
+    """
+    return listing.respond(request, db, USER_LISTING, fields, cursor, limit)
+
 
 @router.post("", response_model=schemas.UserRead)
 def create_user(body: schemas.UserCreate, db: Session = Depends(get_db)):
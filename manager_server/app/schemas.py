@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional, List, Any, Literal
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field
 
 
 class DeviceCreate(BaseModel):
@@ -24,6 +24,7 @@ class DeviceRead(BaseModel):
     status: Literal["online", "offline", "fault", "maintenance"]
     create_time: datetime
     update_time: datetime
+    last_seen: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -38,6 +39,15 @@ class DeviceUpdate(BaseModel):
     status: Optional[Literal["online", "offline", "fault", "maintenance"]] = None
 
 
+class FleetRefresh(BaseModel):
+    device_ids: Optional[List[int]] = None  # default: all devices
+
+
+class FleetConfigPush(BaseModel):
+    config: dict
+    device_ids: Optional[List[int]] = None  # default: all devices
+
+
 class AlarmCreate(BaseModel):
     alarm_time: datetime
     longitude: float
@@ -73,9 +83,19 @@ class AlarmRead(BaseModel):
     user_code: Optional[str]
     address: Optional[str]
     simple_address: Optional[str]
+    route_id: Optional[int] = None
+    route_offset_m: Optional[float] = None
+    route_distance_m: Optional[float] = None
     create_time: datetime
     update_time: datetime
 
+    @computed_field  # type: ignore[misc]
+    @property
+    def thumb_url(self) -> Optional[str]:
+        if not self.image_url:
+            return None
+        return f"/api/v1/alarms/{self.alarm_id}/thumb"
+
     class Config:
         from_attributes = True
 
@@ -0,0 +1,56 @@
+"""JSON for the alarm list endpoints without ORM instances or Pydantic models.
+
+The list queries select the AlarmRead columns as plain row mappings
+(crud.query_alarm_rows_*); alarm_item() turns a row into the document AlarmRead
+produces (same keys and order, Numeric lat/lon as float, thumb_url) and
+json_response() encodes the payload with orjson, falling back to the json module
+when orjson is not installed.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Mapping
+
+from fastapi import Response
+
+from .schemas import AlarmRead
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# AlarmRead field order; each is a t_alarm_info column (thumb_url is computed)
+ALARM_FIELDS = tuple(AlarmRead.model_fields)
+
+
+def alarm_item(row: Mapping[str, Any]) -> dict:
+    item = {name: row[name] for name in ALARM_FIELDS}
+    if item["longitude"] is not None:
+        item["longitude"] = float(item["longitude"])
+    if item["latitude"] is not None:
+        item["latitude"] = float(item["latitude"])
+    item["thumb_url"] = f"/api/v1/alarms/{item['alarm_id']}/thumb" if item["image_url"] else None
+    return item
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        text = obj.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        # datetimes come out like pydantic's: UTC as "Z", naive ones without offset
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_UTC_Z)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(obj: Any, status_code: int = 200) -> Response:
+    return Response(dumps(obj), status_code=status_code, media_type="application/json")
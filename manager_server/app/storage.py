@@ -0,0 +1,275 @@
+"""Content-addressed upload storage.
+Files are named by the SHA-256 of their content and sharded as
+<category>/<h[0:2]>/<h[2:4]>/<h><ext> under settings.upload_dir; identical uploads
+share one file, reference-counted in t_stored_file.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+import shutil
+import uuid
+from typing import BinaryIO, Optional, Tuple
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+_EXT_RE = re.compile(r"^\.[A-Za-z0-9]{1,15}$")
+_SHARDED_RE = re.compile(r"^[^/]+/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[A-Za-z0-9]{1,15})?$")
+# packed member of a per-day archive: packs/<yyyy>/<mm>/<yyyy-mm-dd>.pack@<offset>+<length><ext>
+_PACK_RE = re.compile(r"^(packs/.+\.pack)@(\d+)\+(\d+)(\.[A-Za-z0-9]{1,15})?$")
+
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+}
+
+
+def normalize_ext(filename: Optional[str], default: str = "") -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if _EXT_RE.match(ext) else default
+
+
+def sharded_rel_path(category: str, digest: str, ext: str) -> str:
+    return f"{category}/{digest[0:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+def is_sharded(rel_path: str) -> bool:
+    return bool(_SHARDED_RE.match(rel_path or ""))
+
+
+def is_packed(rel_path: str) -> bool:
+    return bool(_PACK_RE.match(rel_path or ""))
+
+
+def abs_path(rel_path: str) -> str:
+    return os.path.normpath(os.path.join(get_settings().upload_dir, rel_path))
+
+
+def resolve(rel_path: str) -> Optional[str]:
+    """abs_path() that refuses paths escaping the upload root (None in that case)."""
+    root = os.path.realpath(get_settings().upload_dir)
+    path = os.path.realpath(os.path.join(root, rel_path))
+    if path != root and not path.startswith(root + os.sep):
+        return None
+    return path
+
+
+def pack_url(pack_rel: str, offset: int, length: int, ext: str) -> str:
+    return f"{pack_rel}@{int(offset)}+{int(length)}{ext}"
+
+
+def parse_pack_url(rel_path: str) -> Optional[Tuple[str, int, int, str]]:
+    m = _PACK_RE.match(rel_path or "")
+    if not m:
+        return None
+    return m.group(1), int(m.group(2)), int(m.group(3)), m.group(4) or ""
+
+
+def media_type(rel_path: str) -> str:
+    ext = os.path.splitext(rel_path or "")[1].lower()
+    return MEDIA_TYPES.get(ext, "application/octet-stream")
+
+
+def exists(rel_path: str) -> bool:
+    packed = parse_pack_url(rel_path)
+    path = resolve(packed[0] if packed else rel_path)
+    return bool(path) and os.path.isfile(path)
+
+
+def open_image(rel_path: str) -> Optional[Tuple[BinaryIO, int]]:
+    """Open a stored image (plain file or packed member) for reading; returns (fileobj, size).
+    Returns None when the path is outside the upload root or missing. Caller closes fileobj.
+    """
+    packed = parse_pack_url(rel_path)
+    path = resolve(packed[0] if packed else rel_path)
+    if not path or not os.path.isfile(path):
+        return None
+    if packed:
+        _, offset, length, _ = packed
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        if len(data) != length:
+            return None
+        return io.BytesIO(data), length
+    f = open(path, "rb")
+    return f, os.fstat(f.fileno()).st_size
+
+
+def _tmp_path(category: str) -> str:
+    tmp_dir = os.path.join(get_settings().upload_dir, category, ".tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, uuid.uuid4().hex)
+
+
+def _place(tmp: str, rel_path: str) -> None:
+    """Move a fully written temp file into its content-addressed location (no-op if present)."""
+    dst = abs_path(rel_path)
+    if os.path.exists(dst):
+        os.remove(tmp)
+        return
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    os.replace(tmp, dst)
+
+
+def acquire(db: Session, rel_path: str, digest: str, size: int, refs: int = 1) -> None:
+    """Add refs references to rel_path within the caller's (uncommitted) transaction."""
+    stmt = pg_insert(models.StoredFile).values(
+        file_path=rel_path, sha256=digest, file_size=size, ref_count=refs
+    ).on_conflict_do_update(
+        index_elements=[models.StoredFile.file_path],
+        set_={"ref_count": models.StoredFile.ref_count + refs},
+    )
+    db.execute(stmt)
+
+
+def store_bytes(db: Session, content: bytes, ext: str, category: str, refs: int = 1) -> str:
+    """Store content under its hash and take a reference; returns path relative to save_path."""
+    digest = hashlib.sha256(content).hexdigest()
+    rel_path = sharded_rel_path(category, digest, ext)
+    # reference first: the row lock serialises us against a concurrent release() of the same file
+    acquire(db, rel_path, digest, len(content), refs)
+    if not os.path.exists(abs_path(rel_path)):
+        tmp = _tmp_path(category)
+        with open(tmp, "wb") as f:
+            f.write(content)
+        _place(tmp, rel_path)
+    return rel_path
+
+
+def store_fileobj(db: Session, fileobj: BinaryIO, ext: str, category: str) -> str:
+    """Stream fileobj to disk in chunks while hashing, then store it like store_bytes."""
+    tmp = _tmp_path(category)
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, "wb") as f:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                h.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        digest = h.hexdigest()
+        rel_path = sharded_rel_path(category, digest, ext)
+        acquire(db, rel_path, digest, size)
+        _place(tmp, rel_path)
+        return rel_path
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def hash_file(path: str) -> Tuple[str, int]:
+    h = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+            size += len(chunk)
+    return h.hexdigest(), size
+
+
+def adopt_file(db: Session, legacy_rel: str, category: str) -> Optional[str]:
+    """Link (or copy) an existing flat upload into the sharded layout and take a reference.
+    The legacy file is left in place; callers delete it after committing the row update.
+    Returns the new relative path, or None if the legacy file is missing.
+    """
+    src = abs_path(legacy_rel)
+    if not os.path.isfile(src):
+        return None
+    digest, size = hash_file(src)
+    rel_path = sharded_rel_path(category, digest, normalize_ext(legacy_rel))
+    acquire(db, rel_path, digest, size)
+    if not os.path.exists(abs_path(rel_path)):
+        tmp = _tmp_path(category)
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        _place(tmp, rel_path)
+    return rel_path
+
+
+def release(db: Session, rel_path: str, refs: int = 1) -> bool:
+    """Drop refs references to rel_path and commit (together with the caller's pending
+    changes); then delete the file if nothing references it. Returns True if it was deleted.
+    Raises if the commit fails: the session is rolled back and the file is kept.
+    Paths without a t_stored_file row are legacy single-owner uploads and are deleted directly.
+    Packed members are never deleted individually (packs are append-only).
+    """
+    if not rel_path or parse_pack_url(rel_path):
+        return False
+    try:
+        row = db.execute(
+            update(models.StoredFile)
+            .where(models.StoredFile.file_path == rel_path)
+            .values(ref_count=models.StoredFile.ref_count - refs)
+            .returning(models.StoredFile.ref_count, models.StoredFile.sha256, models.StoredFile.file_size)
+        ).first()
+        remove = row is None or row.ref_count <= 0
+        if row is not None and remove:
+            db.execute(delete(models.StoredFile).where(models.StoredFile.file_path == rel_path))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if not remove:
+        return False
+    # unlink only after the commit, so a failed commit never leaves rows pointing at a deleted
+    # file; at worst a crash here leaves an unreferenced file behind, which is harmless
+    try:
+        if row is not None:
+            # hold a placeholder row while unlinking: a concurrent store of the same content
+            # waits on it and then writes the file again instead of finding ours about to vanish
+            claimed = db.execute(
+                pg_insert(models.StoredFile)
+                .values(file_path=rel_path, sha256=row.sha256, file_size=row.file_size, ref_count=0)
+                .on_conflict_do_nothing(index_elements=[models.StoredFile.file_path])
+                .returning(models.StoredFile.file_path)
+            ).first()
+            if claimed is None:
+                # stored again since our commit; the file is in use
+                db.rollback()
+                return False
+        path = abs_path(rel_path)
+        if os.path.exists(path):
+            os.remove(path)
+        if row is not None:
+            db.execute(delete(models.StoredFile).where(models.StoredFile.file_path == rel_path))
+            db.commit()
+        return True
+    except Exception:
+        db.rollback()
+        logger.exception("Remove released file failed: %s", rel_path)
+        return False
+
+
+def discard_if_unreferenced(db: Session, rel_path: str) -> None:
+    """Remove a freshly stored file whose referencing insert was rolled back."""
+    stmt = select(models.StoredFile.file_path).where(models.StoredFile.file_path == rel_path)
+    try:
+        if db.execute(stmt).first() is None:
+            path = abs_path(rel_path)
+            if os.path.exists(path):
+                os.remove(path)
+        db.rollback()
+    except Exception:
+        logger.exception("Discard stored file failed: %s", rel_path)
@@ -0,0 +1,89 @@
+import os
+import logging
+import uuid
+from typing import Iterable, List, Optional
+
+from PIL import Image
+
+from . import storage
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+def thumb_sizes() -> List[int]:
+    return list(get_settings().thumb_sizes)
+
+
+def pick_size(requested: Optional[int]) -> int:
+    """Map a requested edge length onto the closest configured size (smallest by default)."""
+    sizes = sorted(thumb_sizes())
+    if not requested:
+        return sizes[0]
+    for s in sizes:
+        if s >= requested:
+            return s
+    return sizes[-1]
+
+
+def thumb_path_for(image_path: str, size: int) -> str:
+    """Thumbnail lives next to the original: '<dir>/<stem>.thumb<size>.jpg'.
+    Works for both absolute paths and image_url values relative to save_path.
+    """
+    stem, _ = os.path.splitext(image_path)
+    return f"{stem}.thumb{int(size)}.jpg"
+
+
+def _render(src, dst_abs: str, size: int, quality: int) -> None:
+    """src is a path or a binary file object."""
+    with Image.open(src) as im:
+        # let the JPEG decoder downscale while decoding; much cheaper than a full decode
+        im.draft("RGB", (size, size))
+        im = im.convert("RGB")
+        im.thumbnail((size, size))
+        tmp = f"{dst_abs}.{uuid.uuid4().hex}.tmp"
+        try:
+            im.save(tmp, format="JPEG", quality=quality, optimize=True)
+            os.replace(tmp, dst_abs)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def generate_thumbnails(src_abs: str, sizes: Optional[Iterable[int]] = None) -> List[str]:
+    """Render all configured (or given) thumbnail sizes for src_abs; returns written paths."""
+    settings = get_settings()
+    written = []
+    for size in sizes or settings.thumb_sizes:
+        dst = thumb_path_for(src_abs, size)
+        _render(src_abs, dst, int(size), settings.thumb_quality)
+        written.append(dst)
+    return written
+
+
+def ensure_thumbnail(image_url: str, size: int) -> Optional[str]:
+    """Return the absolute thumbnail path for a stored image_url at size, generating it on
+    first request (plain files and packed archive members alike).
+    Returns None if the original image is missing.
+    """
+    dst = storage.abs_path(thumb_path_for(image_url, size))
+    if os.path.exists(dst):
+        return dst
+    opened = storage.open_image(image_url)
+    if not opened:
+        return None
+    src, _ = opened
+    with src:
+        _render(src, dst, int(size), get_settings().thumb_quality)
+    logger.debug("Thumbnail generated lazily: %s", dst)
+    return dst
+
+
+def remove_thumbnails(src_abs: str) -> None:
+    for size in thumb_sizes():
+        p = thumb_path_for(src_abs, size)
+        try:
+            if os.path.exists(p):
+                os.remove(p)
+        except Exception:
+            pass
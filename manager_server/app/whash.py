@@ -0,0 +1,55 @@
+"""Wavelet image hash (WHash), bit-identical to imagededup.methods.WHash.
+
+    whash.encode_image(path)        -> '16 hex chars' (None if the file is not a readable image)
+    whash.hamming_distance(h1, h2)  -> differing bits
+
+Same pipeline as imagededup 0.3.x: RGB (alpha dropped), LANCZOS resize to 256x256,
+grayscale, scale to [0, 1], 5-level haar wavedec2, LL (8x8) >= its median, packed
+into hex. Needs only numpy and PyWavelets, imported on first use, so the server does
+not pull imagededup (and its torch stack) in at startup.
+"""
+import logging
+import os
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+TARGET_SIZE = (256, 256)
+IMG_FORMATS = ("JPEG", "PNG", "BMP", "MPO", "PPM", "TIFF", "GIF", "WEBP")
+
+
+def _load_gray(image_file: str):
+    import numpy as np
+    from PIL import Image
+
+    try:
+        img = Image.open(image_file)
+        if img.format not in IMG_FORMATS:
+            logger.warning("WHash: invalid image format %s: %s", img.format, image_file)
+            return None
+        if img.mode != "RGB":
+            # via RGBA like imagededup (alpha is ignored)
+            img = img.convert("RGBA").convert("RGB")
+        img = img.resize(TARGET_SIZE, Image.LANCZOS).convert("L")
+        return np.array(img).astype("uint8")
+    except Exception as e:
+        logger.warning("WHash: invalid image file %s: %s", image_file, e)
+        return None
+
+
+def encode_image(image_file: str) -> Optional[str]:
+    if not image_file or not os.path.exists(image_file):
+        raise ValueError("Please provide either image file path or image array!")
+    pixels = _load_gray(image_file)
+    if pixels is None:
+        return None
+    import numpy as np
+    import pywt
+
+    ll = pywt.wavedec2(data=pixels / 255, wavelet="haar", level=5)[0]
+    bits = ll >= np.median(np.ndarray.flatten(ll))
+    return "".join("%0.2x" % x for x in np.packbits(bits))
+
+
+def hamming_distance(hash1: str, hash2: str) -> int:
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count("1")
@@ -0,0 +1,86 @@
+"""Fan-out of in-process state changes between worker processes (run_server.py --workers N).
+
+    worker_bus.subscribe("cache", lambda namespaces: ...)   # at import time
+    worker_bus.publish("cache", ["users"])                   # after the local change
+
+Messages travel as NOTIFY on one channel (app/pg_listener.py) and reach every *other*
+worker; the publisher applies its change locally itself. With a single worker publish()
+is a no-op. NOTIFY payloads are limited to ~8000 bytes, so send ids or small snapshots.
+A message published while a worker's listener is reconnecting is lost for that worker;
+subscribers keep their state bounded by TTLs or reloads.
+"""
+import json
+import logging
+import os
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import text
+
+from . import pg_listener
+from .config import get_settings
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "worker_bus"
+MAX_PAYLOAD = 7900
+
+_handlers: Dict[str, Callable[[Any], None]] = {}
+_origin: Dict[int, str] = {}
+
+
+def enabled() -> bool:
+    return get_settings().workers > 1
+
+
+def origin() -> str:
+    # per process: preloaded workers fork from a parent that already imported this module
+    pid = os.getpid()
+    if pid not in _origin:
+        _origin[pid] = f"{pid}-{uuid.uuid4().hex[:8]}"
+    return _origin[pid]
+
+
+def subscribe(kind: str, handler: Callable[[Any], None]) -> None:
+    """handler(data) runs on the pg-listener thread for messages of this kind from other workers."""
+    _handlers[kind] = handler
+
+
+def publish(kind: str, data: Any, db=None) -> bool:
+    """Send data to the other workers; inside db's transaction if given (delivered on commit),
+    otherwise right away. Returns False if the message could not be sent."""
+    if not enabled():
+        return False
+    payload = json.dumps({"o": origin(), "k": kind, "d": data}, ensure_ascii=False, separators=(",", ":"), default=str)
+    if len(payload.encode("utf-8")) > MAX_PAYLOAD:
+        logger.warning("Worker bus message too large, dropped: kind=%s bytes=%s", kind, len(payload))
+        return False
+    try:
+        if db is not None:
+            pg_listener.notify(db, CHANNEL, payload)
+        else:
+            with engine.begin() as conn:
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+        return True
+    except Exception as e:
+        logger.warning("Worker bus publish failed: kind=%s err=%s", kind, e)
+        return False
+
+
+def _on_notify(payload: str) -> None:
+    try:
+        msg = json.loads(payload)
+    except ValueError:
+        logger.warning("Worker bus: malformed message ignored")
+        return
+    if msg.get("o") == origin():
+        return
+    handler: Optional[Callable[[Any], None]] = _handlers.get(msg.get("k"))
+    if handler is not None:
+        handler(msg.get("d"))
+
+
+def start_background() -> None:
+    if enabled():
+        pg_listener.subscribe(CHANNEL, _on_notify)
@@ -49,14 +49,14 @@ python -m PyInstaller ^
     --hidden-import sqlalchemy.dialects.postgresql.psycopg2 ^
     --hidden-import psycopg2 ^
     --hidden-import pydantic ^
+    --hidden-import orjson ^
     --hidden-import passlib ^
     --hidden-import passlib.handlers.bcrypt ^
     --hidden-import bcrypt ^
     --hidden-import yaml ^
-    --hidden-import imagededup ^
+    --hidden-import pywt ^
     --hidden-import PIL ^
     --hidden-import numpy ^
-    --hidden-import scipy ^
     --hidden-import jaraco.text ^
     --hidden-import jaraco.context ^
     --hidden-import jaraco.functools ^
@@ -67,6 +67,7 @@ python -m PyInstaller ^
     --hidden-import tzdata ^
     --add-data "config;config" ^
     --add-data "routes.json;." ^
+    --add-data "sql\migrations;sql\migrations" ^
     run_server.py
 
 if errorlevel 1 (
@@ -2,10 +2,37 @@
 """
 Entry point for PyInstaller packaging.
 Ensures working directory and config resolution work in both dev and frozen exe.
+
+    run_server.exe migrate              create/update the schema (app/migrate.py), then exit
+    run_server.exe                      single process (default, server.workers: 1)
+    run_server.exe --workers 4          production mode: supervisor + 4 worker processes
+
+The server does not touch the schema at startup; run migrate after installing or
+upgrading. In production mode the supervisor binds the port and starts the workers; with server.preload on POSIX it imports the app first and forks the workers from
+it. Each worker gets its share of database.pool_size/max_overflow (app/database.py),
+singleton jobs run in one elected worker (app/leader.py) and in-process caches follow
+changes from the other workers (app/worker_bus.py). Workers send their log records to
+the supervisor, the only process that writes and rotates the log file (app/log_setup.py). SIGHUP, or touching
+server.reload_file, replaces the workers one at a time: a new worker starts serving
+before an old one stops accepting and drains its requests (server.graceful_timeout).
+Preloaded workers are forked from the supervisor's copy of the code, so picking up new
+code needs preload: false (or a full restart). Workers that die are restarted.
 """
 import os
 import sys
 import logging
+import argparse
+import itertools
+import multiprocessing
+import signal
+import threading
+import time
+
+logger = logging.getLogger("run_server")
+
+# a replacement worker must finish its startup within this time during a reload
+WORKER_START_TIMEOUT = 60
+
 
 def setup_paths():
     """Set up sys.path and working directory for frozen exe."""
@@ -24,17 +51,173 @@ def setup_paths():
         sys.path.insert(0, app_path)
     return base_path
 
+
+def _worker_main(config, sockets, stop, ready, log_queue):
+    """Worker process: serve on the inherited sockets until stop is set (graceful) or signalled."""
+    import uvicorn
+    from app import log_setup
+
+    # the supervisor alone writes (and rotates) the log file
+    log_setup.to_queue(log_queue)
+    config.configure_logging()
+    server = uvicorn.Server(config)
+
+    def watch():
+        while not server.started and not stop.is_set():
+            time.sleep(0.1)
+        if server.started:
+            ready.set()
+        stop.wait()
+        server.should_exit = True
+
+    threading.Thread(target=watch, name="worker-stop-watch", daemon=True).start()
+    server.run(sockets=sockets)
+
+
+class Supervisor:
+    def __init__(self, config, workers, preload, graceful_timeout, reload_file):
+        self.config = config
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.reload_file = reload_file
+        # fork shares the preloaded app copy-on-write; spawn (Windows) imports it per worker
+        self.ctx = multiprocessing.get_context("fork" if preload and hasattr(os, "fork") else "spawn")
+        self.sockets = [config.bind_socket()]
+        self.log_queue = self.ctx.Queue()
+        self.procs = []  # [process, stop event, ready event]
+        self._ids = itertools.count(1)
+        self._exit = threading.Event()
+        self._reload = threading.Event()
+
+    def start_worker(self):
+        stop, ready = self.ctx.Event(), self.ctx.Event()
+        p = self.ctx.Process(
+            target=_worker_main,
+            args=(self.config, self.sockets, stop, ready, self.log_queue),
+            name=f"worker-{next(self._ids)}",
+        )
+        p.start()
+        logger.info("Started %s (pid %s)", p.name, p.pid)
+        return [p, stop, ready]
+
+    def stop_worker(self, worker):
+        p, stop, _ = worker
+        stop.set()
+        p.join(self.graceful_timeout + 5)
+        if p.is_alive():
+            logger.warning("%s did not stop in time, terminating", p.name)
+            p.terminate()
+            p.join(5)
+
+    def reload(self):
+        logger.info("Reloading %s workers", len(self.procs))
+        for old in list(self.procs):
+            new = self.start_worker()
+            if not new[2].wait(WORKER_START_TIMEOUT):
+                logger.error("%s failed to start, keeping the remaining old workers", new[0].name)
+                self.stop_worker(new)
+                return
+            self.procs[self.procs.index(old)] = new
+            self.stop_worker(old)
+        logger.info("Reload complete")
+
+    def _reload_requested(self, mtime):
+        if not self.reload_file:
+            return mtime
+        try:
+            current = os.path.getmtime(self.reload_file)
+        except OSError:
+            return mtime
+        if mtime is not None and current != mtime:
+            self._reload.set()
+        return current
+
+    def run(self):
+        from app import log_setup
+
+        listener = log_setup.start_listener(self.log_queue)
+        signal.signal(signal.SIGINT, lambda *_: self._exit.set())
+        signal.signal(signal.SIGTERM, lambda *_: self._exit.set())
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda *_: self._reload.set())
+        self.procs = [self.start_worker() for _ in range(self.workers)]
+        mtime = self._reload_requested(None)
+        while not self._exit.wait(1.0):
+            mtime = self._reload_requested(mtime)
+            if self._reload.is_set():
+                self._reload.clear()
+                self.reload()
+            for i, worker in enumerate(self.procs):
+                if not worker[0].is_alive() and not self._exit.is_set():
+                    logger.warning("%s exited with code %s, restarting", worker[0].name, worker[0].exitcode)
+                    self.procs[i] = self.start_worker()
+        logger.info("Shutting down %s workers", len(self.procs))
+        for worker in self.procs:
+            worker[1].set()
+        for worker in self.procs:
+            self.stop_worker(worker)
+        for sock in self.sockets:
+            sock.close()
+        listener.stop()
+
+
+def serve_workers(host, port, workers):
+    import uvicorn
+    from app.config import get_settings
+
+    settings = get_settings()
+    if settings.preload and hasattr(os, "fork"):
+        # preload: the workers inherit the imported app
+        import app.main  # noqa: F401
+        from app.database import engine, read_replicas
+        engine.dispose()  # no pooled connection may cross the fork
+        for replica in read_replicas:
+            replica.engine.dispose()
+
+    config = uvicorn.Config(
+        "app.main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        log_level="info",
+        timeout_graceful_shutdown=settings.graceful_timeout,
+    )
+    Supervisor(config, workers, settings.preload, settings.graceful_timeout, settings.reload_file).run()
+
+
 def main():
     base_path = setup_paths()
-    # Import after path setup
-    from app.main import app
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Alarm Service")
+    parser.add_argument("command", nargs="?", choices=("serve", "migrate"), default="serve")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: server.workers)")
+    args = parser.parse_args()
+    if args.workers:
+        # read by app/config.py, here and in the workers
+        os.environ["WORKERS"] = str(args.workers)
+
+    if args.command == "migrate":
+        from app import migrate
+        migrate.run()
+        return
+
+    from app.config import get_settings
     import uvicorn
 
+    settings = get_settings()
     # Optional: read host/port from config or env
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8001"))
+    if settings.workers > 1:
+        serve_workers(host, port, settings.workers)
+        return
+    # Import after path setup
+    from app.main import app
     # For exe, we don't use --reload
     uvicorn.run(app, host=host, port=port, log_level="info")
 
+
 if __name__ == "__main__":
+    # PyInstaller: spawned worker processes re-enter the exe
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,26 @@
+-- 上传文件内容寻址存储的引用计数表（文件按 SHA-256 命名并分级目录存放）
+CREATE TABLE IF NOT EXISTS t_stored_file (
+    file_path VARCHAR(1024) PRIMARY KEY,
+    sha256 VARCHAR(64) NOT NULL,
+    file_size BIGINT NOT NULL DEFAULT 0,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    create_time TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE t_stored_file IS '上传文件引用计数表（相同内容的图片/路线文件只存一份）';
+COMMENT ON COLUMN t_stored_file.file_path IS '相对 save_path 的存储路径，如 alarms/ab/cd/<sha256>.jpg';
+COMMENT ON COLUMN t_stored_file.sha256 IS '文件内容 SHA-256';
+COMMENT ON COLUMN t_stored_file.file_size IS '文件字节数';
+COMMENT ON COLUMN t_stored_file.ref_count IS '引用该文件的记录数，降为 0 时删除文件';
+COMMENT ON COLUMN t_stored_file.create_time IS '首次写入时间';
+
+-- create_all 建表时已有同列索引（ix_t_stored_file_sha256），不重复创建
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = 't_stored_file' AND indexdef LIKE '%(sha256)'
+    ) THEN
+        CREATE INDEX idx_stored_file_sha256 ON t_stored_file (sha256);
+    END IF;
+END $$;
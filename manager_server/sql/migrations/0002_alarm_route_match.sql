@@ -0,0 +1,23 @@
+-- 报警归属路线：最近路线、沿线里程（米）及偏离距离（米），由 app/route_matching.py 在入库时计算
+-- 存量数据执行 python tools/backfill_alarms.py 回填
+ALTER TABLE t_alarm_info ADD COLUMN IF NOT EXISTS route_id INTEGER;
+ALTER TABLE t_alarm_info ADD COLUMN IF NOT EXISTS route_offset_m DOUBLE PRECISION;
+ALTER TABLE t_alarm_info ADD COLUMN IF NOT EXISTS route_distance_m DOUBLE PRECISION;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 't_alarm_info'::regclass AND contype = 'f' AND confrelid = 't_route'::regclass
+    ) THEN
+        ALTER TABLE t_alarm_info ADD CONSTRAINT fk_alarm_route FOREIGN KEY (route_id) REFERENCES t_route (route_id)
+            ON DELETE SET NULL;  -- 路线删除时报警保留，归属置空
+    END IF;
+END $$;
+
+COMMENT ON COLUMN t_alarm_info.route_id IS '匹配到的最近路线ID（超出匹配距离时为空）';
+COMMENT ON COLUMN t_alarm_info.route_offset_m IS '报警点投影到路线上的里程（米，自路线起点）';
+COMMENT ON COLUMN t_alarm_info.route_distance_m IS '报警点到路线的垂直距离（米）';
+
+-- 按路线+里程区间查询（如“3号路线 2-5 公里内的报警”）
+CREATE INDEX IF NOT EXISTS idx_alarm_route_offset ON t_alarm_info (route_id, route_offset_m);
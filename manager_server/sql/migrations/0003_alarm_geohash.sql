@@ -0,0 +1,7 @@
+-- 报警点 geohash（9 位，约 5 米精度），用于地图聚合；存量数据执行 python tools/backfill_alarms.py --only geohash 回填
+ALTER TABLE t_alarm_info ADD COLUMN IF NOT EXISTS geohash VARCHAR(12);
+
+COMMENT ON COLUMN t_alarm_info.geohash IS '报警位置 geohash 编码（前缀即聚合网格）';
+
+-- varchar_pattern_ops 使 geohash LIKE 'wtw3%' 前缀查询可走索引
+CREATE INDEX IF NOT EXISTS idx_alarm_geohash ON t_alarm_info (geohash varchar_pattern_ops);
@@ -0,0 +1,4 @@
+-- 设备最后心跳时间，由 app/device_state.py 批量回写；超过 device_offline_after 秒无心跳置为 offline
+ALTER TABLE t_device ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP WITH TIME ZONE;
+
+COMMENT ON COLUMN t_device.last_seen IS '设备最后一次心跳/上报时间';
@@ -0,0 +1,41 @@
+-- 设备指标历史：原始采样（短期保留）+ 1 分钟 / 1 小时降采样（见 app/device_metrics.py）
+CREATE TABLE IF NOT EXISTS t_device_metric (
+    device_id INTEGER NOT NULL REFERENCES t_device(device_id) ON DELETE CASCADE,
+    ts TIMESTAMP WITH TIME ZONE NOT NULL,
+    cpu_percent DOUBLE PRECISION,
+    mem_percent DOUBLE PRECISION,
+    mem_used_mb DOUBLE PRECISION,
+    gpu_util DOUBLE PRECISION,
+    gpu_mem_percent DOUBLE PRECISION,
+    PRIMARY KEY (device_id, ts)
+);
+
+COMMENT ON TABLE t_device_metric IS '设备原始指标采样，保留 device_metric_raw_days 天';
+COMMENT ON COLUMN t_device_metric.ts IS '服务端接收时间';
+COMMENT ON COLUMN t_device_metric.cpu_percent IS 'CPU 使用率 %';
+COMMENT ON COLUMN t_device_metric.mem_percent IS '内存使用率 %';
+COMMENT ON COLUMN t_device_metric.mem_used_mb IS '已用内存 MiB';
+COMMENT ON COLUMN t_device_metric.gpu_util IS 'GPU 使用率 %（多卡取最大）';
+COMMENT ON COLUMN t_device_metric.gpu_mem_percent IS 'GPU 显存使用率 %（多卡取最大）';
+
+CREATE TABLE IF NOT EXISTS t_device_metric_rollup (
+    device_id INTEGER NOT NULL REFERENCES t_device(device_id) ON DELETE CASCADE,
+    step SMALLINT NOT NULL,
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    samples INTEGER NOT NULL,
+    cpu_avg DOUBLE PRECISION,
+    cpu_max DOUBLE PRECISION,
+    mem_avg DOUBLE PRECISION,
+    mem_max DOUBLE PRECISION,
+    mem_used_avg DOUBLE PRECISION,
+    gpu_util_avg DOUBLE PRECISION,
+    gpu_util_max DOUBLE PRECISION,
+    gpu_mem_avg DOUBLE PRECISION,
+    gpu_mem_max DOUBLE PRECISION,
+    PRIMARY KEY (device_id, step, bucket)
+);
+
+COMMENT ON TABLE t_device_metric_rollup IS '设备指标降采样（step=60 保留 device_metric_1m_days 天，step=3600 保留 device_metric_1h_days 天）';
+COMMENT ON COLUMN t_device_metric_rollup.step IS '聚合粒度（秒）';
+COMMENT ON COLUMN t_device_metric_rollup.bucket IS '时间桶起点（UTC 对齐）';
+COMMENT ON COLUMN t_device_metric_rollup.samples IS '桶内原始采样数';
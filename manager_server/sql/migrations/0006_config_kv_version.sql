@@ -0,0 +1,6 @@
+-- 配置版本号：每次写入取序列下一个值，max(version) 即整表版本（见 app/config_store.py）
+CREATE SEQUENCE IF NOT EXISTS config_kv_version_seq;
+
+ALTER TABLE config_kv ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('config_kv_version_seq');
+
+COMMENT ON COLUMN config_kv.version IS '写入版本号（单调递增），客户端据此长轮询配置变更';
@@ -0,0 +1,36 @@
+-- migrate: no-transaction
+-- 报警表复合/部分索引，与 app/crud.py 的查询形状一一对应（tools/explain_check.py 校验执行计划）
+-- CONCURRENTLY 建索引不锁写入，报警上报不中断；不能放在事务中执行，故逐条提交
+
+-- 不带处理状态条件的时间范围：stats_today_hourly、今日报警、导出（create_alarm_info.sql 已建，此处补齐 create_all 建的库）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alarm_time ON t_alarm_info (alarm_time);
+
+-- 报警列表默认条件（排除 auto_ignore）按时间倒序分页：query_alarm_rows_filtered / count_alarms_filtered
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alarm_active_time ON t_alarm_info (alarm_time)
+    WHERE process_status <> 'auto_ignore';
+
+-- 指定处理状态按时间倒序：by-process-status 及列表 process_status 过滤
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alarm_status_time ON t_alarm_info (process_status, alarm_time);
+
+-- 按用户（请求头 user_code）+ 处理状态按时间倒序
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alarm_user_status_time ON t_alarm_info (user_code, process_status, alarm_time);
+
+-- 按用户、未指定处理状态（排除 auto_ignore）按时间倒序
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alarm_user_active_time ON t_alarm_info (user_code, alarm_time)
+    WHERE process_status <> 'auto_ignore';
+
+-- 按报警类型（排除 auto_ignore）按时间倒序
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alarm_type_active_time ON t_alarm_info (alarm_type, alarm_time)
+    WHERE process_status <> 'auto_ignore';
+
+-- need_alarm：近 ignore_days 天已忽略报警的哈希与坐标，仅扫描索引（index-only scan）即可比对
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alarm_ignored_time ON t_alarm_info (alarm_time)
+    INCLUDE (image_hash, latitude, longitude)
+    WHERE process_status = 'ignore';
+
+-- 以下单列索引已是上面复合索引的前缀，删除以减少每次插入的索引维护
+-- （user_code 外键级联更新由 idx_alarm_user_status_time 支撑）
+DROP INDEX CONCURRENTLY IF EXISTS idx_alarm_process_status;
+DROP INDEX CONCURRENTLY IF EXISTS idx_alarm_user_code;
+
+-- get_device_by_code 由 device_code 的 UNIQUE 约束索引（t_device_device_code_key）支撑，无需新增
@@ -0,0 +1,2 @@
+-- 三元组（trigram）扩展，支撑报警地址/处理意见的模糊搜索索引（PostgreSQL 13 起数据库属主即可创建）
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
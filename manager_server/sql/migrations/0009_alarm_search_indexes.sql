@@ -0,0 +1,11 @@
+-- migrate: no-transaction
+-- 报警搜索（GET /api/v1/alarms/search）的 trigram GIN 索引，ILIKE '%关键词%' 可走索引
+-- 表达式须与 app/crud.py 中 ALARM_ADDRESS_TEXT / ALARM_NOTES_TEXT 完全一致，否则规划器不会使用
+
+-- 地址：详细地址 + 简单地址（按街道名搜索）
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alarm_address_trgm ON t_alarm_info
+    USING gin ((coalesce(address, '') || ' ' || coalesce(simple_address, '')) gin_trgm_ops);
+
+-- 处理记录：处理意见 + 处理结果反馈
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alarm_notes_trgm ON t_alarm_info
+    USING gin ((coalesce(process_opinion, '') || ' ' || coalesce(process_feedback, '')) gin_trgm_ops);
@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- 热存储（alarms/ 下）图片路径部分索引，归档后的行（cold/、packs/）自动移出索引
+-- list_archive_candidates 按 image_url 键集分页、逐组判断 max(alarm_time)，每批只扫描本批之后的热行，
+-- 避免每批对全表 GROUP BY；repoint_alarm_images 按 image_url 定位引用同一图片的报警
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alarm_hot_image ON t_alarm_info (image_url, alarm_time)
+    WHERE image_url LIKE 'alarms/%';
@@ -0,0 +1,4 @@
+-- 路线文件按内容寻址存储（app/storage.py），相同内容的文件落在同一路径并按引用计数共享，
+-- 多条路线可以引用同一个文件，去掉 route_file_path 的唯一约束（建表时的 UNIQUE 及唯一索引）
+ALTER TABLE t_route DROP CONSTRAINT IF EXISTS t_route_route_file_path_key;
+DROP INDEX IF EXISTS idx_route_file_path;
@@ -2,6 +2,7 @@
 setlocal
 set ROOT=%CD%
 set PORT=8001
+python run_server.py migrate
 uvicorn app.main:app --reload --host 0.0.0.0 --port %PORT% --app-dir "%ROOT%"
 endlocal
 pause
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Backfill derived columns on existing alarms:
+  - routes:  route attribution (route_id / route_offset_m / route_distance_m)
+             using the parsed route indexes (app/route_index.py)
+  - geohash: geohash of the alarm location (app/geohash.py), for map clustering
+
+Usage (from manager_server/):
+    python tools/backfill_alarms.py [--only routes|geohash] [--all] [--dry-run] [--batch-size 1000]
+
+By default only alarms without a route are matched; --all re-matches every
+alarm, e.g. after a route file was replaced. Each batch commits on its own, so
+the script can be interrupted and re-run.
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select  # noqa: E402
+
+from app import crud, geohash, models, route_index, route_matching  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+
+logger = logging.getLogger("backfill_alarms")
+
+
+def backfill_routes(batch_size: int, rematch_all: bool, dry_run: bool) -> dict:
+    stats = {"rows": 0, "matched": 0, "unmatched": 0}
+    db = SessionLocal()
+    try:
+        routes = db.execute(
+            select(models.Route.route_id, models.Route.route_file_path, models.Route.route_format)
+        ).all()
+        existing = set()
+        for route_id, path, fmt in routes:
+            existing.add(route_id)
+            meta = route_index.read_meta(route_id)
+            if not dry_run and path and (not meta or meta.get("source") != path):
+                # routes uploaded before indexing existed
+                route_index.build(route_id, path, fmt)
+        for rid in route_index.indexed_route_ids():
+            if rid not in existing and not dry_run:
+                # index left behind by a route deleted outside the API
+                route_index.remove(rid)
+        last_id = 0
+        while True:
+            rows = crud.list_alarm_locations(db, last_id, batch_size, unmatched_only=not rematch_all)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for alarm_id, lon, lat in rows:
+                stats["rows"] += 1
+                m = route_matching.match(lon, lat)
+                if m is None:
+                    stats["unmatched"] += 1
+                    if not rematch_all:
+                        continue
+                    updates.append({"alarm_id": alarm_id, "route_id": None, "route_offset_m": None, "route_distance_m": None})
+                    continue
+                stats["matched"] += 1
+                updates.append({
+                    "alarm_id": alarm_id,
+                    "route_id": m.route_id,
+                    "route_offset_m": m.offset_m,
+                    "route_distance_m": m.distance_m,
+                })
+            if dry_run:
+                db.rollback()
+            else:
+                crud.set_alarm_route_matches(db, updates)
+            logger.info("routes: up to id=%s %s", last_id, stats)
+    finally:
+        db.close()
+    return stats
+
+
+def backfill_geohash(batch_size: int, dry_run: bool) -> dict:
+    stats = {"rows": 0}
+    db = SessionLocal()
+    try:
+        while True:
+            rows = crud.list_alarms_without_geohash(db, batch_size)
+            if not rows:
+                break
+            stats["rows"] += len(rows)
+            if dry_run:
+                # nothing gets written, so the same rows would come back
+                stats["rows"] = db.execute(
+                    select(func.count()).select_from(models.AlarmInfo).where(models.AlarmInfo.geohash.is_(None))
+                ).scalar()
+                break
+            crud.set_alarm_geohashes(
+                db, [{"alarm_id": alarm_id, "geohash": geohash.encode(lat, lon)} for alarm_id, lon, lat in rows]
+            )
+            logger.info("geohash: up to id=%s %s", rows[-1][0], stats)
+    finally:
+        db.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", choices=["routes", "geohash"], help="run a single backfill step")
+    parser.add_argument("--all", action="store_true", help="re-match alarms that already have a route")
+    parser.add_argument("--dry-run", action="store_true", help="match but do not write")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    batch_size = max(1, args.batch_size)
+    g = backfill_geohash(batch_size, args.dry_run) if args.only in (None, "geohash") else None
+    r = backfill_routes(batch_size, args.all, args.dry_run) if args.only in (None, "routes") else None
+    logger.info("done: geohash=%s routes=%s dry_run=%s", g, r, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
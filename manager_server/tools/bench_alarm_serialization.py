@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Compare the two ways of turning a page of alarms into the GET /api/v1/alarms body:
+
+    orm      AlarmInfo instances -> AlarmRead.model_validate -> jsonable_encoder + json
+             (the previous list path)
+    rows     column mappings -> serialize.alarm_item -> orjson (app/serialize.py)
+
+Usage (from manager_server/):
+    python tools/bench_alarm_serialization.py [--sizes 50,200,1000] [--repeat 50] [--json]
+
+Rows are synthetic, so no PostgreSQL is needed; what is measured is the work after the
+query returns (ORM identity-map loading is not included, which favours the orm path).
+Both paths must produce the same JSON document, which is checked before timing. Also
+prints the body size and its gzip size (app/compression.py level).
+"""
+import argparse
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from app import models, schemas, serialize  # noqa: E402
+from app.crud import ALARM_READ_COLUMNS  # noqa: E402
+
+GZIP_LEVEL = 5
+
+
+def make_rows(n: int) -> list:
+    tz = timezone(timedelta(hours=8))
+    t0 = datetime(2024, 5, 1, 8, 0, tzinfo=tz)
+    rows = []
+    for i in range(n):
+        rows.append({
+            "alarm_id": 100000 + i,
+            "alarm_time": t0 + timedelta(seconds=37 * i),
+            "longitude": Decimal("113.9") + Decimal(i) / Decimal(10 ** 5),
+            "latitude": Decimal("22.5") + Decimal(i) / Decimal(10 ** 5),
+            "alarm_type": ("smoke", "fire", "intrusion")[i % 3],
+            "confidence": 0.5 + (i % 50) / 100,
+            "process_opinion": None if i % 4 else "已派单处理",
+            "process_opinion_person": None if i % 4 else 7,
+            "process_status": ("unprocessed", "processing", "closed", "ignore")[i % 4],
+            "process_feedback": None,
+            "process_feedback_person": None,
+            "image_url": f"alarms/2024/05/01/{100000 + i}.jpg",
+            "image_hash": f"{i:016x}",
+            "device_ip": f"10.0.{i % 250}.{i % 200 + 1}",
+            "user_code": "U0001",
+            "address": "广东省深圳市南山区科技园南区某某路 88 号",
+            "simple_address": "南山区科技园",
+            "route_id": i % 12 or None,
+            "route_offset_m": 12.5 * i,
+            "route_distance_m": 3.25,
+            "create_time": t0 + timedelta(seconds=37 * i + 1),
+            "update_time": t0 + timedelta(seconds=37 * i + 2),
+        })
+    return rows
+
+
+def orm_path(instances: list, total: int) -> bytes:
+    content = {"items": [schemas.AlarmRead.model_validate(it) for it in instances], "total": total}
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def rows_path(rows: list, total: int) -> bytes:
+    return serialize.dumps({"items": [serialize.alarm_item(r) for r in rows], "total": total})
+
+
+def _time(fn, arg, total, repeat) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg, total)
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples)
+
+
+def measure(size: int, repeat: int) -> dict:
+    rows = make_rows(size)
+    instances = [models.AlarmInfo(**r) for r in rows]
+    # the projected query carries only the AlarmRead columns
+    projected = [{c.name: r[c.name] for c in ALARM_READ_COLUMNS} for r in rows]
+    old, new = orm_path(instances, size), rows_path(projected, size)
+    if json.loads(old) != json.loads(new):
+        raise SystemExit(f"outputs differ at {size} rows")
+    orm_s = _time(orm_path, instances, size, repeat)
+    rows_s = _time(rows_path, projected, size, repeat)
+    return {
+        "rows": size,
+        "orm_ms": round(orm_s * 1000, 3),
+        "rows_ms": round(rows_s * 1000, 3),
+        "speedup": round(orm_s / rows_s, 1) if rows_s else None,
+        "body_bytes": len(new),
+        "gzip_bytes": len(gzip.compress(new, GZIP_LEVEL)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="50,200,1000")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="print one JSON object (for tracking over time)")
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    results = [measure(n, max(1, args.repeat)) for n in sizes]
+    if args.json:
+        print(json.dumps({"orjson": serialize.orjson is not None, "results": results}))
+        return
+    print(f"orjson: {'yes' if serialize.orjson is not None else 'no (json fallback)'}, median of {args.repeat}")
+    print(f"{'rows':>6} {'orm ms':>9} {'rows ms':>9} {'speedup':>8} {'body KB':>9} {'gzip KB':>9}")
+    for r in results:
+        print(
+            f"{r['rows']:>6} {r['orm_ms']:>9.2f} {r['rows_ms']:>9.2f} {r['speedup']:>7}x "
+            f"{r['body_bytes'] / 1024:>9.1f} {r['gzip_bytes'] / 1024:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
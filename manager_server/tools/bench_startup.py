@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Measure cold start of the server: time to import app.main (everything the process
+does before it can serve) in fresh interpreters, plus the slowest imports.
+
+Usage (from manager_server/):
+    python tools/bench_startup.py [--runs 5] [--top 15] [--json]
+
+Import must stay free of database and network access (schema changes run in the
+separate migrate step, background tasks start with the app), so this needs no
+running PostgreSQL. Compare the median between commits; --top lists the modules
+with the largest cumulative import time (python -X importtime).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+
+
+def _run(args, env=None):
+    return subprocess.run(
+        [sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def measure(runs: int) -> dict:
+    imports, wall = [], []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        out = _run(["-c", PROBE])
+        wall.append(time.perf_counter() - t0)
+        imports.append(float(out.stdout.strip().splitlines()[-1]))
+    return {
+        "runs": runs,
+        "import_median_s": round(statistics.median(imports), 4),
+        "import_min_s": round(min(imports), 4),
+        "process_median_s": round(statistics.median(wall), 4),
+    }
+
+
+def slowest_imports(top: int) -> list:
+    """(cumulative seconds, module) of the slowest imports below app.main."""
+    err = _run(["-X", "importtime", "-c", "import app.main"]).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        try:
+            rows.append((int(cumulative.strip()) / 1e6, name.rstrip()))
+        except ValueError:
+            continue  # header line
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list (0 = none)")
+    parser.add_argument("--json", action="store_true", help="print one JSON object (for tracking over time)")
+    args = parser.parse_args()
+
+    result = measure(max(1, args.runs))
+    slow = slowest_imports(args.top) if args.top > 0 else []
+    if args.json:
+        result["slowest"] = [{"module": m.strip(), "s": round(s, 4)} for s, m in slow]
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    print(
+        f"import app.main: median {result['import_median_s'] * 1000:.0f} ms, "
+        f"min {result['import_min_s'] * 1000:.0f} ms over {result['runs']} runs "
+        f"(process {result['process_median_s'] * 1000:.0f} ms)"
+    )
+    if slow:
+        print("slowest imports (cumulative):")
+        for s, m in slow:
+            print(f"  {s * 1000:8.1f} ms  {m}")
+
+
+if __name__ == "__main__":
+    main()
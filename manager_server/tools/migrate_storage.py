@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Move legacy flat uploads (alarms/<uuid>.jpg, routes/<uuid>.gps) into the
+content-addressed, sharded layout and rewrite image_url / route_file_path.
+
+Usage (from manager_server/):
+    python tools/migrate_storage.py [--dry-run] [--batch-size 500]
+
+Safe to re-run: rows already pointing at sharded paths (or archive packs) are skipped, and legacy
+files are only deleted after the rows referencing them have been committed.
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, update  # noqa: E402
+
+from app import models, storage, thumbs  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+
+logger = logging.getLogger("migrate_storage")
+
+
+def _remove_legacy(paths):
+    for p in paths:
+        try:
+            if os.path.exists(p):
+                os.remove(p)
+        except Exception:
+            logger.warning("could not remove legacy file %s", p)
+        thumbs.remove_thumbnails(p)
+
+
+def migrate_alarms(batch_size: int, dry_run: bool) -> dict:
+    stats = {"rows": 0, "moved": 0, "missing": 0}
+    last_id = 0
+    db = SessionLocal()
+    try:
+        while True:
+            stmt = (
+                select(models.AlarmInfo.alarm_id, models.AlarmInfo.image_url)
+                .where(models.AlarmInfo.alarm_id > last_id)
+                .order_by(models.AlarmInfo.alarm_id.asc())
+                .limit(batch_size)
+            )
+            rows = db.execute(stmt).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            legacy = set()
+            for alarm_id, image_url in rows:
+                # sharded or archived into a pack (app/image_archiver.py): nothing to migrate
+                if not image_url or storage.is_sharded(image_url) or storage.is_packed(image_url):
+                    continue
+                stats["rows"] += 1
+                if dry_run:
+                    continue
+                new_rel = storage.adopt_file(db, image_url, "alarms")
+                if new_rel is None:
+                    stats["missing"] += 1
+                    logger.warning("alarm %s: image missing: %s", alarm_id, image_url)
+                    continue
+                db.execute(
+                    update(models.AlarmInfo)
+                    .where(models.AlarmInfo.alarm_id == alarm_id)
+                    .values(image_url=new_rel)
+                )
+                legacy.add(storage.abs_path(image_url))
+                stats["moved"] += 1
+            db.commit()
+            _remove_legacy(legacy)
+            logger.info("alarms: up to id=%s %s", last_id, stats)
+    finally:
+        db.close()
+    return stats
+
+
+def migrate_routes(dry_run: bool) -> dict:
+    stats = {"rows": 0, "moved": 0, "missing": 0}
+    db = SessionLocal()
+    try:
+        rows = db.execute(select(models.Route.route_id, models.Route.route_file_path)).all()
+        for route_id, path in rows:
+            if not path or storage.is_sharded(path):
+                continue
+            stats["rows"] += 1
+            if dry_run:
+                continue
+            # routes with identical files end up sharing one path; adopt_file takes a reference each
+            new_rel = storage.adopt_file(db, path, "routes")
+            if new_rel is None:
+                stats["missing"] += 1
+                logger.warning("route %s: file missing: %s", route_id, path)
+                continue
+            db.execute(
+                update(models.Route)
+                .where(models.Route.route_id == route_id)
+                .values(route_file_path=new_rel)
+            )
+            db.commit()
+            _remove_legacy([storage.abs_path(path)])
+            stats["moved"] += 1
+    finally:
+        db.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only count rows that would be migrated")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    a = migrate_alarms(max(1, args.batch_size), args.dry_run)
+    r = migrate_routes(args.dry_run)
+    logger.info("done: alarms=%s routes=%s dry_run=%s", a, r, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ from frame_analyzer import frame_analyzer
 from alarm_handler import alarm_handler
 from config_manager import load_config
 from logger_setup import get_logger
-from manager_client import run_config_listener, update_device_by_code_startup
+from manager_client import run_config_listener, update_device_by_code_startup, start_control_channel
 import atexit
 from gps_ser import start_gps, stop_gps
 
@@ -32,12 +32,14 @@ def main():
     rtsp_url = cfg.get("rtsp_url", "rtsp://your-rtsp-url")
     fps = cfg.get("fps", 2)
     
-    # 启动前，向 manager_server 上报设备信息（device_code=本机MAC）
-    try:
-        update_device_by_code_startup()
-        logger.info("已尝试向 manager_server 上报设备信息（按 device_code=MAC）")
-    except Exception:
-        logger.warning("上报设备信息失败，继续启动其他模块")
+    # 优先使用与 manager_server 的长连接控制通道（心跳、指标增量、配置下发）；
+    # 未安装 websockets 或关闭 use_control_channel 时回退为定时 HTTP 全量上报；
+    # 通道连续连接失败时由控制通道线程自行回退 HTTP 上报（control_channel_fallback_after）
+    channel_started = False
+    if cfg.get("use_control_channel", True):
+        channel_started = start_control_channel(stop_event)
+        if channel_started:
+            logger.info("已启动 manager_server 控制通道（device_code=MAC）")
 
     def device_report_loop():
         while not stop_event.is_set():
@@ -50,11 +52,18 @@ def main():
             if stop_event.wait(report_interval):
                 break
 
-    try:
-        device_report_thread = threading.Thread(target=device_report_loop, daemon=True)
-        device_report_thread.start()
-    except Exception:
-        pass
+    if not channel_started:
+        # 启动前，向 manager_server 上报设备信息（device_code=本机MAC）
+        try:
+            update_device_by_code_startup()
+            logger.info("已尝试向 manager_server 上报设备信息（按 device_code=MAC）")
+        except Exception:
+            logger.warning("上报设备信息失败，继续启动其他模块")
+        try:
+            device_report_thread = threading.Thread(target=device_report_loop, daemon=True)
+            device_report_thread.start()
+        except Exception:
+            pass
 
     # 启动RTSP流处理线程
     rtsp_thread = threading.Thread( 
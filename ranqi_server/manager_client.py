@@ -6,10 +6,21 @@ from typing import Optional, Dict, Any
 from config_manager import load_config
 from system_info import get_system_info
 import json
+import threading
+import time
 from pathlib import Path
 from net_utils import get_local_ip
+from logger_setup import get_logger
 import uuid
 
+logger = get_logger(__name__)
+
+# Optional: persistent control channel to manager_server (pip install "websockets>=12")
+try:
+    from websockets.sync.client import connect as ws_connect  # type: ignore
+except Exception:
+    ws_connect = None  # type: ignore
+
 # Lightweight REST listener to update local config
 try:
     from fastapi import FastAPI, HTTPException
@@ -129,6 +140,148 @@ def update_device_by_code_startup(default_base: str = "http://127.0.0.1:8001") -
         time.sleep(1)
 
 
+# ---------------- Control Channel (WebSocket) ----------------
+def _channel_url(base_url: str) -> str:
+    base = base_url.rstrip("/")
+    if base.startswith("https://"):
+        base = "wss://" + base[len("https://"):]
+    elif base.startswith("http://"):
+        base = "ws://" + base[len("http://"):]
+    return f"{base}/api/v1/devices/channel"
+
+
+def _dict_delta(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Keys of new whose values differ from old (nested dicts diffed recursively)."""
+    delta: Dict[str, Any] = {}
+    for k, v in new.items():
+        ov = old.get(k)
+        if isinstance(v, dict) and isinstance(ov, dict):
+            sub = _dict_delta(ov, v)
+            if sub:
+                delta[k] = sub
+        elif v != ov:
+            delta[k] = v
+    return delta
+
+
+def _handle_channel_message(ws, msg: Dict[str, Any]) -> None:
+    if msg.get("type") == "config" and isinstance(msg.get("config"), dict):
+        ack: Dict[str, Any] = {"type": "ack", "id": msg.get("id")}
+        try:
+            current = {}
+            try:
+                current = load_config()
+            except Exception:
+                current = {}
+            current = _deep_merge_dicts(current, msg["config"])
+            _save_config_to_file(current)
+            ack.update(ok=True, config=current)
+            logger.info("Config updated from manager control channel")
+        except Exception as e:
+            ack.update(ok=False, error=str(e))
+        ws.send(json.dumps(ack, ensure_ascii=False))
+
+
+def _run_channel_session(
+    url: str, device_code: str, stop_event: threading.Event, metrics_interval: float, on_connected=None
+) -> None:
+    with ws_connect(url, open_timeout=10, close_timeout=2) as ws:
+        info = get_system_info() or {}
+        try:
+            cfg = load_config() or {}
+        except Exception:
+            cfg = {}
+        ws.send(json.dumps({
+            "type": "hello",
+            "device_code": device_code,
+            "device_ip": get_local_ip(),
+            "device_config": cfg,
+            "device_info": info,
+        }, ensure_ascii=False))
+        welcome = json.loads(ws.recv(timeout=10))
+        heartbeat = float(welcome.get("heartbeat_interval", 30))
+        logger.info("Manager control channel connected: %s", url)
+        if on_connected:
+            on_connected()
+        now = time.monotonic()
+        next_heartbeat = now + heartbeat
+        next_metrics = now + metrics_interval
+        while not stop_event.is_set():
+            wait = max(0.1, min(next_heartbeat, next_metrics) - time.monotonic())
+            try:
+                raw = ws.recv(timeout=min(wait, 1.0))
+            except TimeoutError:
+                raw = None
+            if raw:
+                msg = json.loads(raw)
+                if isinstance(msg, dict):
+                    _handle_channel_message(ws, msg)
+            now = time.monotonic()
+            if now >= next_metrics:
+                new_info = get_system_info() or {}
+                delta = _dict_delta(info, new_info)
+                info = new_info
+                next_metrics = now + metrics_interval
+                if delta:
+                    ws.send(json.dumps({"type": "metrics", "delta": delta}, ensure_ascii=False))
+                    next_heartbeat = now + heartbeat
+            if now >= next_heartbeat:
+                ws.send('{"type":"heartbeat"}')
+                next_heartbeat = now + heartbeat
+
+
+def run_control_channel(stop_event: threading.Event, default_base: str = "http://127.0.0.1:8001") -> None:
+    """Keep a control channel to manager_server open, reconnecting with backoff until stop_event.
+    After control_channel_fallback_after failed connects in a row the device reports itself over
+    HTTP (every update_device_info_time seconds) until the channel connects again.
+    """
+    device_code = _get_local_mac()
+    backoff = 1.0
+    failures = 0
+    next_report = 0.0
+    while not stop_event.is_set():
+        try:
+            cfg = load_config() or {}
+        except Exception:
+            cfg = {}
+        metrics_interval = float(cfg.get("metrics_interval", 60))
+        fallback_after = int(cfg.get("control_channel_fallback_after", 5))
+        base_url = get_manager_base_url(default=default_base)
+        url = _channel_url(base_url)
+        started = time.monotonic()
+        connected = []
+        try:
+            _run_channel_session(url, device_code, stop_event, metrics_interval, on_connected=lambda: connected.append(True))
+        except Exception as e:
+            logger.warning("Manager control channel dropped (%s); reconnecting in %.0fs", e, backoff)
+        if connected:
+            if 0 < fallback_after <= failures:
+                logger.info("Manager control channel restored; stopping HTTP self-report")
+            failures = 0
+        else:
+            failures += 1
+        if fallback_after > 0 and failures >= fallback_after and time.monotonic() >= next_report:
+            if failures == fallback_after:
+                logger.warning("Manager control channel failed %s times; falling back to HTTP self-report", failures)
+            if not update_device_by_code(base_url):
+                logger.warning("Failed to report device info over HTTP: base_url=%s", base_url)
+            next_report = time.monotonic() + float(cfg.get("update_device_info_time", 60))
+        if time.monotonic() - started > 60:
+            backoff = 1.0
+        if stop_event.wait(backoff):
+            break
+        backoff = min(backoff * 2, 60.0)
+
+
+def start_control_channel(stop_event: threading.Event) -> bool:
+    """Start run_control_channel in a daemon thread; False if the websockets package is missing."""
+    if ws_connect is None:
+        return False
+    t = threading.Thread(target=run_control_channel, args=(stop_event,), name="manager-channel", daemon=True)
+    t.start()
+    return True
+
+
 # ---------------- RESTful Config Listener ----------------
 _app: Optional["FastAPI"] = None
 